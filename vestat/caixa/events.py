@@ -7,58 +7,112 @@ Funções se comportam de acordo com o esperado pela aplicação
 """
 
 import logging
+from itertools import groupby
 
 from django.utils.safestring import mark_safe
 from django.core.urlresolvers import reverse
 
 from vestat.django_utils import format_currency, format_date
 from vestat.utils import daterange_inclusive
-from vestat.calendario import Event
-from models import PagamentoComCartao
-from views import ver_dia
+from vestat.calendario import Event, depends_on
+from models import Dia, Venda, Bandeira, PagamentoComCartao, ResumoDiario, ResumoDoDia
 
 logger = logging.getLogger("vestat")
 
+_formato_do_link = None
+"""
+Formato da URL da tela do caixa de um dia, com os campos `ano`, `mes`
+e `dia`. Montado na primeira chamada de `formato_do_link`.
+"""
+
+def formato_do_link():
+    """
+    Retorna o formato da URL da tela do caixa de um dia (ver
+    `_formato_do_link`), chamando o `reverse` uma vez só.
+    """
+
+    global _formato_do_link
+
+    if _formato_do_link is None:
+        # Os números precisam casar com as expressões da URL; depois
+        # são trocados pelos campos do formato. A view é passada pelo
+        # nome, pra não carregar as views do caixa junto com os eventos.
+        link = reverse("vestat.caixa.views.ver_dia", kwargs={"ano": "9999", "mes": "99", "dia": "99"})
+        link = link.replace("{", "{{").replace("}", "}}")
+        _formato_do_link = link.replace("9999/99/99", "{ano:04d}/{mes:02d}/{dia:02d}")
+
+    return _formato_do_link
+
+@depends_on(Dia, ResumoDiario)
 def dia_events(begin, end):
     """
     Eventos que linkam para a tela do caixa dos dias entre `begin` e `end`.
+
+    Os dias de trabalho já abertos mostram também o faturamento e o
+    número de vendas do dia. Os dias e seus resumos são lidos numa
+    consulta só; só os dias que ainda não têm `ResumoDiario` são
+    calculados à parte.
     """
 
-    for d in daterange_inclusive(begin, end):
-        kwargs = {
-            "ano": "{0:04d}".format(d.year),
-            "mes": "{0:02d}".format(d.month),
-            "dia": "{0:02d}".format(d.day),
-        }
+    formato = formato_do_link()
 
-        link = reverse(ver_dia, kwargs=kwargs)
-        nome = u'<a href="{link}">Caixa</a>'.format(link=link)
+    resumos = {}
+    faltando = {}
+    for dia in Dia.objects.filter(data__range=(begin, end)).select_related("resumodiario"):
+        try:
+            resumos[dia.data] = dia.resumodiario.resumo()
+        except ResumoDiario.DoesNotExist:
+            faltando[dia.id] = dia.data
 
-        yield Event(d, mark_safe(nome))
+    if faltando:
+        for id, resumo in Dia._calcular_resumos(faltando.keys()).items():
+            resumos[faltando[id]] = resumo
+        for data in faltando.values():
+            resumos.setdefault(data, ResumoDoDia())
 
+    for d in daterange_inclusive(begin, end):
+        link = formato.format(ano=d.year, mes=d.month, dia=d.day)
+        resumo = resumos.get(d)
+
+        if resumo is None:
+            nome = u'<a href="{link}">Caixa</a>'.format(link=link)
+            yield Event(d, mark_safe(nome))
+        else:
+            faturamento = format_currency(resumo.faturamento())
+            nome = u'<a href="{link}">Caixa</a>: R$ {faturamento}'.format(link=link,
+                                                                          faturamento=faturamento)
+            descricao = u"Faturamento: R$ {0}, {1} vendas".format(faturamento, resumo.vendas)
+            yield Event(d, mark_safe(nome), descricao)
+
+@depends_on(PagamentoComCartao, Bandeira, Venda, Dia)
 def dias_de_deposito_events(begin, end):
     """
     Eventos que mostram a quantia que se espera que as bandeiras
     depositem referente a pagamentos com cartão.
-    """
-
-    pagamentos = PagamentoComCartao.objects.filter(data_do_deposito__range=(begin, end))
 
-    dias = {}
-    for p in pagamentos:
-        dias.setdefault(p.data_do_deposito, []).append(p)
+    Os pagamentos são lidos numa consulta só, junto com a bandeira e a
+    data da venda; os totais e as descrições são montados a partir
+    dessas linhas, sem voltar ao banco de dados.
+    """
 
-    for data, pagamentos in dias.items():
+    pagamentos = PagamentoComCartao.objects \
+                    .filter(data_do_deposito__range=(begin, end)) \
+                    .select_related("bandeira", "venda__dia") \
+                    .order_by("data_do_deposito", "venda__dia__data", "id")
 
-        valor_total = sum((p.valor - p.taxa) for p in pagamentos)
-        nome = u"Entrada dos cartões: R$ {0}".format(format_currency(valor_total))
+    for data, pagamentos in groupby(pagamentos, key=lambda p: p.data_do_deposito):
+        valor_total = 0
+        linhas = []
 
-        descricao = "\n".join(
-            u"R$ ({pgto} - {taxa}), {bandeira}, {data}".format(
+        for p in pagamentos:
+            taxa = p.taxa
+            valor_total += p.valor - taxa
+            linhas.append(u"R$ ({pgto} - {taxa}), {bandeira}, {data}".format(
                 bandeira = p.bandeira,
                 pgto = format_currency(p.valor),
-                taxa = format_currency(p.taxa),
-                data = format_date(p.venda.dia.data))
-            for p in pagamentos)
+                taxa = format_currency(taxa),
+                data = format_date(p.venda.dia.data)))
+
+        nome = u"Entrada dos cartões: R$ {0}".format(format_currency(valor_total))
 
-        yield Event(data, nome, descricao)
+        yield Event(data, nome, "\n".join(linhas))
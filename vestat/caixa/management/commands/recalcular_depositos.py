@@ -0,0 +1,92 @@
+# -*- encoding: utf-8 -*-
+"""
+Comando 'recalcular_depositos', recalcula a data de depósito dos
+pagamentos com cartão -- necessário depois de mudar os feriados ou o
+prazo de depósito de uma bandeira.
+"""
+import time
+from collections import defaultdict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from vestat.caixa.models import PagamentoComCartao
+from vestat.versao import nova_versao_dos_dados
+
+TAMANHO_DO_LOTE = 500
+"""
+Número de pagamentos lidos e gravados por vez (e por transação).
+"""
+
+
+def recalcular_depositos(pagamentos, tamanho_do_lote=TAMANHO_DO_LOTE):
+    """
+    Recalcula a data de depósito dos pagamentos em `pagamentos`, em
+    lotes de `tamanho_do_lote` pagamentos.
+
+    Cada lote é lido com uma consulta (já com a venda, o dia e a
+    bandeira) e gravado numa transação, com um UPDATE pra cada data de
+    depósito diferente; pagamentos cuja data não mudou não são gravados.
+
+    Se algum pagamento for alterado, troca a versão dos dados (ver
+    `vestat.versao`), descartando os relatórios e os eventos do
+    calendário em cache.
+
+    Retorna uma tupla `(lidos, alterados)` com o número de pagamentos.
+
+    Argumentos:
+
+    - pagamentos: um QuerySet de objetos `PagamentoComCartao`.
+    """
+
+    pagamentos = pagamentos.select_related("venda__dia", "bandeira").order_by("pk")
+    lidos = alterados = 0
+    ultimo_pk = 0
+
+    while True:
+        lote = list(pagamentos.filter(pk__gt=ultimo_pk)[:tamanho_do_lote])
+        if not lote:
+            break
+
+        por_data = defaultdict(list)
+        for pagamento in lote:
+            data = pagamento._data_do_deposito()
+            if data != pagamento.data_do_deposito:
+                por_data[data].append(pagamento.pk)
+
+        with transaction.commit_on_success():
+            for data, pks in por_data.items():
+                PagamentoComCartao.objects.filter(pk__in=pks).update(data_do_deposito=data)
+
+        lidos += len(lote)
+        alterados += sum(len(pks) for pks in por_data.values())
+        ultimo_pk = lote[-1].pk
+
+    # O UPDATE não dispara os sinais que invalidam os relatórios e os
+    # eventos do calendário em cache.
+    if alterados:
+        nova_versao_dos_dados()
+
+    return lidos, alterados
+
+
+class Command(BaseCommand):
+    help = u"Recalcula a data de depósito dos pagamentos com cartão."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--bandeira", dest="bandeira", type="int",
+                    help=u"Só recalcula os pagamentos da bandeira com esse id."),
+    )
+
+    def handle(self, *args, **options):
+        pagamentos = PagamentoComCartao.objects.all()
+        if options.get("bandeira"):
+            pagamentos = pagamentos.filter(bandeira=options["bandeira"])
+
+        inicio = time.time()
+        lidos, alterados = recalcular_depositos(pagamentos)
+        duracao = max(time.time() - inicio, 1e-6)
+
+        self.stdout.write(u"{0} pagamentos lidos, {1} alterados em {2:.1f}s ({3:.0f} pagamentos/s)\n"
+                          .format(lidos, alterados, duracao, lidos / duracao))
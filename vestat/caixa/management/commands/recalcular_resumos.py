@@ -0,0 +1,22 @@
+# -*- encoding: utf-8 -*-
+"""
+Comando 'recalcular_resumos', reconstrói a tabela de resumos diários
+(`ResumoDiario`) a partir das vendas, despesas etc.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from vestat.caixa.models import Dia, ResumoDiario
+
+
+class Command(BaseCommand):
+    help = u"Recalcula os resumos diários de todos os dias, um ano de cada vez."
+
+    def handle(self, *args, **options):
+        for ano in Dia.objects.dates("data", "year"):
+            dias = Dia.objects.filter(data__year=ano.year)
+
+            with transaction.commit_on_success():
+                ResumoDiario.recalcular(dias)
+
+            self.stdout.write(u"{0}: {1} dias recalculados\n".format(ano.year, dias.count()))
@@ -1,6 +1,7 @@
 # -*- encoding: utf-8 -*-
 from vestat.contabil.models import Registro
 from vestat.caixa import NOME_DO_REGISTRO
+from vestat.caixa.models import ResumoDiario
 
 from django.contrib.messages.api import info
 
@@ -17,3 +18,30 @@ class AutocreateRegistroMiddleware:
             r = Registro(nome=NOME_DO_REGISTRO)
             r.save()
             info(request, "Registro de contabilidade criado")
+
+
+class AdiarResumosMiddleware:
+    """
+    Recalcula os resumos diários alterados por uma requisição uma vez
+    só, no fim dela (ver `ResumoDiario.adiar`), em vez de a cada venda,
+    pagamento etc. salvo.
+
+    """
+
+    def process_request(self, request):
+        request._adiar_resumos = ResumoDiario.adiar()
+        request._adiar_resumos.__enter__()
+
+    def process_exception(self, request, exception):
+        adiar = request.__dict__.pop("_adiar_resumos", None)
+        if adiar is not None:
+            try:
+                adiar.__exit__(type(exception), exception, None)
+            except type(exception):
+                pass
+
+    def process_response(self, request, response):
+        adiar = request.__dict__.pop("_adiar_resumos", None)
+        if adiar is not None:
+            adiar.__exit__(None, None, None)
+        return response
@@ -4,20 +4,25 @@ from decimal import Decimal
 import datetime
 import operator
 import logging
+import threading
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 
 from django.core import serializers
 from django.core.urlresolvers import reverse_lazy
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Sum, Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.db.utils import DatabaseError
 from django.db.models.query_utils import Q
 from django.template.defaultfilters import slugify
 from durationfield.db.models.fields.duration import DurationField #@UnresolvedImport
 
 from vestat.caixa import NOME_DO_REGISTRO
-from vestat.feriados import eh_dia_util, eh_feriado
+from vestat.feriados import eh_feriado, somar_dias_uteis
 from vestat.config import config_pages, Link
 from vestat.config.models import VestatConfiguration
 from vestat.contabil.models import Registro, Transacao, Lancamento
@@ -76,6 +81,97 @@ def secs_to_time_str(valor):
     return "%02d:%02d:%02d" % (horas, minutos, segundos)
 
 
+class ResumoDoDia(object):
+    """
+    Totais de um dia de trabalho (ou de um conjunto de dias), calculados
+    de uma vez só.
+
+    Os atributos guardam as somas "cruas" tiradas do banco de dados; os
+    métodos derivam delas os valores exibidos nos relatórios, seguindo as
+    mesmas regras dos métodos correspondentes de `Dia`.
+
+    Resumos podem ser somados (``resumo1 + resumo2``), o que permite
+    consolidar os totais de vários dias sem voltar ao banco de dados.
+    """
+
+    CAMPOS = (
+        "dinheiro",
+        "cheque",
+        "cartao_debito",
+        "cartao_credito",
+        "gorjeta_bruta",
+        "num_pessoas",
+        "permanencia",
+        "vendas",
+        "vendas_abertas",
+        "despesas_de_caixa",
+        "debitos_bancarios",
+        "creditos_bancarios",
+        "ajustes",
+    )
+    """
+    Nomes dos atributos somados pelo resumo.
+
+    - dinheiro, cheque: pagamentos das vendas fechadas.
+    - cartao_debito, cartao_credito: pagamentos com cartão das vendas
+      fechadas, por categoria da bandeira.
+    - gorjeta_bruta: soma dos 10% das vendas fechadas, sem aplicar o
+      `FATOR_CONSIDERADO_10P`.
+    - num_pessoas, permanencia: somas sobre as vendas fechadas (a
+      permanência em segundos).
+    - vendas, vendas_abertas: número de vendas fechadas e abertas.
+    - despesas_de_caixa, debitos_bancarios, creditos_bancarios, ajustes:
+      somas das despesas de caixa, das movimentações bancárias negativas
+      e positivas, e dos ajustes de caixa.
+    """
+
+    def __init__(self, **totais):
+        for campo in self.CAMPOS:
+            setattr(self, campo, totais.pop(campo, 0))
+
+        if totais:
+            raise TypeError(u"Campos desconhecidos: {0}".format(u", ".join(totais)))
+
+    def __add__(self, other):
+        return ResumoDoDia(**dict((campo, getattr(self, campo) + getattr(other, campo))
+                                  for campo in self.CAMPOS))
+
+    def __repr__(self):
+        return "<ResumoDoDia: {0}>".format(", ".join("{0}={1}".format(campo, getattr(self, campo))
+                                                      for campo in self.CAMPOS))
+
+    def faturamento_cartao(self):
+        return self.cartao_credito + self.cartao_debito
+
+    def faturamento(self):
+        return self.dinheiro + self.cheque + self.faturamento_cartao()
+
+    def caixa(self):
+        return self.dinheiro + self.cheque
+
+    def gorjeta(self):
+        return self.gorjeta_bruta * FATOR_CONSIDERADO_10P if self.gorjeta_bruta else 0
+
+    def movimentacoes_bancarias(self):
+        return self.debitos_bancarios + self.creditos_bancarios
+
+    def despesas(self):
+        return self.despesas_de_caixa + self.debitos_bancarios
+
+    def resultado(self):
+        return self.faturamento() + self.despesas()
+
+    def permanencia_media(self):
+        if self.permanencia:
+            return secs_to_time(float(self.permanencia) / self.vendas)
+        return 0
+
+    def captacao_por_pessoa(self):
+        if self.vendas and self.num_pessoas:
+            return self.faturamento() / self.num_pessoas
+        return 0
+
+
 class VendasFechadasManager(models.Manager):
     def get_query_set(self):
         return super(VendasFechadasManager, self).get_query_set().filter(fechada=True)
@@ -84,6 +180,39 @@ class VendasAbertasManager(models.Manager):
     def get_query_set(self):
         return super(VendasAbertasManager, self).get_query_set().filter(fechada=False)
 
+class DiaManager(models.Manager):
+    def com_totais(self, de=None, ateh=None, ordem="data"):
+        """
+        Retorna uma lista dos dias entre `de` e `ateh`, inclusive, com
+        seus resumos (ver `Dia.resumo`) já calculados.
+
+        Os totais de todos os dias saem de um número fixo de consultas
+        agrupadas; depois disso, chamar os métodos de totais de cada dia
+        (faturamento, despesas, pessoas, permanência, vendas abertas
+        etc.) não acessa o banco de dados.
+
+        Argumentos:
+
+        - de: a data inicial; um objeto `datetime.date`, ou `None` pra
+          não limitar o início.
+        - ateh: a data final; um objeto `datetime.date`, ou `None` pra
+          não limitar o fim.
+        - ordem: o campo usado pra ordenar os dias (e.g. "-data").
+        """
+
+        dias = self.get_query_set()
+        dias = dias.filter(data__gte=de) if de else dias
+        dias = dias.filter(data__lte=ateh) if ateh else dias
+
+        resumos = self.model.resumos(dias)
+
+        resultado = list(dias.order_by(ordem))
+        for dia in resultado:
+            dia._resumo = resumos[dia.pk]
+
+        return resultado
+
+
 class Dia(models.Model):
     class Meta:
         ordering = ['data']
@@ -92,8 +221,11 @@ class Dia(models.Model):
     anotacoes = models.TextField(blank=True)
     dia_da_semana = models.IntegerField(editable=False, null=True)
 
+    objects = DiaManager()
+
     def save(self, *args, **kwargs):
         self.dia_da_semana = self.data.weekday()
+        self._resumo = None
         super(Dia, self).save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -115,20 +247,43 @@ class Dia(models.Model):
             return dias[self.data.weekday()]
 
     @classmethod
-    def _anos(cls, objects=None):
-        """Retorna um set com todos os anos (como string) de objetos Dia"""
+    def periodos(cls, tipo="month", objects=None):
+        """
+        Retorna uma lista ordenada dos períodos em que há objetos Dia de
+        `objects`, ou de todos os objetos Dia, se `objects` não for dado.
+
+        Os períodos distintos são extraídos pelo banco de dados, sem
+        carregar os dias.
+
+        Argumentos:
+
+        - tipo: "year", pra uma lista de anos, ou "month", pra uma lista
+          de tuplas `(ano, mes)`.
+        """
+
+        if tipo not in ("year", "month"):
+            raise ValueError(u"Tipo de período inválido: {0}".format(tipo))
 
         if objects is None: objects = Dia.objects.all()
-        return sorted(set([dia.data.year for dia in objects]))
+        datas = objects.dates("data", tipo)
+
+        if tipo == "year":
+            return [data.year for data in datas]
+        return [(data.year, data.month) for data in datas]
+
+    @classmethod
+    def _anos(cls, objects=None):
+        """Retorna uma lista ordenada com todos os anos de objetos Dia"""
+
+        return cls.periodos("year", objects)
 
     @classmethod
     def _meses(cls, ano, objects=None):
-        """Retorna um set com todos os meses (como string) de objetos
+        """Retorna uma lista ordenada com todos os meses de objetos
         Dia do ano `ano`"""
 
         if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(data__year=ano)
-        return sorted(set([dia.data.month for dia in objects]))
+        return [mes for _, mes in cls.periodos("month", objects.filter(data__year=ano))]
 
     @classmethod
     def _dias(cls, ano, mes, objects=None):
@@ -152,6 +307,150 @@ class Dia(models.Model):
         for obj in serializers.deserialize(format, file):
             obj.save()
 
+    @classmethod
+    def resumos(cls, dias):
+        """
+        Retorna um `dict` que associa o `id` de cada dia de `dias` ao
+        seu `ResumoDoDia`. Dias sem nenhum movimento recebem um resumo
+        zerado.
+
+        Os resumos são lidos da tabela de `ResumoDiario`; só os dias que
+        ainda não têm uma linha lá são calculados a partir das vendas,
+        despesas etc. (ver `Dia._calcular_resumos`).
+
+        Argumentos:
+
+        - dias: um QuerySet de objetos `Dia`, ou uma lista de ids.
+        """
+
+        resultado = defaultdict(ResumoDoDia)
+        for resumo_diario in ResumoDiario.objects.filter(dia__in=dias):
+            resultado[resumo_diario.dia_id] = resumo_diario.resumo()
+
+        faltando = cls.objects.filter(pk__in=dias, resumodiario__isnull=True)
+        if faltando.exists():
+            resultado.update(cls._calcular_resumos(faltando))
+
+        return resultado
+
+    @classmethod
+    def resumo_total(cls, objects=None):
+        """
+        Retorna um `ResumoDoDia` com a soma dos totais de `objects`, ou
+        de todos os objetos Dia, se `objects` não for dado.
+
+        A soma é feita pelo banco de dados sobre a tabela de
+        `ResumoDiario`, em uma consulta; os dias que ainda não têm uma
+        linha lá são calculados a partir das vendas, despesas etc.
+        """
+
+        if objects is None: objects = Dia.objects.all()
+
+        somas = ResumoDiario.objects.filter(dia__in=objects) \
+                                    .aggregate(*[Sum(campo) for campo in ResumoDoDia.CAMPOS])
+        total = ResumoDoDia(**dict((campo, somas[campo + "__sum"] or 0)
+                                   for campo in ResumoDoDia.CAMPOS))
+
+        faltando = cls.objects.filter(pk__in=objects, resumodiario__isnull=True)
+        if faltando.exists():
+            total = sum(cls._calcular_resumos(faltando).values(), total)
+
+        return total
+
+    @classmethod
+    def _calcular_resumos(cls, dias):
+        """
+        Calcula os resumos dos dias em `dias` a partir das vendas,
+        pagamentos com cartão, despesas de caixa, movimentações bancárias
+        e ajustes, sem usar a tabela de `ResumoDiario`. Retorna um `dict`
+        como o de `Dia.resumos`.
+
+        Faz uma consulta agrupada por dia pra cada tabela envolvida,
+        independente do número de dias.
+
+        Argumentos:
+
+        - dias: um QuerySet de objetos `Dia`, ou uma lista de ids.
+        """
+
+        totais = defaultdict(dict)
+
+        def acumular(dia_id, campo, valor):
+            if valor:
+                totais[dia_id][campo] = totais[dia_id].get(campo, 0) + valor
+
+        vendas = Venda.objects.filter(dia__in=dias).order_by() \
+                              .values("dia", "fechada") \
+                              .annotate(quantidade=Count("id"),
+                                        dinheiro=Sum("pgto_dinheiro"),
+                                        cheque=Sum("pgto_cheque"),
+                                        gorjeta=Sum("gorjeta"),
+                                        num_pessoas=Sum("num_pessoas"),
+                                        permanencia=Sum("permanencia"))
+
+        for linha in vendas:
+            if not linha["fechada"]:
+                acumular(linha["dia"], "vendas_abertas", linha["quantidade"])
+                continue
+
+            acumular(linha["dia"], "vendas", linha["quantidade"])
+            acumular(linha["dia"], "dinheiro", linha["dinheiro"])
+            acumular(linha["dia"], "cheque", linha["cheque"])
+            acumular(linha["dia"], "gorjeta_bruta", linha["gorjeta"])
+            acumular(linha["dia"], "num_pessoas", linha["num_pessoas"])
+            acumular(linha["dia"], "permanencia", linha["permanencia"])
+
+        campos_cartao = { "D": "cartao_debito", "C": "cartao_credito" }
+        cartoes = PagamentoComCartao.objects.filter(venda__dia__in=dias, venda__fechada=True) \
+                                            .order_by() \
+                                            .values("venda__dia", "bandeira__categoria") \
+                                            .annotate(total=Sum("valor"))
+
+        for linha in cartoes:
+            campo = campos_cartao.get(linha["bandeira__categoria"])
+            if campo:
+                acumular(linha["venda__dia"], campo, linha["total"])
+
+        somas_simples = (
+            ("despesas_de_caixa", DespesaDeCaixa.objects.all()),
+            ("debitos_bancarios", MovimentacaoBancaria.objects.filter(valor__lt=0)),
+            ("creditos_bancarios", MovimentacaoBancaria.objects.filter(valor__gt=0)),
+            ("ajustes", AjusteDeCaixa.objects.all()),
+        )
+
+        for campo, queryset in somas_simples:
+            linhas = queryset.filter(dia__in=dias).order_by() \
+                             .values("dia").annotate(total=Sum("valor"))
+
+            for linha in linhas:
+                acumular(linha["dia"], campo, linha["total"])
+
+        resultado = defaultdict(ResumoDoDia)
+        for dia_id, campos in totais.items():
+            resultado[dia_id] = ResumoDoDia(**campos)
+
+        return resultado
+
+    def resumo(self, recalcular=False):
+        """
+        Retorna o `ResumoDoDia` desse dia.
+
+        O resumo é calculado na primeira chamada e guardado no objeto;
+        as chamadas seguintes (e todos os métodos de totais do dia, que
+        usam o resumo) não acessam o banco de dados. Salvar o dia
+        descarta o resumo guardado.
+
+        Argumentos:
+
+        - recalcular: se `True`, descarta o resumo guardado e o calcula
+          de novo.
+        """
+
+        if recalcular or getattr(self, "_resumo", None) is None:
+            self._resumo = Dia.resumos([self.pk])[self.pk]
+
+        return self._resumo
+
     def vendas_abertas(self):
         return self.venda_set.filter(fechada=False)
 
@@ -161,69 +460,42 @@ class Dia(models.Model):
     def permanencia_media(self):
         """Retorna a permanência média dos clientes do dia"""
 
-        perm = self.vendas_fechadas().aggregate(Sum('permanencia'))['permanencia__sum']
-        if perm:
-            return secs_to_time(float(perm) / self.vendas_fechadas().count())
-
-        return 0
+        return self.resumo().permanencia_media()
 
     @classmethod
     def permanencia_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        perm = objects.aggregate(Sum('venda__permanencia'))['venda__permanencia__sum']
+        perm = cls.resumo_total(objects).permanencia
         return secs_to_time_str(float(perm))
-        return 0
 
     @classmethod
     def permanencia_media_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        perm = objects.aggregate(Sum('venda__permanencia'))['venda__permanencia__sum']
-        if perm:
-            count = objects.aggregate(Count('venda'))['venda__count']
-            return secs_to_time(float(perm) / count)
-        return 0
+        return cls.resumo_total(objects).permanencia_media()
 
     def caixa(self):
         """Retorna o total ganho em dinheiro no dia."""
-        dinheiro = self.vendas_fechadas().aggregate(Sum('pgto_dinheiro'))['pgto_dinheiro__sum']
-        cheque = self.vendas_fechadas().aggregate(Sum('pgto_cheque'))['pgto_cheque__sum']
-        return sum(filter(None, [dinheiro, cheque]))
+        return self.resumo().caixa()
 
     @classmethod
     def caixa_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        dinheiro = objects.aggregate(Sum('venda__pgto_dinheiro'))['venda__pgto_dinheiro__sum']
-        cheque = objects.aggregate(Sum('venda__pgto_cheque'))['venda__pgto_cheque__sum']
-        return sum(filter(None, [dinheiro, cheque]))
+        return cls.resumo_total(objects).caixa()
     
     def faturamento_dinheiro(self):
-        dinheiro = self.vendas_fechadas().aggregate(Sum('pgto_dinheiro'))['pgto_dinheiro__sum'] 
-        return dinheiro if dinheiro else 0
+        return self.resumo().dinheiro
     
     def faturamento_cheque(self):
-        cheque = self.vendas_fechadas().aggregate(Sum('pgto_cheque'))['pgto_cheque__sum'] 
-        return cheque if cheque else 0
+        return self.resumo().cheque
     
     def faturamento_cartao(self):
-        return self.faturamento_cartao_credito() + self.faturamento_cartao_debito()
+        return self.resumo().faturamento_cartao()
     
     def faturamento_cartao_debito(self):
-        cartao = self.vendas_fechadas().filter(pagamentocomcartao__bandeira__categoria='D') \
-                                  .aggregate(Sum('pagamentocomcartao__valor')) \
-                                    ['pagamentocomcartao__valor__sum'] 
-        return cartao if cartao else 0
+        return self.resumo().cartao_debito
     
     def faturamento_cartao_credito(self):
-        cartao = self.vendas_fechadas().filter(pagamentocomcartao__bandeira__categoria='C') \
-                                          .aggregate(Sum('pagamentocomcartao__valor')) \
-                                            ['pagamentocomcartao__valor__sum'] 
-        return cartao if cartao else 0
+        return self.resumo().cartao_credito
     
     def faturamento(self):
-        return self.faturamento_dinheiro() + self.faturamento_cartao() + self.faturamento_cheque()
+        return self.resumo().faturamento()
 
     def faturamento_porcentagem(self):
         """Retorna a porcentagem de despesas em relação ao resultado do dia."""
@@ -231,100 +503,65 @@ class Dia(models.Model):
     
     @classmethod
     def faturamento_total_dinheiro(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        pgto = objects.aggregate(Sum('venda__pgto_dinheiro'))['venda__pgto_dinheiro__sum']
-        return pgto if pgto else 0
+        return cls.resumo_total(objects).dinheiro
     
     @classmethod
     def faturamento_total_cheque(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        pgto = objects.aggregate(Sum('venda__pgto_cheque'))['venda__pgto_cheque__sum']
-        return pgto if pgto else 0
+        return cls.resumo_total(objects).cheque
     
     @classmethod
     def faturamento_total_cartao_debito(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        pgto = objects.filter(venda__fechada=True, venda__pagamentocomcartao__bandeira__categoria='D') \
-                         .aggregate(Sum('venda__pagamentocomcartao__valor')) \
-                           ['venda__pagamentocomcartao__valor__sum']
-        return pgto if pgto else 0
+        return cls.resumo_total(objects).cartao_debito
     
     @classmethod
     def faturamento_total_cartao_credito(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        pgto = objects.filter(venda__fechada=True, venda__pagamentocomcartao__bandeira__categoria='C') \
-                         .aggregate(Sum('venda__pagamentocomcartao__valor')) \
-                           ['venda__pagamentocomcartao__valor__sum']
-        return pgto if pgto else 0
+        return cls.resumo_total(objects).cartao_credito
     
     @classmethod
     def faturamento_total_cartao(cls, objects=None):
-        return cls.faturamento_total_cartao_credito(objects) + \
-               cls.faturamento_total_cartao_debito(objects)
+        return cls.resumo_total(objects).faturamento_cartao()
 
     @classmethod
     def faturamento_total(cls, objects=None):
-        return sum([Dia.faturamento_total_dinheiro(objects), Dia.faturamento_total_cheque(objects), Dia.faturamento_total_cartao(objects)])
+        return cls.resumo_total(objects).faturamento()
     
     def despesas_de_caixa(self):
         """Retorna o total de despesas de caixa do dia."""
 
-        despesas_de_caixa = self.despesadecaixa_set.aggregate(Sum('valor'))['valor__sum']
-        return despesas_de_caixa if despesas_de_caixa else 0
+        return self.resumo().despesas_de_caixa
 
     @classmethod
     def despesas_de_caixa_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        despesas_de_caixa = objects.aggregate(Sum('despesadecaixa__valor'))['despesadecaixa__valor__sum']
-        return despesas_de_caixa if despesas_de_caixa else 0
+        return cls.resumo_total(objects).despesas_de_caixa
     
     @classmethod
     def movimentacoes_bancarias_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        movbancarias = objects.aggregate(Sum('movimentacaobancaria__valor'))['movimentacaobancaria__valor__sum']
-        return movbancarias if movbancarias else 0
+        return cls.resumo_total(objects).movimentacoes_bancarias()
     
     @classmethod
     def debitos_bancarios_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        movbancarias = objects.filter(movimentacaobancaria__valor__lt=0).\
-                        aggregate(Sum('movimentacaobancaria__valor'))['movimentacaobancaria__valor__sum']
-        return movbancarias if movbancarias else 0
+        return cls.resumo_total(objects).debitos_bancarios
     
     @classmethod
     def creditos_bancarios_total(cls, objects=None):
-        if objects is None: objects = Dia.objects.all()
-        movbancarias = objects.filter(movimentacaobancaria__valor__gt=0).\
-                        aggregate(Sum('movimentacaobancaria__valor'))['movimentacaobancaria__valor__sum']
-        return movbancarias if movbancarias else 0
+        return cls.resumo_total(objects).creditos_bancarios
     
     def movimentacoes_bancarias(self):
-        movbancarias = self.movimentacaobancaria_set.aggregate(Sum('valor'))['valor__sum']
-        return movbancarias if movbancarias else 0
+        return self.resumo().movimentacoes_bancarias()
     
     def debitos_bancarios(self):
-        movbancarias = self.movimentacaobancaria_set.filter(valor__lt=0).\
-                        aggregate(Sum('valor'))['valor__sum']
-        return movbancarias if movbancarias else 0
+        return self.resumo().debitos_bancarios
     
     def creditos_bancarios(self):
-        movbancarias = self.movimentacaobancaria_set.filter(valor__gt=0).\
-                        aggregate(Sum('valor'))['valor__sum']
-        return movbancarias if movbancarias else 0
+        return self.resumo().creditos_bancarios
     
     def ajustes_de_caixa(self):
-        ajustes = self.ajustedecaixa_set.aggregate(Sum('valor'))['valor__sum']
-        return ajustes if ajustes else 0
+        return self.resumo().ajustes
     
     def despesas(self):
         """Retorna o total de despesas do dia."""
 
-        despesas_de_caixa = self.despesas_de_caixa()
-        despesas_bancarias =  self.movimentacaobancaria_set.filter(valor__lt=0).aggregate(Sum('valor'))['valor__sum']
-
-        return sum(filter(None, [despesas_de_caixa, despesas_bancarias]))
+        return self.resumo().despesas()
 
     def despesas_porcentagem(self):
         """Retorna a porcentagem de despesas em relação ao resultado do dia."""
@@ -335,32 +572,19 @@ class Dia(models.Model):
         """Retorna o total de despesas de `objects`, ou de
         todos os objetos Dia, se `objects` não for dado"""
 
-        if objects is None: objects = Dia.objects.all()
-
-        despesas_de_caixa = Dia.despesas_de_caixa_total(objects)
-        despesas_bancarias =  objects.filter(movimentacaobancaria__valor__lt=0).aggregate(Sum('movimentacaobancaria__valor'))['movimentacaobancaria__valor__sum']
-
-        return sum(filter(None, [despesas_de_caixa, despesas_bancarias]))
+        return cls.resumo_total(objects).despesas()
 
     @classmethod
     def gorjeta_total(cls, objects=None):
         """Retorna o total de gorjetas de `objects`, ou de todos os
         objetos Dia, se `objects` não for dado."""
 
-        if objects is None: objects = Dia.objects.all()
-        vendas = Venda.objects.filter(dia__in=objects, fechada=True)
-        gorjeta = vendas.aggregate(Sum('gorjeta'))['gorjeta__sum']
-
-        if not gorjeta:
-            return 0
-
-        return gorjeta * FATOR_CONSIDERADO_10P
+        return cls.resumo_total(objects).gorjeta()
 
     def gorjeta(self):
         """Retorna o total de gorjetas do dia."""
 
-        gorjeta = self.vendas_fechadas().aggregate(Sum('gorjeta'))['gorjeta__sum']
-        return gorjeta * Decimal('0.9') if gorjeta else 0
+        return self.resumo().gorjeta()
 
     @classmethod
     def descontos_da_gorjeta(cls, dias=None):
@@ -408,81 +632,60 @@ class Dia(models.Model):
     def ajuste_total(cls, objects=None):
         """Retorna o total de ajustes do dia."""
         
-        if objects is None: objects = Dia.objects.all()
-        ajuste = objects.aggregate(Sum('ajustedecaixa__valor'))['ajustedecaixa__valor__sum']
-        return ajuste if ajuste else 0
+        return cls.resumo_total(objects).ajustes
     
     def ajuste(self):
         """Retorna o total de ajustes do dia."""
         
-        ajuste = self.ajustedecaixa_set.aggregate(Sum('valor'))['valor__sum']
-        return ajuste if ajuste else 0
+        return self.resumo().ajustes
 
     @classmethod
     def resultado_total(cls, objects=None):
         """Retorna o resultado (lucro ou prejuízo) de `objects`, ou de todos os
         objetos Dia, se `objects` não for dado."""
 
-        if objects is None: objects = Dia.objects.all()
-        resultado = cls.faturamento_total(objects) + cls.despesas_total(objects)
-        return resultado if resultado else 0
+        return cls.resumo_total(objects).resultado()
 
     def resultado(self):
         """Retorna o resultado (lucro ou prejuízo) do dia"""
 
-        resultado = self.faturamento() + self.despesas()
-        return resultado if resultado else 0
+        return self.resumo().resultado()
 
     def caixa_de_hoje(self):
         """Retorna o total de dinheiro no caixa no dia"""
-        dias = Dia.dias_entre(None, self.data)
-        return Dia.faturamento_total_dinheiro(dias) + \
-               Dia.faturamento_total_cheque(dias) + \
-               Dia.despesas_de_caixa_total(dias) + \
-               Dia.ajuste_total(dias)
+        total = Dia.resumo_total(Dia.dias_entre(None, self.data))
+        return total.caixa() + total.despesas_de_caixa + total.ajustes
     
     def captacao_por_pessoa(self):
-        if self.vendas_fechadas().count():
-            return self.faturamento() / self.num_pessoas()
-        return 0
+        return self.resumo().captacao_por_pessoa()
 
     @classmethod
     def captacao_por_pessoa_total(cls, objects=None):
-        num_pessoas = Dia.num_pessoas_total(objects)
-        if num_pessoas:
-            return cls.faturamento_total(objects) / num_pessoas
-        return 0
+        return cls.resumo_total(objects).captacao_por_pessoa()
 
     @classmethod
     def num_pessoas_total(cls, objects=None):
         """Retorna o número de pessoas de `objects`, ou de todos os
         objetos Dia, se `objects` não for dado."""
 
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        num_pessoas = objects.aggregate(Sum('venda__num_pessoas'))['venda__num_pessoas__sum']
-        return num_pessoas if num_pessoas else 0
+        return cls.resumo_total(objects).num_pessoas
 
     def num_pessoas(self):
         """Retorna o num_pessoas (lucro ou prejuízo) do dia"""
 
-        num_pessoas = self.vendas_fechadas().aggregate(Sum('num_pessoas'))['num_pessoas__sum']
-        return num_pessoas if num_pessoas else 0
+        return self.resumo().num_pessoas
 
     @classmethod
     def vendas_total(cls, objects=None):
         """Retorna o número de vendas de `objects`, ou de todos os
         objetos Dia, se `objects` não for dado."""
 
-        if objects is None: objects = Dia.objects.all()
-        objects = objects.filter(venda__fechada=True)
-        vendas = objects.aggregate(Count('venda'))['venda__count']
-        return vendas if vendas else 0
+        return cls.resumo_total(objects).vendas
 
     def vendas(self):
         """Retorna o número de vendas do dia"""
 
-        return self.vendas_fechadas().count()
+        return self.resumo().vendas
 
     @classmethod
     def fim_do_ano(cls, ano):
@@ -505,82 +708,113 @@ class Dia(models.Model):
     
     @classmethod
     def listar_dias(cls, de=None, ateh=None, dias_da_semana=range(0, 8)):
-        dias = cls.dias_entre(de, ateh).order_by("-data")
+        dias = cls.objects.com_totais(de, ateh, ordem="-data")
+        total = sum((dia.resumo() for dia in dias), ResumoDoDia())
 
         dados = {
                    "faturamento_total": {
-                                            "total": cls.faturamento_total(dias),
-                                            "dinheiro": cls.faturamento_total_dinheiro(dias),
-                                            "cheque": cls.faturamento_total_cheque(dias),
-                                            "cartao_debito": cls.faturamento_total_cartao_debito(dias),
-                                            "cartao_credito": cls.faturamento_total_cartao_credito(dias),
+                                            "total": total.faturamento(),
+                                            "dinheiro": total.dinheiro,
+                                            "cheque": total.cheque,
+                                            "cartao_debito": total.cartao_debito,
+                                            "cartao_credito": total.cartao_credito,
                                         },
-                  "vendas_total": cls.vendas_total(dias),
-                  "num_pessoas_total": cls.num_pessoas_total(dias),
-                  "permanencia_media_total": cls.permanencia_media_total(dias),
-                  "captacao_por_pessoa_total": cls.captacao_por_pessoa_total(dias),
-                  "gorjeta_total": cls.gorjeta_total(dias),
-                  "despesas_de_caixa_total": cls.despesas_de_caixa_total(dias),
-                  "movimentacoes_bancarias_total": cls.movimentacoes_bancarias_total(dias),
-                  "resultado_total": cls.faturamento_total(dias) + cls.despesas_total(dias),
+                  "vendas_total": total.vendas,
+                  "num_pessoas_total": total.num_pessoas,
+                  "permanencia_media_total": total.permanencia_media(),
+                  "captacao_por_pessoa_total": total.captacao_por_pessoa(),
+                  "gorjeta_total": total.gorjeta(),
+                  "despesas_de_caixa_total": total.despesas_de_caixa,
+                  "movimentacoes_bancarias_total": total.movimentacoes_bancarias(),
+                  "resultado_total": total.resultado(),
                   "dias": dias,
                 }
     
         return dados
     
+    @classmethod
+    def resumos_por_mes(cls, dias=None):
+        """
+        Retorna um `OrderedDict` que associa cada mês dos dias em
+        `dias`, na forma de uma tupla `(ano, mes)`, ao `ResumoDoDia`
+        com a soma dos totais dos seus dias. Os meses ficam em ordem
+        crescente.
+
+        Faz as mesmas consultas de `Dia.resumos` mais uma, pras datas
+        dos dias; a soma por mês é feita em memória.
+
+        Argumentos:
+
+        - dias: um QuerySet de objetos `Dia`; se não for dado, usa todos
+          os dias.
+        """
+
+        if dias is None: dias = cls.objects.all()
+
+        resumos = cls.resumos(dias)
+        meses = defaultdict(ResumoDoDia)
+
+        for dia_id, data in dias.order_by().values_list("id", "data"):
+            meses[(data.year, data.month)] += resumos[dia_id]
+
+        return OrderedDict(sorted(meses.items()))
+
     @classmethod
     def estruturar_dias(cls, dias=None):
+        """
+        Retorna um `dict` com os totais de cada ano, e dentro de cada
+        ano os totais de cada mês dos dias em `dias`, junto com os
+        totais acumulados desde o primeiro dia de trabalho até o fim do
+        ano/mês.
+
+        Os totais saem de um único `Dia.resumos_por_mes` sobre todos os
+        dias; os totais anuais e os acumulados são somados em memória.
+        """
+
         if dias == None: dias = cls.objects.all()
-        dias = dias.order_by("-data")
-    
+        meses_de_dias = set(cls.periodos("month", dias))
+
+        def totais(resumo, acumulado):
+            return { "vendas": resumo.vendas,
+                     "num_pessoas": resumo.num_pessoas,
+                     "permanencia_media": resumo.permanencia_media(),
+                     "captacao_por_pessoa": resumo.captacao_por_pessoa(),
+                     "faturamento": resumo.faturamento(),
+                     "faturamento_acumulado": acumulado.faturamento(),
+                     "despesas_de_caixa": resumo.despesas_de_caixa,
+                     "despesas_de_caixa_acumulado": acumulado.despesas_de_caixa,
+                     "movimentacoes_bancarias": resumo.movimentacoes_bancarias(),
+                     "movimentacoes_bancarias_acumulado": acumulado.movimentacoes_bancarias(),
+                     "gorjeta": resumo.gorjeta(),
+                     "gorjeta_acumulado": acumulado.gorjeta(),
+                     "despesas": resumo.despesas(),
+                     "despesas_acumulado": acumulado.despesas(),
+                     "resultado": resumo.resultado(),
+                     "resultado_acumulado": acumulado.resultado() }
+
         anos = {}
-        for ano in sorted(cls._anos()):
-            dias_do_ano = cls.objects.filter(data__year=ano)
-            dias_ate_ano = cls.objects.filter(data__lte=cls.fim_do_ano(ano))
-    
-            meses = {}
-            for mes in cls._meses(ano, dias):
-                dias_do_mes = cls.objects.filter(data__year=ano, data__month=mes)
-                dias_ate_mes = cls.objects.filter(data__lte=cls.fim_do_mes(ano, mes))
-    
-                meses[mes] = { "nome": MESES[mes-1],
-                               "vendas": cls.vendas_total(dias_do_mes),
-                               "num_pessoas": cls.num_pessoas_total(dias_do_mes),
-                               "permanencia_media": cls.permanencia_media_total(dias_do_mes),
-                               "captacao_por_pessoa": cls.captacao_por_pessoa_total(dias_do_mes),
-                               "faturamento": cls.faturamento_total(dias_do_mes),
-                               "faturamento_acumulado": cls.faturamento_total(dias_ate_mes),
-                               "despesas_de_caixa": cls.despesas_de_caixa_total(dias_do_mes),
-                               "despesas_de_caixa_acumulado": cls.despesas_de_caixa_total(dias_ate_mes),
-                               "movimentacoes_bancarias": cls.movimentacoes_bancarias_total(dias_do_mes),
-                               "movimentacoes_bancarias_acumulado": cls.movimentacoes_bancarias_total(dias_ate_mes),
-                               "gorjeta": cls.gorjeta_total(dias_do_mes),
-                               "gorjeta_acumulado": cls.gorjeta_total(dias_ate_mes),
-                               "despesas": cls.despesas_total(dias_do_mes),
-                               "despesas_acumulado": cls.despesas_total(dias_ate_mes),
-                               "resultado": cls.faturamento_total(dias_do_mes) + cls.despesas_total(dias_do_mes),
-                               "resultado_acumulado": cls.faturamento_total(dias_ate_mes) + cls.despesas_total(dias_ate_mes),
-                               "dias": dias_do_mes }
-    
-            anos[ano] = { "nome": ano,
-                          "num_pessoas": cls.num_pessoas_total(dias_do_ano),
-                          "vendas": cls.vendas_total(dias_do_ano),
-                          "permanencia_media": cls.permanencia_media_total(dias_do_ano),
-                          "captacao_por_pessoa": cls.captacao_por_pessoa_total(dias_do_ano),
-                          "faturamento": cls.faturamento_total(dias_do_ano),
-                          "faturamento_acumulado": cls.faturamento_total(dias_ate_ano),
-                          "despesas_de_caixa": cls.despesas_de_caixa_total(dias_do_ano),
-                          "despesas_de_caixa_acumulado": cls.despesas_de_caixa_total(dias_ate_ano),
-                          "movimentacoes_bancarias": cls.movimentacoes_bancarias_total(dias_do_ano),
-                          "movimentacoes_bancarias_acumulado": cls.movimentacoes_bancarias_total(dias_ate_ano),
-                          "gorjeta": cls.gorjeta_total(dias_do_ano),
-                          "gorjeta_acumulado": cls.gorjeta_total(dias_ate_ano),
-                          "despesas": cls.despesas_total(dias_do_ano),
-                          "despesas_acumulado": cls.despesas_total(dias_ate_ano),
-                          "resultado": cls.faturamento_total(dias_do_ano) + cls.despesas_total(dias_do_ano),
-                          "resultado_acumulado": cls.faturamento_total(dias_ate_ano) + cls.despesas_total(dias_ate_ano),
-                          "meses": meses }
-    
+        acumulado = ResumoDoDia()
+        resumos_dos_anos = defaultdict(ResumoDoDia)
+
+        for (ano, mes), resumo in cls.resumos_por_mes().items():
+            acumulado += resumo
+            resumos_dos_anos[ano] += resumo
+
+            if ano not in anos:
+                anos[ano] = { "nome": ano, "meses": {} }
+
+            # o acumulado do ano é o acumulado do seu último mês
+            anos[ano]["acumulado"] = acumulado
+
+            if (ano, mes) in meses_de_dias:
+                meses = anos[ano]["meses"]
+                meses[mes] = totais(resumo, acumulado)
+                meses[mes]["nome"] = MESES[mes-1]
+                meses[mes]["dias"] = cls.objects.filter(data__year=ano, data__month=mes)
+
+        for ano, dados in anos.items():
+            dados.update(totais(resumos_dos_anos[ano], dados.pop("acumulado")))
+
         return anos
 
 
@@ -628,36 +862,29 @@ class PagamentoComCartao(models.Model):
 
     def _data_do_deposito(self):
         data_da_venda = self.venda.dia.data
-        um_dia = datetime.timedelta(1)
-        intervalo = datetime.timedelta(0)
-        faltam_dias = self.bandeira.prazo_de_deposito
-        soh_dias_uteis = self.bandeira.contagem_de_dias == "U"
-
-        while faltam_dias:
-            intervalo += um_dia
-            data_teste = data_da_venda + intervalo
+        prazo = self.bandeira.prazo_de_deposito
 
-            if soh_dias_uteis:
-                if eh_dia_util(data_teste):
-                    faltam_dias -= 1
-            else:
-                faltam_dias -= 1
+        if self.bandeira.contagem_de_dias == "U":
+            return somar_dias_uteis(data_da_venda, prazo)
 
-        return data_da_venda + intervalo
+        return data_da_venda + datetime.timedelta(prazo)
 
     def save(self, *args, **kwargs):
-        super(PagamentoComCartao, self).save(*args, **kwargs)
+        # O pagamento é salvo duas vezes, junto com a movimentação da
+        # taxa; o resumo do dia é recalculado uma vez só.
+        with ResumoDiario.adiar():
+            super(PagamentoComCartao, self).save(*args, **kwargs)
 
-        categoria_taxas = CategoriaDeMovimentacao.objects.get(slug=SLUG_CATEGORIA_TAXA_CARTAO)
+            categoria_taxas = CategoriaDeMovimentacao.objects.get(slug=SLUG_CATEGORIA_TAXA_CARTAO)
 
-        self.venda.dia.movimentacaobancaria_set.create(valor=-self.taxa,
-            categoria=categoria_taxas, descricao=self.bandeira.nome,
-            pgto_cartao=self)
+            self.venda.dia.movimentacaobancaria_set.create(valor=-self.taxa,
+                categoria=categoria_taxas, descricao=self.bandeira.nome,
+                pgto_cartao=self)
 
-        self.venda.dia.save()
+            self.venda.dia.save()
 
-        self.data_do_deposito = self._data_do_deposito()
-        super(PagamentoComCartao, self).save(*args, **kwargs)
+            self.data_do_deposito = self._data_do_deposito()
+            super(PagamentoComCartao, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return u"R$ %.2f, %s" % (self.valor, self.bandeira)
@@ -712,7 +939,8 @@ class Venda(models.Model):
     pgto_cheque = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     fechada = models.BooleanField(editable=False, default=False);
 
-    transacao_10p = models.ForeignKey(Transacao, null=True, editable=False, related_name="+")
+    transacao_10p = models.ForeignKey(Transacao, null=True, editable=False, related_name="+",
+                                      on_delete=models.SET_NULL)
 
     objects = models.Manager()
     abertas = VendasAbertasManager()
@@ -755,29 +983,83 @@ class Venda(models.Model):
         if not self.fechada:
             return
 
-        if self.transacao_10p:
-            self.transacao_10p.delete()
+        with transaction.commit_on_success():
+            if self.transacao_10p:
+                self.transacao_10p.delete()
+                self.transacao_10p = None
 
-        self.fechada = False
-        self.save()
+            self.fechada = False
+            self.save()
 
     def fechar(self):
         """
         Torna a venda fechada -- o cliente já pagou a conta.
 
-        Cria/sobrescreve a transação de 10% referente à venda.
+        Cria/sobrescreve a transação de 10% referente à venda. Tudo é
+        feito numa transação do banco de dados: se algo der errado, nem
+        a venda nem a contabilidade ficam pela metade.
 
         """
 
         if self.fechada:
             return
 
+        with transaction.commit_on_success():
+            registro_10p = Registro.objects.get(nome=NOME_DO_REGISTRO) if self.gorjeta else None
+            config = get_config() if self.gorjeta else None
+
+            self._fechar(registro_10p, config)
+            self.save()
+
+    @classmethod
+    def fechar_varias(cls, vendas):
+        """
+        Fecha várias vendas de uma vez (e.g. no fim da noite), numa
+        transação só do banco de dados.
+
+        O registro de contabilidade e a configuração são buscados uma vez
+        só; cada venda é salva com um UPDATE dos campos alterados pelo
+        fechamento (`fechada` e `transacao_10p`), e os resumos diários
+        dos dias das vendas são recalculados uma vez só, no final.
+
+        Argumentos:
+
+        - vendas: um iterable de objetos `Venda`. As vendas já fechadas
+          são ignoradas.
+        """
+
+        vendas = [venda for venda in vendas if not venda.fechada]
+        if not vendas:
+            return
+
+        with transaction.commit_on_success():
+            com_gorjeta = any(venda.gorjeta for venda in vendas)
+            registro_10p = Registro.objects.get(nome=NOME_DO_REGISTRO) if com_gorjeta else None
+            config = get_config() if com_gorjeta else None
+
+            for venda in vendas:
+                venda._fechar(registro_10p, config)
+                cls.objects.filter(pk=venda.pk).update(fechada=True,
+                                                       transacao_10p=venda.transacao_10p)
+
+            ResumoDiario.recalcular(list(set(venda.dia_id for venda in vendas)))
+
+    def _fechar(self, registro_10p, config):
+        """
+        Cria a transação de 10% da venda e a marca como fechada, sem
+        salvá-la.
+
+        Os quatro lançamentos da transação são criados com um único
+        `bulk_create`, que não dispara sinais; os checkpoints de saldo
+        afetados já são invalidados ao salvar a transação, que tem a
+        mesma data.
+        """
+
         if self.transacao_10p:
             self.transacao_10p.delete()
+            self.transacao_10p = None
 
         if self.gorjeta:
-            registro_10p = Registro.objects.get(nome=NOME_DO_REGISTRO)
-
             self.transacao_10p = Transacao(
                 registro=registro_10p,
                 data=self.dia.data,
@@ -786,8 +1068,6 @@ class Venda(models.Model):
 
             self.transacao_10p.save()
 
-            config = get_config()
-
             a_pagar = Decimal(
                 float(
                     Fraction.from_decimal(self.gorjeta) \
@@ -796,29 +1076,19 @@ class Venda(models.Model):
                  )
             )
 
-            self.transacao_10p.lancamentos.create(
-                valor=a_pagar * -1,
-                conta=join("entrada", "vendas", "10% funcionarios"),
-            )
-
-            self.transacao_10p.lancamentos.create(
-                valor=a_pagar,
-                conta=join("bens", "caixa"),
-            )
-
-            self.transacao_10p.lancamentos.create(
-                valor=a_pagar,
-                conta=join("gastos", "funcionarios", "10%"),
-            )
-
-            self.transacao_10p.lancamentos.create(
-                valor=a_pagar * -1,
-                conta=join("dividas", "contas a pagar", "10%"),
-            )
+            lancamentos = [
+                (a_pagar * -1, join("entrada", "vendas", "10% funcionarios")),
+                (a_pagar, join("bens", "caixa")),
+                (a_pagar, join("gastos", "funcionarios", "10%")),
+                (a_pagar * -1, join("dividas", "contas a pagar", "10%")),
+            ]
 
+            Lancamento.objects.bulk_create([
+                Lancamento(transacao=self.transacao_10p, valor=valor, conta=conta)
+                for valor, conta in lancamentos
+            ])
 
         self.fechada = True
-        self.save()
 
     def delete(self, *args, **kwargs):
         if self.transacao_10p:
@@ -991,6 +1261,209 @@ class MovimentacaoBancaria(models.Model):
     def get_absolute_url(self):
         return self.dia.get_absolute_url() + "movbancaria/{0}/".format(self.id)
 
+class ResumoDiario(models.Model):
+    """
+    Totais pré-calculados de um dia de trabalho (ver `ResumoDoDia`).
+
+    Os relatórios leem os totais dessa tabela em vez de somar as vendas,
+    despesas etc. a cada acesso. As linhas são recalculadas sempre que
+    uma venda (inclusive ao ser aberta/fechada), pagamento com cartão,
+    despesa de caixa, movimentação bancária ou ajuste de caixa do dia é
+    salvo ou removido; dias sem linha são calculados na hora.
+
+    Pra reconstruir a tabela inteira, rode o comando
+    ``python manage.py recalcular_resumos``.
+    """
+
+    class Meta:
+        verbose_name = "Resumo diário"
+        verbose_name_plural = "Resumos diários"
+
+    dia = models.OneToOneField(Dia, editable=False)
+
+    dinheiro = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cheque = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cartao_debito = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cartao_credito = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    gorjeta_bruta = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    num_pessoas = models.IntegerField(default=0)
+    permanencia = models.IntegerField(default=0)
+    vendas = models.IntegerField(default=0)
+    vendas_abertas = models.IntegerField(default=0)
+    despesas_de_caixa = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    debitos_bancarios = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    creditos_bancarios = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    ajustes = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __unicode__(self):
+        return unicode(self.dia)
+
+    def resumo(self):
+        """Retorna os totais guardados como um `ResumoDoDia`."""
+
+        return ResumoDoDia(**dict((campo, getattr(self, campo))
+                                  for campo in ResumoDoDia.CAMPOS))
+
+    @classmethod
+    def recalcular(cls, dias):
+        """
+        Recalcula as linhas dos dias em `dias`, criando as que faltarem.
+
+        Argumentos:
+
+        - dias: um QuerySet de objetos `Dia`, ou uma lista de ids.
+        """
+
+        # Os totais são calculados, e as linhas trocadas, numa transação
+        # só, com as linhas dos dias travadas (nos bancos que suportam o
+        # SELECT ... FOR UPDATE): dois recálculos simultâneos do mesmo
+        # dia não inserem duas linhas, uma venda salva durante o cálculo
+        # espera o fim dele pra recalcular o dia de novo, e uma falha no
+        # meio não deixa o dia sem resumo.
+        with transaction.commit_on_success():
+            ids = list(Dia.objects.select_for_update().filter(pk__in=dias).values_list("pk", flat=True))
+            resumos = Dia._calcular_resumos(ids)
+
+            cls.objects.filter(dia__in=ids).delete()
+            cls.objects.bulk_create([
+                cls(dia_id=dia_id, **dict((campo, getattr(resumos[dia_id], campo))
+                                          for campo in ResumoDoDia.CAMPOS))
+                for dia_id in ids
+            ])
+
+    @classmethod
+    def invalidar(cls, dias):
+        """
+        Remove as linhas dos dias em `dias`; até serem recalculados, os
+        totais desses dias são calculados na hora.
+        """
+
+        cls.objects.filter(dia__in=dias).delete()
+
+    _adiados = threading.local()
+    """
+    Dias com recálculo adiado por `adiar`, em cada thread.
+    """
+
+    @classmethod
+    def atualizar(cls, dia_id):
+        """
+        Recalcula a linha do dia com id `dia_id`, depois de uma venda,
+        pagamento etc. do dia ser salvo ou removido.
+
+        Dentro de um bloco `adiar`, a linha só é removida (os totais do
+        dia passam a ser calculados na hora) e o dia é recalculado uma
+        vez só, no fim do bloco.
+        """
+
+        adiados = getattr(cls._adiados, "dias", None)
+
+        if adiados is None:
+            cls.recalcular([dia_id])
+        elif dia_id not in adiados:
+            cls.invalidar([dia_id])
+            adiados.add(dia_id)
+
+    @classmethod
+    @contextmanager
+    def adiar(cls):
+        """
+        Gerenciador de contexto que junta os recálculos de `atualizar`
+        feitos dentro do bloco `with` num recálculo só de cada dia, no
+        fim do bloco. Salvar um pagamento com cartão, por exemplo, salva
+        também uma movimentação bancária e o próprio pagamento de novo.
+
+        Blocos aninhados fazem parte do bloco de fora. Se o bloco
+        terminar com uma exceção, os dias ficam sem linha e continuam
+        sendo calculados na hora.
+        """
+
+        if getattr(cls._adiados, "dias", None) is not None:
+            yield
+            return
+
+        cls._adiados.dias = set()
+        try:
+            yield
+        except:
+            cls._adiados.dias = None
+            raise
+
+        dias, cls._adiados.dias = cls._adiados.dias, None
+        if dias:
+            cls.recalcular(list(dias))
+
+
+def _dia_do_objeto(instance):
+    """
+    Retorna o id do dia a que pertence uma venda, pagamento com cartão,
+    despesa, movimentação ou ajuste, ou `None` se o dia não existir mais.
+    """
+
+    if isinstance(instance, PagamentoComCartao):
+        dias = Venda.objects.filter(pk=instance.venda_id).values_list("dia_id", flat=True)
+        return next(iter(dias), None)
+
+    return instance.dia_id
+
+@receiver(post_save, sender=Venda, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_save, sender=PagamentoComCartao, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_save, sender=DespesaDeCaixa, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_save, sender=MovimentacaoBancaria, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_save, sender=AjusteDeCaixa, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_delete, sender=Venda, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_delete, sender=PagamentoComCartao, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_delete, sender=DespesaDeCaixa, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_delete, sender=MovimentacaoBancaria, dispatch_uid="atualizar_resumo_diario")
+@receiver(post_delete, sender=AjusteDeCaixa, dispatch_uid="atualizar_resumo_diario")
+def atualizar_resumo_diario(sender, instance, raw=False, **kwargs):
+    """
+    Recalcula o `ResumoDiario` do dia de um objeto salvo ou removido
+    (ver `ResumoDiario.atualizar`).
+
+    Objetos carregados de fixtures/dumps (``raw``) só invalidam o resumo,
+    porque os objetos relacionados podem ainda não ter sido carregados.
+    """
+
+    dia_id = _dia_do_objeto(instance)
+    if dia_id is None:
+        return
+
+    if raw:
+        ResumoDiario.invalidar([dia_id])
+    else:
+        ResumoDiario.atualizar(dia_id)
+
+@receiver(post_save, sender=Dia, dispatch_uid="criar_resumo_diario")
+def criar_resumo_diario(sender, instance, created, raw=False, **kwargs):
+    """Cria o `ResumoDiario` (zerado) de um dia novo."""
+
+    if created and not raw:
+        ResumoDiario.objects.create(dia=instance)
+
+@receiver(post_delete, sender=Dia, dispatch_uid="remover_resumo_diario")
+def remover_resumo_diario(sender, instance, **kwargs):
+    """
+    Remove o `ResumoDiario` de um dia removido -- as vendas etc. removidas
+    junto com o dia podem ter recriado a linha.
+    """
+
+    ResumoDiario.invalidar([instance.pk])
+
+@receiver(post_save, sender=Bandeira, dispatch_uid="atualizar_resumos_da_bandeira")
+def atualizar_resumos_da_bandeira(sender, instance, created, raw=False, **kwargs):
+    """
+    Recalcula os resumos dos dias com pagamentos de uma bandeira
+    alterada, já que a categoria (débito/crédito) pode ter mudado.
+    """
+
+    if created or raw:
+        return
+
+    dias = Dia.objects.filter(venda__pagamentocomcartao__bandeira=instance).distinct()
+    ResumoDiario.recalcular(dias)
+
+
 config_pages["vestat"].add(
     Link(
         "bandeiras",
@@ -0,0 +1,141 @@
+# -*- encoding: utf-8 -*-
+"""
+Previsão do saldo no banco.
+
+Soma, por dia ou por semana, os depósitos esperados dos pagamentos com
+cartão (já descontada a taxa da bandeira) e os débitos bancários
+lançados nos dias de trabalho do intervalo, e acumula o resultado num
+saldo projetado.
+
+As taxas dos cartões, que também são lançadas como movimentações
+bancárias no dia da venda, não entram nos débitos: elas já estão
+descontadas do valor depositado.
+
+Só entram os débitos já lançados: um débito agendado (um aluguel, por
+exemplo) só aparece na previsão depois de lançado como movimentação
+bancária de um dia de trabalho.
+
+As somas são feitas em centavos, com inteiros, pra não acumular erros
+de arredondamento; cada depósito é arredondado pro centavo mais próximo.
+"""
+
+import datetime
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from models import PagamentoComCartao, MovimentacaoBancaria
+
+PERIODOS = {
+    "dia": 1,
+    "semana": 7,
+}
+"""
+Tamanho em dias de cada período aceito por `previsao_de_caixa`.
+"""
+
+PontoDaPrevisao = namedtuple("PontoDaPrevisao", "inicio fim depositos debitos saldo")
+"""
+Um período da previsão: datas de início e fim (inclusive), depósitos
+líquidos e débitos esperados no período, e o saldo projetado no fim
+dele.
+"""
+
+CENTAVO = Decimal("0.01")
+
+def _centavos(valor):
+    """
+    Converte um `Decimal` num número inteiro de centavos, arredondando
+    pro centavo mais próximo.
+    """
+
+    return int(Decimal(valor).quantize(CENTAVO, rounding=ROUND_HALF_UP) * 100)
+
+def _somar_por_periodo(datas, centavos, base, passo, n):
+    """
+    Soma os `centavos` (inteiros) em `n` períodos de `passo` dias a
+    partir da data `base`, de acordo com a data correspondente a cada
+    valor. Retorna um array do numpy, de inteiros, com as `n` somas.
+
+    O `numpy.bincount` soma os pesos como `float64`, mas inteiros até
+    2**53 (bem mais que o total de centavos de qualquer intervalo) são
+    representados e somados sem erro; o resultado volta pra inteiro.
+    """
+
+    import numpy
+
+    if not len(datas):
+        return numpy.zeros(n, dtype=numpy.int64)
+
+    ordinais = numpy.fromiter((d.toordinal() for d in datas), dtype=numpy.int64, count=len(datas))
+    indices = (ordinais - base.toordinal()) // passo
+    somas = numpy.bincount(indices, weights=numpy.array(centavos, dtype=numpy.float64), minlength=n)
+
+    return numpy.rint(somas).astype(numpy.int64)
+
+def _decimal(centavos):
+    """
+    Converte um número inteiro de centavos num `Decimal` com duas casas
+    decimais.
+    """
+
+    return (Decimal(int(centavos)) / 100).quantize(CENTAVO)
+
+def previsao_de_caixa(inicio, fim, periodo="dia", saldo_inicial=0):
+    """
+    Retorna uma lista de `PontoDaPrevisao` com a previsão do saldo no
+    banco entre as datas `inicio` e `fim`, inclusive.
+
+    Os depósitos e os débitos são lidos numa consulta cada e agrupados
+    por período de uma vez só, com o numpy, independente do número de
+    pagamentos. Os débitos são só os já lançados nos dias de trabalho do
+    intervalo (ver a documentação do módulo). O numpy só é carregado na
+    primeira previsão, e não junto com o módulo.
+
+    Argumentos:
+
+    - inicio, fim: objetos `datetime.date`.
+    - periodo: "dia" ou "semana"; as semanas começam na segunda-feira,
+      então a primeira e a última podem ser cortadas por `inicio` e
+      `fim`.
+    - saldo_inicial: o saldo no banco antes de `inicio`.
+    """
+
+    import numpy
+
+    if periodo not in PERIODOS:
+        raise ValueError(u"Período inválido: {0}".format(periodo))
+
+    if fim < inicio:
+        return []
+
+    passo = PERIODOS[periodo]
+    base = inicio - datetime.timedelta(inicio.weekday()) if periodo == "semana" else inicio
+    n = (fim - base).days // passo + 1
+
+    pagamentos = PagamentoComCartao.objects \
+                    .filter(data_do_deposito__range=(inicio, fim)) \
+                    .values_list("data_do_deposito", "valor", "bandeira__taxa")
+    datas, valores, taxas = zip(*pagamentos) or ((), (), ())
+    depositos = _somar_por_periodo(datas, [_centavos(valor - valor * taxa) for valor, taxa in zip(valores, taxas)],
+                                   base, passo, n)
+
+    movimentacoes = MovimentacaoBancaria.objects \
+                        .filter(dia__data__range=(inicio, fim), valor__lt=0, pgto_cartao__isnull=True) \
+                        .values_list("dia__data", "valor")
+    datas, valores = zip(*movimentacoes) or ((), ())
+    debitos = _somar_por_periodo(datas, [_centavos(valor) for valor in valores], base, passo, n)
+
+    saldos = _centavos(saldo_inicial) + numpy.cumsum(depositos + debitos)
+
+    pontos = []
+    for i in range(n):
+        inicio_do_periodo = base + datetime.timedelta(i * passo)
+        fim_do_periodo = inicio_do_periodo + datetime.timedelta(passo - 1)
+
+        pontos.append(PontoDaPrevisao(max(inicio_do_periodo, inicio),
+                                      min(fim_do_periodo, fim),
+                                      _decimal(depositos[i]),
+                                      _decimal(debitos[i]),
+                                      _decimal(saldos[i])))
+
+    return pontos
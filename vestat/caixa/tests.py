@@ -3,20 +3,31 @@ from datetime import date, time, datetime, timedelta
 import random
 from decimal import Decimal
 from fractions import Fraction
+from StringIO import StringIO
+from contextlib import contextmanager
 
 from django.test import TestCase
 from django.db.models import Sum, Count
 from django.conf import settings
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.db import transaction
 
 from models import Dia, Venda, DespesaDeCaixa, \
     secs_to_time, PagamentoComCartao, Bandeira, CategoriaDeMovimentacao, \
-    SLUG_CATEGORIA_GORJETA
+    SLUG_CATEGORIA_GORJETA, ResumoDoDia, ResumoDiario
 
 from vestat.config.models import VestatConfiguration
+from vestat.django_utils import format_currency
 from vestat.contabil.models import Registro, Transacao, Lancamento
+from vestat.feriados.core import limpar_indice
+from vestat.calendario import get_events
 
 from caixa import NOME_DO_REGISTRO
+from events import dia_events, dias_de_deposito_events, formato_do_link
+from previsao import previsao_de_caixa
+from middleware import AdiarResumosMiddleware
 
 
 def random_date(year=None, month=None, day=None):
@@ -164,6 +175,23 @@ class DiaTestCase(TestCase):
             dia = Dia(data=datetime(*data))
             self.assertEqual(dia.categoria_semanal(), resultado)
 
+    def test_periodos(self):
+        for data in [date(2011, 12, 31), date(2012, 3, 1), date(2012, 3, 2), date(2012, 1, 5)]:
+            Dia(data=data).save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Dia.periodos("month"), [(2011, 12), (2012, 1), (2012, 3)])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Dia._anos(), [2011, 2012])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Dia._meses(2012), [1, 3])
+
+        dias_de_marco = Dia.objects.filter(data__month=3)
+        self.assertEqual(Dia.periodos("year", dias_de_marco), [2012])
+        self.assertRaises(ValueError, Dia.periodos, "day")
+
 class VendaTestCase(TestCase):
     def setUp(self):
         self.dia = Dia(data=datetime(2012, 02, 14))
@@ -193,10 +221,15 @@ class VendaTestCase(TestCase):
 class TestCaseVestatBoilerplate(TestCase):
     """
     Um TestCase que cria os objetos `contabil.models.Registro` e
-    `config.models.VestatConfiguration` usados na aplicação.
+    `config.models.VestatConfiguration` usados na aplicação, e que
+    descarta o índice de feriados antes e depois de cada teste (o
+    rollback do banco de dados não o descarta).
     """
 
     def setUp(self):
+        limpar_indice()
+        self.addCleanup(limpar_indice)
+
         self.config = VestatConfiguration()
         self.config.save()
 
@@ -518,6 +551,38 @@ class DiaDezPorcentoAPagarTestCase(TestCaseVestatBoilerplate):
         dezp_a_pagar -= Decimal("10")
         self.assertEqual(self.dia.dez_porcento_a_pagar(), dezp_a_pagar)
 
+    def teste_fecha_abre_e_fecha_de_novo(self):
+        self.abre_venda_200_reais()
+        self.venda.fechar()
+        dezp_a_pagar = self.dia.dez_porcento_a_pagar()
+
+        self.venda.abrir()
+        self.assertEqual(self.dia.dez_porcento_a_pagar(), Decimal("0"))
+        self.assertTrue(Venda.objects.filter(pk=self.venda.pk).exists())
+
+        venda = Venda.objects.get(pk=self.venda.pk)
+        venda.fechar()
+        self.assertEqual(self.dia.dez_porcento_a_pagar(), dezp_a_pagar)
+        self.assertEqual(venda.transacao_10p.lancamentos.count(), 4)
+        self.assertTrue(venda.transacao_10p.eh_consistente)
+
+    def teste_fechar_varias(self):
+        vendas = []
+        for i in range(3):
+            self.abre_venda_200_reais()
+            vendas.append(self.venda)
+
+        Venda.fechar_varias(vendas)
+
+        self.assertEqual(Venda.fechadas.filter(dia=self.dia).count(), 3)
+        self.assertEqual(Lancamento.objects.count(), 12)
+        self.assertEqual(self.dia.vendas(), 3)
+
+        fracao_aumento_da_divida = Fraction.from_decimal(Decimal("60")) * \
+                Fraction(9, 10) *  \
+                self.config.fracao_10p_funcionarios
+        self.assertAlmostEqual(self.dia.dez_porcento_a_pagar(), Decimal(float(fracao_aumento_da_divida)))
+
 
 class PagamentoComCartaoTestCase(TestCaseVestatBoilerplate):
     fixtures = ["feriados_bancarios", "categorias_de_movimentacao_teste"]
@@ -611,3 +676,405 @@ class PagamentoComCartaoTestCase(TestCaseVestatBoilerplate):
 
             pgto = self.dummy_pgto(data_pgto, bandeira, Decimal("200"))
             self.assertEqual(pgto.data_do_deposito, data_prevista)
+
+    def teste_comando_recalcular_depositos(self):
+        debito = self.dummy_pgto(date(2012, 2, 17), self.bandeira_debito, Decimal("200"))
+        credito = self.dummy_pgto(date(2012, 3, 15), self.bandeira_credito, Decimal("200"))
+
+        def datas_dos_depositos():
+            return [e.date for e in get_events(date(2012, 2, 1), date(2012, 2, 29))
+                    if e.text.startswith(u"Entrada dos cartões")]
+        self.assertEqual(datas_dos_depositos(), [date(2012, 2, 23)])
+
+        Bandeira.objects.filter(pk=self.bandeira_debito.pk).update(prazo_de_deposito=3)
+
+        saida = StringIO()
+        call_command("recalcular_depositos", bandeira=self.bandeira_debito.pk, stdout=saida)
+        self.assertTrue(saida.getvalue().startswith(u"1 pagamentos lidos, 1 alterados"))
+
+        # sexta antes do carnaval + 3 dias úteis, também no calendário
+        self.assertEqual(PagamentoComCartao.objects.get(pk=debito.pk).data_do_deposito, date(2012, 2, 24))
+        self.assertEqual(datas_dos_depositos(), [date(2012, 2, 24)])
+        self.assertEqual(PagamentoComCartao.objects.get(pk=credito.pk).data_do_deposito, date(2012, 4, 15))
+
+        saida = StringIO()
+        call_command("recalcular_depositos", stdout=saida)
+        self.assertTrue(saida.getvalue().startswith(u"2 pagamentos lidos, 0 alterados"))
+
+
+class ResumoDoDiaTestCase(TestCaseVestatBoilerplate):
+    """
+    Testes do `Dia.resumo`, dos métodos de totais do dia que o usam e da
+    tabela de `ResumoDiario`.
+    """
+
+    fixtures = ["cartoes_teste", "categorias_de_movimentacao_teste"]
+
+    def setUp(self):
+        super(ResumoDoDiaTestCase, self).setUp()
+
+        self.dia = Dia(data=date(2013, 4, 1))
+        self.dia.save()
+
+        venda = Venda(dia=self.dia, mesa="1", hora_entrada=time(20, 0),
+                      hora_saida=time(22, 0), num_pessoas=4, categoria="L",
+                      conta=Decimal("200"), gorjeta=Decimal("20"),
+                      pgto_dinheiro=Decimal("100"), pgto_cheque=Decimal("50"))
+        venda.save()
+
+        PagamentoComCartao(venda=venda, valor=Decimal("30"), bandeira=Bandeira.objects.get(pk=2)).save()
+        PagamentoComCartao(venda=venda, valor=Decimal("20"), bandeira=Bandeira.objects.get(pk=1)).save()
+        venda.fechar()
+
+        Venda(dia=self.dia, mesa="2", hora_entrada=time(21, 0), num_pessoas=2,
+              categoria="L").save()
+
+        self.dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        self.dia.movimentacaobancaria_set.create(valor=Decimal("7"))
+        self.dia.ajustedecaixa_set.create(valor=Decimal("3"))
+
+        self.dia = Dia.objects.get(pk=self.dia.pk)
+
+    def test_totais(self):
+        self.assertEqual(self.dia.faturamento_dinheiro(), Decimal("100"))
+        self.assertEqual(self.dia.faturamento_cheque(), Decimal("50"))
+        self.assertEqual(self.dia.faturamento_cartao_debito(), Decimal("30"))
+        self.assertEqual(self.dia.faturamento_cartao_credito(), Decimal("20"))
+        self.assertEqual(self.dia.faturamento(), Decimal("200"))
+        self.assertEqual(self.dia.gorjeta(), Decimal("18"))
+        self.assertEqual(self.dia.num_pessoas(), 4)
+        self.assertEqual(self.dia.vendas(), 1)
+        self.assertEqual(self.dia.resumo().vendas_abertas, 1)
+        self.assertEqual(self.dia.permanencia_media(), time(2, 0))
+        self.assertEqual(self.dia.despesas_de_caixa(), Decimal("-10"))
+        # taxas dos cartões: 30 * 0.02 + 20 * 0.033
+        self.assertEqual(self.dia.debitos_bancarios(), Decimal("-1.26"))
+        self.assertEqual(self.dia.creditos_bancarios(), Decimal("7"))
+        self.assertEqual(self.dia.ajuste(), Decimal("3"))
+        self.assertEqual(self.dia.resultado(), Decimal("188.74"))
+
+    def test_resumo_eh_memorizado(self):
+        with self.assertNumQueries(2):
+            self.dia.faturamento()
+
+        with self.assertNumQueries(0):
+            self.dia.resultado()
+            self.dia.gorjeta()
+            self.dia.permanencia_media()
+            self.dia.captacao_por_pessoa()
+
+    def test_resumos_de_varios_dias(self):
+        outro_dia = Dia(data=date(2013, 4, 2))
+        outro_dia.save()
+
+        with self.assertNumQueries(2):
+            resumos = Dia.resumos(Dia.objects.all())
+
+        self.assertEqual(resumos[self.dia.pk].faturamento(), Decimal("200"))
+        self.assertEqual(resumos[outro_dia.pk].faturamento(), 0)
+
+    def test_com_totais(self):
+        Dia(data=date(2013, 4, 2)).save()
+        Dia(data=date(2013, 5, 1)).save()
+
+        with self.assertNumQueries(3):
+            dias = Dia.objects.com_totais(date(2013, 4, 1), date(2013, 4, 30), ordem="-data")
+
+        self.assertEqual([d.data for d in dias], [date(2013, 4, 2), date(2013, 4, 1)])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(dias[1].faturamento(), Decimal("200"))
+            self.assertEqual(dias[1].resumo().vendas_abertas, 1)
+            self.assertEqual(dias[0].resultado(), 0)
+
+    def test_listar_dias(self):
+        dados = Dia.listar_dias(date(2013, 4, 1), date(2013, 4, 30))
+
+        self.assertEqual(dados["faturamento_total"]["total"], Decimal("200"))
+        self.assertEqual(dados["faturamento_total"]["cartao_debito"], Decimal("30"))
+        self.assertEqual(dados["resultado_total"], Decimal("188.74"))
+        self.assertEqual(dados["gorjeta_total"], Decimal("18"))
+        self.assertEqual(dados["vendas_total"], 1)
+
+    def test_estruturar_dias(self):
+        dia_de_maio = Dia(data=date(2013, 5, 10))
+        dia_de_maio.save()
+        venda = Venda(dia=dia_de_maio, mesa="1", hora_entrada=time(20, 0),
+                      hora_saida=time(21, 0), num_pessoas=2, categoria="L",
+                      conta=Decimal("80"), pgto_dinheiro=Decimal("80"))
+        venda.save()
+        venda.fechar()
+
+        with self.assertNumQueries(4):
+            anos = Dia.estruturar_dias()
+
+        abril = anos[2013]["meses"][4]
+        maio = anos[2013]["meses"][5]
+
+        self.assertEqual(abril["nome"], u"abril")
+        self.assertEqual(abril["faturamento"], Decimal("200"))
+        self.assertEqual(abril["faturamento_acumulado"], Decimal("200"))
+        self.assertEqual(maio["faturamento"], Decimal("80"))
+        self.assertEqual(maio["faturamento_acumulado"], Decimal("280"))
+        self.assertEqual(maio["resultado_acumulado"], Decimal("268.74"))
+
+        dias_de_2013 = Dia.objects.filter(data__year=2013)
+        self.assertEqual(anos[2013]["faturamento"], Dia.faturamento_total(dias_de_2013))
+        self.assertEqual(anos[2013]["despesas"], Dia.despesas_total(dias_de_2013))
+        self.assertEqual(anos[2013]["num_pessoas"], Dia.num_pessoas_total(dias_de_2013))
+        self.assertEqual(anos[2013]["permanencia_media"], Dia.permanencia_media_total(dias_de_2013))
+
+    def test_estruturar_dias_lista_so_os_meses_dos_dias_dados(self):
+        Dia(data=date(2013, 5, 10)).save()
+
+        anos = Dia.estruturar_dias(Dia.objects.filter(data__month=5))
+        self.assertEqual(anos[2013]["meses"].keys(), [5])
+        self.assertEqual(anos[2013]["faturamento"], Decimal("200"))
+
+    def assertResumoDiarioAtualizado(self, dia):
+        resumo_diario = ResumoDiario.objects.get(dia=dia).resumo()
+        resumo_calculado = Dia._calcular_resumos([dia.pk])[dia.pk]
+
+        for campo in ResumoDoDia.CAMPOS:
+            self.assertEqual(getattr(resumo_diario, campo), getattr(resumo_calculado, campo), campo)
+
+    def test_resumo_diario_acompanha_as_mudancas(self):
+        self.assertResumoDiarioAtualizado(self.dia)
+
+        venda = self.dia.vendas_fechadas()[0]
+        venda.abrir()
+        self.assertResumoDiarioAtualizado(self.dia)
+        self.assertEqual(ResumoDiario.objects.get(dia=self.dia).vendas, 0)
+
+        venda.pagamentocomcartao_set.all()[0].delete()
+        self.dia.despesadecaixa_set.all().delete()
+        self.assertResumoDiarioAtualizado(self.dia)
+        self.assertEqual(ResumoDiario.objects.get(dia=self.dia).despesas_de_caixa, 0)
+
+        outro_dia = Dia(data=date(2013, 4, 2))
+        outro_dia.save()
+        self.assertResumoDiarioAtualizado(outro_dia)
+
+        outro_dia.delete()
+        self.assertFalse(ResumoDiario.objects.filter(dia=outro_dia.pk).exists())
+
+    def test_resumo_diario_acompanha_a_categoria_da_bandeira(self):
+        bandeira = Bandeira.objects.get(pk=2)
+        bandeira.categoria = "C"
+        bandeira.save()
+
+        self.assertResumoDiarioAtualizado(self.dia)
+        self.assertEqual(ResumoDiario.objects.get(dia=self.dia).cartao_credito, Decimal("50"))
+
+    def test_dias_sem_resumo_diario_sao_calculados_na_hora(self):
+        dia_de_maio = Dia(data=date(2013, 5, 10))
+        dia_de_maio.save()
+        Venda(dia=dia_de_maio, mesa="1", hora_entrada=time(20, 0),
+              hora_saida=time(21, 0), num_pessoas=2, categoria="L",
+              conta=Decimal("80"), pgto_dinheiro=Decimal("80")).fechar()
+
+        ResumoDiario.invalidar([self.dia.pk])
+
+        self.assertEqual(Dia.resumos([self.dia.pk])[self.dia.pk].faturamento(), Decimal("200"))
+        self.assertEqual(Dia.faturamento_total(), Decimal("280"))
+        self.assertEqual(Dia.faturamento_total_dinheiro(), Decimal("180"))
+        self.assertEqual(Dia.vendas_total(), 2)
+        self.assertEqual(Dia.resultado_total(), Decimal("268.74"))
+        self.assertEqual(Dia.faturamento_total(Dia.objects.filter(data__month=5)), Decimal("80"))
+
+    def test_recalcular_calcula_dentro_da_transacao(self):
+        eventos = []
+
+        commit_on_success = transaction.commit_on_success
+        @contextmanager
+        def registrar():
+            eventos.append("inicio")
+            with commit_on_success():
+                yield
+            eventos.append("fim")
+        transaction.commit_on_success = registrar
+        self.addCleanup(setattr, transaction, "commit_on_success", commit_on_success)
+
+        calcular_resumos = Dia.__dict__["_calcular_resumos"]
+        def calcular(cls, dias):
+            eventos.append("calculo")
+            return calcular_resumos.__func__(cls, dias)
+        Dia._calcular_resumos = classmethod(calcular)
+        self.addCleanup(setattr, Dia, "_calcular_resumos", calcular_resumos)
+
+        ResumoDiario.recalcular([self.dia.pk])
+
+        self.assertEqual(eventos, ["inicio", "calculo", "fim"])
+        self.assertResumoDiarioAtualizado(self.dia)
+
+    def test_comando_recalcular_resumos(self):
+        ResumoDiario.objects.all().delete()
+
+        call_command("recalcular_resumos", stdout=StringIO())
+
+        self.assertResumoDiarioAtualizado(self.dia)
+
+    def contar_recalculos(self):
+        """
+        Troca o `ResumoDiario.recalcular` por uma versão que anota os
+        dias recalculados em `self.recalculos` (desfeito no `tearDown`).
+        """
+
+        self.recalculos = []
+        recalcular = ResumoDiario.__dict__["recalcular"]
+
+        def contar(cls, dias):
+            self.recalculos.append(list(dias))
+            return recalcular.__func__(cls, dias)
+
+        ResumoDiario.recalcular = classmethod(contar)
+        self.addCleanup(setattr, ResumoDiario, "recalcular", recalcular)
+
+    def test_pagamento_com_cartao_recalcula_o_dia_uma_vez(self):
+        venda = self.dia.vendas_fechadas()[0]
+        self.contar_recalculos()
+
+        PagamentoComCartao(venda=venda, valor=Decimal("10"), bandeira=Bandeira.objects.get(pk=1)).save()
+
+        self.assertEqual(self.recalculos, [[self.dia.pk]])
+        self.assertResumoDiarioAtualizado(self.dia)
+
+    def test_adiar_recalculos(self):
+        self.contar_recalculos()
+
+        with ResumoDiario.adiar():
+            self.dia.despesadecaixa_set.create(valor=Decimal("-10"))
+            with ResumoDiario.adiar():
+                self.dia.ajustedecaixa_set.create(valor=Decimal("3"))
+
+            # enquanto isso, os totais do dia são calculados na hora
+            self.assertFalse(ResumoDiario.objects.filter(dia=self.dia).exists())
+            self.assertEqual(Dia.resumos([self.dia.pk])[self.dia.pk].ajustes, Decimal("6"))
+            self.assertEqual(self.recalculos, [])
+
+        self.assertEqual(self.recalculos, [[self.dia.pk]])
+        self.assertResumoDiarioAtualizado(self.dia)
+
+        with self.assertRaises(ValueError):
+            with ResumoDiario.adiar():
+                self.dia.despesadecaixa_set.create(valor=Decimal("-5"))
+                raise ValueError
+
+        self.assertEqual(len(self.recalculos), 1)
+        self.assertFalse(ResumoDiario.objects.filter(dia=self.dia).exists())
+        self.assertEqual(Dia.resumos([self.dia.pk])[self.dia.pk].despesas_de_caixa, Decimal("-25"))
+
+    def test_middleware_recalcula_no_fim_da_requisicao(self):
+        middleware = AdiarResumosMiddleware()
+        request = RequestFactory().get("/")
+        self.contar_recalculos()
+
+        middleware.process_request(request)
+        self.dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        self.dia.movimentacaobancaria_set.create(valor=Decimal("7"))
+        self.assertEqual(self.recalculos, [])
+        middleware.process_response(request, HttpResponse())
+
+        self.assertEqual(self.recalculos, [[self.dia.pk]])
+        self.assertResumoDiarioAtualizado(self.dia)
+
+        # outra requisição, que termina com uma exceção
+        middleware.process_request(request)
+        self.dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        middleware.process_exception(request, ValueError())
+        middleware.process_response(request, HttpResponse())
+
+        self.assertEqual(len(self.recalculos), 1)
+        self.assertEqual(Dia.resumos([self.dia.pk])[self.dia.pk].despesas_de_caixa, Decimal("-30"))
+
+    def test_eventos_do_calendario(self):
+        # O primeiro link carrega as URLs, e com elas os formulários dos
+        # relatórios, que consultam o banco ao serem importados.
+        formato_do_link()
+
+        with self.assertNumQueries(1):
+            eventos = list(dia_events(date(2013, 3, 31), date(2013, 4, 2)))
+
+        self.assertEqual([e.date for e in eventos], [date(2013, 3, 31), date(2013, 4, 1), date(2013, 4, 2)])
+        self.assertTrue(all(u'href="/caixa/{0:%Y/%m/%d}/"'.format(e.date) in e.text for e in eventos))
+        self.assertTrue(eventos[1].text.endswith(u"R$ " + format_currency(Decimal("200"))))
+        self.assertEqual(eventos[0].description, "")
+
+        ResumoDiario.invalidar([self.dia.pk])
+        eventos = list(dia_events(date(2013, 4, 1), date(2013, 4, 1)))
+        self.assertTrue(eventos[0].text.endswith(u"R$ " + format_currency(Decimal("200"))))
+
+    def test_eventos_de_deposito(self):
+        with self.assertNumQueries(1):
+            eventos = list(dias_de_deposito_events(date(2013, 4, 1), date(2013, 6, 30)))
+
+        datas = sorted(PagamentoComCartao.objects.values_list("data_do_deposito", flat=True))
+        self.assertEqual([e.date for e in eventos], sorted(set(datas)))
+        self.assertEqual(sum(len(e.description.splitlines()) for e in eventos), 2)
+
+
+class PrevisaoDeCaixaTestCase(TestCaseVestatBoilerplate):
+    """
+    Testes do `previsao.previsao_de_caixa`.
+    """
+
+    fixtures = ["cartoes_teste", "categorias_de_movimentacao_teste"]
+
+    def setUp(self):
+        super(PrevisaoDeCaixaTestCase, self).setUp()
+
+        dia = Dia(data=date(2013, 4, 1))
+        dia.save()
+
+        venda = Venda(dia=dia, mesa="1", hora_entrada=time(20, 0),
+                      hora_saida=time(22, 0), num_pessoas=2, categoria="L",
+                      conta=Decimal("300"))
+        venda.save()
+
+        # débito: 2 dias úteis, depositado em 03/04; crédito: 31 dias
+        # corridos, depositado em 02/05
+        PagamentoComCartao(venda=venda, valor=Decimal("100"), bandeira=Bandeira.objects.get(pk=2)).save()
+        PagamentoComCartao(venda=venda, valor=Decimal("200"), bandeira=Bandeira.objects.get(pk=1)).save()
+
+        outro_dia = Dia(data=date(2013, 4, 5))
+        outro_dia.save()
+        outro_dia.movimentacaobancaria_set.create(valor=Decimal("-50"))
+        outro_dia.movimentacaobancaria_set.create(valor=Decimal("20"))
+
+    def test_por_dia(self):
+        with self.assertNumQueries(2):
+            pontos = previsao_de_caixa(date(2013, 4, 1), date(2013, 4, 7))
+
+        self.assertEqual([p.inicio for p in pontos], [date(2013, 4, d) for d in range(1, 8)])
+        self.assertEqual([p.depositos for p in pontos], [0, 0, Decimal("98"), 0, 0, 0, 0])
+        self.assertEqual([p.debitos for p in pontos], [0, 0, 0, 0, Decimal("-50"), 0, 0])
+        self.assertEqual([p.saldo for p in pontos], [0, 0, 98, 98, 48, 48, 48])
+
+    def test_por_semana(self):
+        pontos = previsao_de_caixa(date(2013, 4, 3), date(2013, 5, 3), "semana",
+                                   saldo_inicial=Decimal("10"))
+
+        self.assertEqual(len(pontos), 5)
+        self.assertEqual((pontos[0].inicio, pontos[0].fim), (date(2013, 4, 3), date(2013, 4, 7)))
+        self.assertEqual((pontos[-1].inicio, pontos[-1].fim), (date(2013, 4, 29), date(2013, 5, 3)))
+        self.assertEqual(pontos[0].saldo, Decimal("58"))
+        self.assertEqual(pontos[-1].depositos, Decimal("193.40"))
+        self.assertEqual(pontos[-1].saldo, Decimal("251.40"))
+
+    def test_soma_em_centavos(self):
+        # 0,75 - 2% = 0,735, arredondado pra 0,74 (em float, 98 + 0,735
+        # seria arredondado pra 98,73)
+        venda = Venda.objects.get(dia__data=date(2013, 4, 1))
+        PagamentoComCartao(venda=venda, valor=Decimal("0.75"), bandeira=Bandeira.objects.get(pk=2)).save()
+        dia = Dia.objects.get(data=date(2013, 4, 5))
+        for i in range(3):
+            dia.movimentacaobancaria_set.create(valor=Decimal("-0.10"))
+
+        pontos = previsao_de_caixa(date(2013, 4, 1), date(2013, 4, 7))
+        self.assertEqual(str(pontos[2].depositos), "98.74")
+        self.assertEqual(str(pontos[4].debitos), "-50.30")
+        self.assertEqual(str(pontos[-1].saldo), "48.44")
+
+    def test_intervalo_vazio(self):
+        self.assertEqual(previsao_de_caixa(date(2013, 4, 2), date(2013, 4, 1)), [])
+        self.assertRaises(ValueError, previsao_de_caixa, date(2013, 4, 1), date(2013, 4, 2), "mes")
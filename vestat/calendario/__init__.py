@@ -1,2 +1,2 @@
 # -*- encoding: utf-8 -*-
-from core import Event, get_events
+from core import Event, get_events, depends_on
@@ -19,13 +19,68 @@ Pra criar um gerador de eventos:
       fim, ambos objetos `datetime.date`.
     - deve retornar uma sequência (list, tuple) ou gerador com objetos
       `Event` cuja data esteja entre as datas fornecidas, inclusive.
+
+3. Opcionalmente, declare com o decorator `depends_on` os modelos dos
+   quais os eventos gerados dependem. Os eventos de geradores com
+   dependências declaradas são guardados em cache por intervalo de
+   datas, e descartados quando um objeto de um desses modelos é salvo
+   ou removido. Geradores sem a declaração são chamados a cada consulta.
+
+   O cache fica na memória de cada processo, mas cada intervalo guarda
+   também a versão dos dados (ver `vestat.versao`)
+   em que foi gerado: alterações feitas por outro processo, ou sem
+   disparar os sinais (e.g. o comando `recalcular_depositos`), trocam a
+   versão e descartam os eventos antigos.
+
+Os geradores são procurados uma vez só, na primeira consulta. Se
+`settings.CALENDARIO_THREADS` for maior que 1, os geradores que não
+estão em cache são chamados em paralelo, nesse número de threads.
 """
 
 import logging
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+
+from vestat.versao import versao_dos_dados
 
 logger = logging.getLogger("vestat")
 
+MAX_CACHE_ENTRIES = 48
+"""
+Número máximo de intervalos de datas guardados em cache por gerador;
+passado esse número, os intervalos usados há mais tempo são descartados.
+"""
+
+_registry = None
+"""
+Lista de tuplas `(nome, gerador)` dos geradores de eventos encontrados,
+ou `None` se eles ainda não foram procurados.
+"""
+
+_cache = {}
+"""
+Cache dos eventos: associa o nome de cada gerador a um `OrderedDict`
+que associa cada intervalo `(begin, end)` a uma tupla `(versão, eventos)`
+com a versão dos dados e a lista de eventos gerada, do intervalo usado
+há mais tempo pro usado mais recentemente.
+"""
+
+_cache_lock = threading.Lock()
+"""
+Trava do `_cache`, consultado e alterado pelas threads dos geradores
+(ver `settings.CALENDARIO_THREADS`) e pelas do servidor.
+"""
+
+_dependents = {}
+"""
+Associa cada modelo aos nomes dos geradores que dependem dele.
+"""
+
 class Event():
     """
     Um evento de calendário.
@@ -49,15 +104,134 @@ class Event():
     def __unicode__(self):
         return u"{date} - {text}".format(**vars(self))
 
+def depends_on(*models):
+    """
+    Decorator que declara os modelos dos quais um gerador de eventos
+    depende (ver a documentação do módulo). Um gerador que não depende
+    de nenhum modelo (e.g. só das datas) pode ser declarado sem
+    argumentos, e fica em cache até o programa ser encerrado.
+    """
+
+    def decorator(function):
+        function.depends_on = models
+        return function
+    return decorator
+
+def clear_cache(sender=None, **kwargs):
+    """
+    Descarta os eventos em cache dos geradores que dependem do modelo
+    `sender`, ou de todos os geradores se `sender` não for dado.
+
+    É chamada quando um objeto de um modelo do qual algum gerador
+    depende é salvo ou removido.
+    """
+
+    with _cache_lock:
+        if sender is None:
+            _cache.clear()
+        else:
+            for name in _dependents.get(sender, ()):
+                _cache.pop(name, None)
+
+def _get_cached(name, key, version):
+    """
+    Retorna os eventos em cache do gerador `name` no intervalo `key`, ou
+    `None` se não houver eventos em cache na versão dos dados `version`.
+    """
+
+    with _cache_lock:
+        entries = _cache.get(name)
+        if entries is None or key not in entries:
+            return None
+
+        entry = entries.pop(key)
+        if entry[0] != version:
+            return None
+
+        # Volta pro fim da fila: é o intervalo usado mais recentemente.
+        entries[key] = entry
+        return entry[1]
+
+def _set_cached(name, key, version, events):
+    """
+    Guarda os eventos do gerador `name` no intervalo `key`, gerados na
+    versão dos dados `version`, descartando os intervalos usados há mais
+    tempo se passar de `MAX_CACHE_ENTRIES`.
+    """
+
+    with _cache_lock:
+        entries = _cache.setdefault(name, OrderedDict())
+        entries.pop(key, None)
+        entries[key] = (version, events)
+
+        while len(entries) > MAX_CACHE_ENTRIES:
+            entries.popitem(last=False)
+
+def get_generators():
+    """
+    Retorna uma lista de tuplas `(nome, gerador)` com os geradores de
+    eventos das aplicações instaladas em `settings.INSTALLED_APPS`.
+
+    Para cada aplicação `app`, procura-se um módulo `app.events`; caso
+    ele exista, todas as variáveis desse módulo que terminem em 'events'
+    são consideradas geradores. A busca é feita uma vez só.
+    """
+
+    global _registry
+
+    if _registry is None:
+        registry = []
+
+        for app in settings.INSTALLED_APPS:
+            events_module_name = app + ".events"
+
+            try:
+                module = __import__(events_module_name, fromlist=["events"])
+            except ImportError:
+                continue
+
+            for name, function in sorted(vars(module).items()):
+                if not name.endswith("events"):
+                    continue
+
+                name = "{0}.{1}".format(events_module_name, name)
+                registry.append((name, function))
+
+                for model in getattr(function, "depends_on", ()):
+                    if model not in _dependents:
+                        # Sem `dispatch_uid`: esse módulo pode ser
+                        # importado com dois nomes, cada um com o seu
+                        # cache, e os dois precisam ser limpos.
+                        post_save.connect(clear_cache, sender=model)
+                        post_delete.connect(clear_cache, sender=model)
+                    _dependents.setdefault(model, set()).add(name)
+
+        _registry = registry
+
+    return _registry
+
+def _run_generator(function, begin, end, close_connection=False):
+    """
+    Chama um gerador e retorna a lista de eventos gerados. Se
+    `close_connection` for `True`, fecha a conexão com o banco de dados
+    no fim (necessário quando o gerador roda numa thread separada).
+    """
+
+    try:
+        return list(function(begin, end))
+    finally:
+        if close_connection:
+            connection.close()
+
 def get_events(begin, end):
     """
     Retorna os eventos, de todos os aplicativos instalados, que
     aconteçam entre as duas datas fornecidas, inclusive.
 
-    Para cada aplicação `app` instalada em `settings.INSTALLED_APPS`,
-    procura-se um módulo `app.events`; caso ele exista, puxa todas as
-    variáveis desse módulo que terminem em 'events' e os chama como
-    geradores de eventos.
+    Os eventos de cada gerador (ver `get_generators`) são tirados do
+    cache quando possível (e gerados na versão atual dos dados); os que
+    faltam são gerados, em paralelo se
+    `settings.CALENDARIO_THREADS` for maior que 1.
 
     Finalmente, retorna todos os eventos gerados por ordem crescente de
     data.
@@ -69,19 +243,34 @@ def get_events(begin, end):
     """
 
     event_list = []
+    pending = []
+    version = versao_dos_dados()
 
-    for app in settings.INSTALLED_APPS:
-        events_module_name = app + ".events"
+    for name, function in get_generators():
+        cached = _get_cached(name, (begin, end), version)
 
-        try:
-            module = __import__(events_module_name, fromlist=["events"])
-        except ImportError:
-            pass
+        if cached is not None:
+            event_list.extend(cached)
         else:
-            generators = [i for i in vars(module).items() if i[0].endswith("events")]
+            pending.append((name, function))
+
+    threads = min(getattr(settings, "CALENDARIO_THREADS", 1), len(pending))
+
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            results = pool.map(lambda item: _run_generator(item[1], begin, end, True),
+                               pending)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_generator(function, begin, end) for name, function in pending]
+
+    for (name, function), result in zip(pending, results):
+        event_list.extend(result)
 
-            for name, function in generators:
-                result = list(function(begin, end))
-                event_list.extend(result)
+        if hasattr(function, "depends_on"):
+            _set_cached(name, (begin, end), version, result)
 
     return sorted(event_list, key=lambda e: e.date)
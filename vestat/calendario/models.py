@@ -0,0 +1,5 @@
+# -*- encoding: utf-8 -*-
+"""
+A aplicação `calendario` não tem modelos; esse módulo existe pra que o
+Django encontre os seus testes.
+"""
@@ -6,7 +6,20 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import threading
+from datetime import date
+
 from django.test import TestCase
+from django.test.utils import override_settings
+
+from vestat.feriados.models import Feriado
+from vestat.contabil.models import Registro
+from vestat.caixa import NOME_DO_REGISTRO
+from vestat.feriados.core import limpar_indice
+from vestat.versao import nova_versao_dos_dados
+
+import core
+from core import Event, get_events
 
 
 class SimpleTest(TestCase):
@@ -15,3 +28,133 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class GetEventsTestCase(TestCase):
+    """
+    Testes do `core.get_events`.
+    """
+
+    fixtures = ["feriados_bancarios"]
+
+    def setUp(self):
+        # Os links dos dias de trabalho carregam as URLs, e o admin da
+        # contabilidade precisa do registro ao ser importado.
+        Registro(nome=NOME_DO_REGISTRO).save()
+        core.clear_cache()
+        self.addCleanup(core.clear_cache)
+        self.addCleanup(limpar_indice)
+
+    def feriados(self, events):
+        return [e for e in events if e.text.startswith(u"Feriado")]
+
+    def contar_chamadas(self):
+        """
+        Troca os geradores por um só, que não depende de nenhum modelo, e
+        retorna a lista dos intervalos com que ele é chamado.
+        """
+
+        chamadas = []
+
+        @core.depends_on()
+        def contador_events(begin, end):
+            chamadas.append((begin, end))
+            return []
+
+        registry = core._registry
+        core._registry = [("contador_events", contador_events)]
+        self.addCleanup(setattr, core, "_registry", registry)
+        return chamadas
+
+    def test_eventos_do_mes(self):
+        events = get_events(date(2012, 2, 1), date(2012, 2, 29))
+
+        self.assertEqual([e.date for e in self.feriados(events)], [date(2012, 2, 20), date(2012, 2, 21)])
+        self.assertEqual(len([e for e in events if u"Caixa" in e.text]), 29)
+        self.assertEqual([e.date for e in events], sorted(e.date for e in events))
+
+    def test_cache(self):
+        get_events(date(2012, 2, 1), date(2012, 2, 29))
+
+        with self.assertNumQueries(0):
+            events = get_events(date(2012, 2, 1), date(2012, 2, 29))
+        self.assertEqual(len(self.feriados(events)), 2)
+
+        Feriado(nome=u"Aniversário", data_unica=date(2012, 2, 10)).save()
+
+        events = get_events(date(2012, 2, 1), date(2012, 2, 29))
+        self.assertEqual(len(self.feriados(events)), 3)
+
+    def test_cache_na_versao_dos_dados(self):
+        chamadas = self.contar_chamadas()
+        get_events(date(2012, 2, 1), date(2012, 2, 29))
+        get_events(date(2012, 2, 1), date(2012, 2, 29))
+        self.assertEqual(len(chamadas), 1)
+
+        # dados alterados sem os sinais, por outro processo por exemplo
+        nova_versao_dos_dados()
+        get_events(date(2012, 2, 1), date(2012, 2, 29))
+        self.assertEqual(len(chamadas), 2)
+
+    def test_descarta_os_intervalos_usados_ha_mais_tempo(self):
+        chamadas = self.contar_chamadas()
+        meses = [(date(2012, mes, 1), date(2012, mes, 28)) for mes in (1, 2, 3)]
+
+        original = core.MAX_CACHE_ENTRIES
+        core.MAX_CACHE_ENTRIES = 2
+        self.addCleanup(setattr, core, "MAX_CACHE_ENTRIES", original)
+
+        get_events(*meses[0])
+        get_events(*meses[1])
+        get_events(*meses[0])
+        get_events(*meses[2]) # descarta fevereiro, não janeiro
+        self.assertEqual(chamadas, meses)
+
+        get_events(*meses[0])
+        get_events(*meses[2])
+        self.assertEqual(chamadas, meses)
+        get_events(*meses[1])
+        self.assertEqual(chamadas, meses + [meses[1]])
+
+    def test_cache_usado_por_varias_threads(self):
+        original = core.MAX_CACHE_ENTRIES
+        core.MAX_CACHE_ENTRIES = 3
+        self.addCleanup(setattr, core, "MAX_CACHE_ENTRIES", original)
+        erros = []
+
+        def usar_o_cache():
+            try:
+                for i in range(2000):
+                    key = (i % 5, None)
+                    core._set_cached("teste", key, 1, [i])
+                    core._get_cached("teste", key, 1)
+            except Exception as e:
+                erros.append(e)
+
+        threads = [threading.Thread(target=usar_o_cache) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(erros, [])
+        self.assertEqual(len(core._cache["teste"]), 3)
+
+    @override_settings(CALENDARIO_THREADS=2)
+    def test_geradores_em_paralelo(self):
+        def a_events(begin, end):
+            yield Event(end, u"b")
+            yield Event(begin, u"a")
+
+        def c_events(begin, end):
+            return [Event(begin, u"c")]
+
+        registry = core._registry
+        core._registry = [("a_events", a_events), ("c_events", c_events)]
+        try:
+            events = get_events(date(2012, 2, 1), date(2012, 2, 29))
+        finally:
+            core._registry = registry
+
+        self.assertEqual(sorted(e.text for e in events), [u"a", u"b", u"c"])
+        self.assertEqual(events[-1].text, u"b")
@@ -9,23 +9,25 @@ from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
-from django.db.models import Model
 
-from vestat.caixa.models import PagamentoComCartao
 from vestat.config.management.converter_dump import converter
 from vestat.django_utils import criar_superusuario
+from vestat.versao import nova_versao_dos_dados
 
-def sync_and_evolve():
+def sync_and_evolve(hint=True):
     """
     Roda os comandos 'syncdb' e 'evolve' do django management, de forma
     não-interativa.
+
+    Com `hint`, o 'evolve' aplica as mudanças que ele mesmo deduz dos
+    modelos; sem, aplica as evoluções escritas em ``<app>/evolutions``.
     """
 
     # Sincroniza o banco de dados
     call_command('syncdb', interactive=False)
 
     # Evolui o banco de dados com o Django Evolution
-    call_command('evolve', interactive=False, execute=True, hint=True, database="default")
+    call_command('evolve', interactive=False, execute=True, hint=hint, database="default")
 
 
 def versao_1_2_2(cmd, *args):
@@ -66,6 +68,10 @@ def versao_1_2_2(cmd, *args):
 
     call_command("loaddata", tmp_dump_filename)
 
+    # Os objetos carregados não trocam a versão dos dados sozinhos (ver
+    # `vestat.versao.dados_alterados`).
+    nova_versao_dos_dados()
+
     print("Removendo arquivo temporário...")
     os.remove(tmp_dump_filename)
 
@@ -75,10 +81,26 @@ def versao_1_2_2(cmd, *args):
     print("Reunindo arquivos estáticos...")
     call_command("collectstatic", interactive=False)
 
-    print("Re-salvando os pagamentos com cartões pra preencher data de depósito")
-    for pagamento in PagamentoComCartao.objects.all():
-        pagamento.data_do_deposito = pagamento._data_do_deposito()
-        Model.save(pagamento)
+    print("Preenchendo a data de depósito dos pagamentos com cartões")
+    call_command("recalcular_depositos")
+
+
+def versao_1_3_0(cmd, *args):
+    """
+    Atualizações pra versão 1.3.0.
+
+    Ações:
+
+    - Cria as tabelas novas (resumos diários e saldos mensais da
+      contabilidade) e aplica as evoluções do banco de dados
+      (índices da data das transações e da conta dos lançamentos)
+    - Preenche a tabela de resumos diários com os dias já existentes
+    """
+
+    sync_and_evolve(hint=False)
+
+    print("Calculando os resumos diários...")
+    call_command("recalcular_resumos")
 
 
 def versao_1_2_0(cmd, *args):
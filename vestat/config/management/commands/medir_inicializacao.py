@@ -0,0 +1,127 @@
+# -*- encoding: utf-8 -*-
+"""
+Comando 'medir_inicializacao', mede o tempo que um processo novo do
+Vestat leva pra atender a primeira requisição -- carregar o Django, as
+URLs e as views, e responder a uma página.
+
+Cada medição é feita num processo Python separado, pra que os módulos
+já carregados por este processo não entrem na conta. Também mostra se
+as bibliotecas pesadas dos gráficos (matplotlib e numpy) foram
+carregadas pelo caminho.
+
+As requisições são feitas numa cópia descartável do banco de dados (ver
+`copiar_banco_de_dados`), apagada no fim, e não no banco de verdade. Os
+redirecionamentos são seguidos: a medição de "/caixa/" inclui a página
+do dia para a qual ele redireciona.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urlparse
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import vestat
+
+MODULOS_PESADOS = ["matplotlib", "numpy"]
+"""
+Módulos que não deveriam ser carregados por páginas sem gráficos.
+"""
+
+SCRIPT = """
+import json, sys, time
+inicio = time.time()
+
+from django.conf import settings
+settings.DATABASES["default"]["NAME"] = {banco!r}
+
+from django.test.client import Client
+from django.test.utils import setup_test_environment
+
+setup_test_environment()
+resposta = Client().get({url!r}, follow=True)
+
+print(json.dumps({{
+    "segundos": time.time() - inicio,
+    "status": resposta.status_code,
+    "url": resposta.redirect_chain[-1][0] if resposta.redirect_chain else {url!r},
+    "modulos": [m for m in {modulos!r} if m in sys.modules],
+}}))
+"""
+"""
+Código executado em cada processo medido; a saída é um objeto JSON.
+"""
+
+
+def copiar_banco_de_dados(diretorio):
+    """
+    Copia o banco de dados configurado (um arquivo do SQLite) pro
+    `diretorio`, e retorna o caminho da cópia. Se o banco ainda não
+    existir, retorna o caminho sem criar nada: o
+    `AutocreateDatabaseMiddleware` cria um banco vazio na primeira
+    requisição.
+    """
+
+    original = settings.DATABASES["default"]["NAME"]
+    copia = os.path.join(diretorio, os.path.basename(original))
+
+    if os.path.exists(original):
+        shutil.copy(original, copia)
+
+    return copia
+
+
+def medir(url, banco):
+    """
+    Roda um processo Python novo que faz uma requisição GET à `url`,
+    seguindo os redirecionamentos, com o banco de dados no arquivo
+    `banco`, e retorna o dicionário com o resultado (chaves "segundos",
+    "status", "url" -- a URL final -- e "modulos").
+    """
+
+    env = dict(os.environ)
+    env["DJANGO_SETTINGS_MODULE"] = settings.SETTINGS_MODULE
+    caminhos = [os.path.dirname(os.path.dirname(os.path.abspath(vestat.__file__)))] + sys.path
+    env["PYTHONPATH"] = os.pathsep.join(p for p in caminhos if p)
+
+    script = SCRIPT.format(url=url, banco=banco, modulos=MODULOS_PESADOS)
+    processo = subprocess.Popen([sys.executable, "-c", script], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    saida, erros = processo.communicate()
+
+    if processo.returncode != 0:
+        raise CommandError(u"Erro ao medir {0}:\n{1}".format(url, erros.decode("utf-8", "replace")))
+
+    return json.loads(saida.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = u"Mede o tempo até a primeira requisição de um processo novo do Vestat."
+    args = u"[url ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--vezes", dest="vezes", type="int", default=5,
+                    help=u"Número de processos medidos pra cada URL (padrão: 5)."),
+    )
+
+    def handle(self, *urls, **options):
+        diretorio = tempfile.mkdtemp()
+
+        try:
+            banco = copiar_banco_de_dados(diretorio)
+
+            for url in urls or ["/caixa/", "/relatorios/"]:
+                medicoes = [medir(url, banco) for i in range(options["vezes"])]
+                tempos = sorted(m["segundos"] for m in medicoes)
+                ultima = medicoes[-1]
+
+                self.stdout.write(u"{0} ({1}): mediana {2:.3f}s, mínimo {3:.3f}s (status {4}; carregou: {5})\n"
+                                  .format(url, urlparse.urlsplit(ultima["url"]).path, tempos[len(tempos) // 2], tempos[0],
+                                          ultima["status"], u", ".join(ultima["modulos"]) or u"nada"))
+        finally:
+            shutil.rmtree(diretorio)
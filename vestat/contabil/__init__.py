@@ -1,2 +1,2 @@
 # -*- encoding: utf-8 -*-
-from core import SEPARADOR_DE_CONTAS, Contas, join
+from core import SEPARADOR_DE_CONTAS, Contas, NoDeConta, join
@@ -1,6 +1,19 @@
 # -*- encoding: utf-8 -*-
+from collections import namedtuple
+from decimal import Decimal
+
 SEPARADOR_DE_CONTAS = ":"
 
+NoDeConta = namedtuple("NoDeConta", "nome saldo_proprio saldo_total filhos")
+"""
+Nó da árvore de saldos de `Contas.arvore`.
+
+- nome: o nome da conta, sem o nome das contas-mães.
+- saldo_proprio: a soma dos lançamentos feitos direto na conta.
+- saldo_total: o saldo próprio mais os saldos totais das subcontas.
+- filhos: lista de `NoDeConta` das subcontas, em ordem alfabética.
+"""
+
 def join(*contas):
     """
     Junta as contas dadas usando o símbolo separador em
@@ -32,6 +45,11 @@ class Contas:
             "contas": {},
         }
 
+        self._saldos = {
+            "saldo": Decimal("0"),
+            "contas": {},
+        }
+
     def __eq__(self, other):
         """
         Retorna `True` se as hierarquias de `self` e `other` forem iguais; `False` senão.
@@ -51,7 +69,7 @@ class Contas:
 
         """
 
-        self.digerir_transacoes(registro.transacoes.all())
+        self.digerir_transacoes(registro.transacoes.prefetch_related("lancamentos"))
 
     def digerir_transacoes(self, transacoes):
         """
@@ -103,6 +121,57 @@ class Contas:
 
         pai["lancamentos"].append(lancamento)
 
+    def digerir_balancos(self, registro, de=None, ateh=None):
+        """
+        Alimenta a árvore de saldos (ver `Contas.arvore`) com os
+        balanços das contas de um registro, dentro de um intervalo de
+        datas dadas, inclusive.
+
+        Os balanços saem de uma consulta agrupada por conta (ver
+        `models.Registro.balancos`); nenhum lançamento é carregado.
+
+        Argumentos:
+
+        - registro: objeto `models.Registro`.
+        - de: a data inicial; um objeto `datetime.date`
+        - ateh: a data final; um objeto `datetime.date`
+
+        """
+
+        for conta, saldo in registro.balancos(de=de, ateh=ateh).items():
+            pai = self._saldos
+            for nome in conta.split(SEPARADOR_DE_CONTAS):
+                if nome not in pai["contas"]:
+                    pai["contas"][nome] = {
+                        "saldo": Decimal("0"),
+                        "contas": {},
+                    }
+
+                pai = pai["contas"][nome]
+
+            pai["saldo"] += saldo
+
+    @property
+    def arvore(self):
+        """
+        Retorna a árvore de saldos das contas com as quais o objeto foi
+        alimentado por `Contas.digerir_balancos`.
+
+        A raiz é um `NoDeConta` sem nome, cujos filhos são as contas de
+        nível primário; o saldo total da raiz é a soma de todas as
+        contas. Os saldos totais de cada conta incluem os das suas
+        subcontas.
+
+        """
+
+        def loop(nome, saldos):
+            filhos = [loop(nome_filho, saldos_filho)
+                      for nome_filho, saldos_filho in sorted(saldos["contas"].items())]
+            saldo_total = saldos["saldo"] + sum(filho.saldo_total for filho in filhos)
+            return NoDeConta(nome, saldos["saldo"], saldo_total, filhos)
+
+        return loop(u"", self._saldos)
+
     @property
     def contas_e_lancamentos(self):
         """
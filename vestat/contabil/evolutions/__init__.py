@@ -0,0 +1,3 @@
+SEQUENCE = [
+    'indices_do_balanco',
+]
@@ -0,0 +1,11 @@
+# -*- encoding: utf-8 -*-
+"""
+Índices usados pelo balanço das contas: as transações são filtradas
+pela data, e os lançamentos pela conta.
+"""
+from django_evolution.mutations import ChangeField
+
+MUTATIONS = [
+    ChangeField('Transacao', 'data', initial=None, db_index=True),
+    ChangeField('Lancamento', 'conta', initial=None, db_index=True),
+]
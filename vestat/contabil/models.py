@@ -20,6 +20,9 @@ import datetime
 from decimal import Decimal
 
 from django.db import models
+from django.db.models import Sum
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 
 from vestat.config import config_pages, Link
@@ -31,11 +34,34 @@ class Registro(models.Model):
     def __unicode__(self):
         return self.nome
 
+    def _lancamentos(self, de=None, ateh=None):
+        """
+        Retorna um QuerySet dos lançamentos das transações do registro
+        dentro de um intervalo de datas dadas, inclusive.
+        """
+
+        filtros = {}
+
+        if de:
+            assert isinstance(de, datetime.date)
+            filtros["transacao__data__gte"] = de
+
+        if ateh:
+            assert isinstance(ateh, datetime.date)
+            filtros["transacao__data__lte"] = ateh
+
+        return Lancamento.objects.filter(transacao__registro=self, **filtros).order_by()
+
     def balanco(self, conta, de=None, ateh=None):
         """
         Calcula o balanço financeiro de uma conta dentro de um intervalo
         de datas dadas, inclusive.
 
+        A soma é feita pelo banco de dados. Sem data inicial, o balanço
+        parte do `SaldoCheckpoint` do último mês fechado antes de `ateh`
+        e soma só os lançamentos depois dele, então o custo não cresce
+        com o histórico.
+
         Argumentos:
 
         - conta: um nome de conta seguindo o formato descrito no módulo.
@@ -43,29 +69,56 @@ class Registro(models.Model):
         - ateh: a data final; um objeto `datetime.date`
         """
 
-        filtros = {}
+        if de is None:
+            checkpoint = SaldoCheckpoint.obter(self, conta, ateh)
+            if checkpoint:
+                de = checkpoint.data + datetime.timedelta(1)
+                return checkpoint.saldo + self._somar(conta, de, ateh)
 
-        if de:
-            assert isinstance(de, datetime.date)
-            filtros["data__gte"] = de
+        return self._somar(conta, de, ateh)
 
-        if ateh:
-            assert isinstance(ateh, datetime.date)
-            filtros["data__lte"] = ateh
+    def _somar(self, conta, de=None, ateh=None):
+        """
+        Soma os lançamentos de uma conta dentro de um intervalo de datas
+        dadas, inclusive, sem usar os checkpoints.
+        """
+
+        lancamentos = self._lancamentos(de, ateh).filter(conta=conta)
+        resultado = lancamentos.aggregate(Sum("valor"))["valor__sum"]
+        return resultado if resultado else Decimal('0')
+
+    def balancos(self, contas=None, de=None, ateh=None):
+        """
+        Calcula os balanços financeiros de várias contas dentro de um
+        intervalo de datas dadas, inclusive, em uma consulta.
+
+        Retorna um `dict` que associa o nome de cada conta ao seu
+        balanço. Contas pedidas em `contas` que não têm lançamentos no
+        intervalo recebem balanço zero.
+
+        Argumentos:
+
+        - contas: uma lista de nomes de conta; se não for dada, calcula
+          o balanço de todas as contas com lançamentos no intervalo.
+        - de: a data inicial; um objeto `datetime.date`
+        - ateh: a data final; um objeto `datetime.date`
+        """
+
+        lancamentos = self._lancamentos(de, ateh)
+        resultado = {}
 
-        resultado = Decimal('0')
-        transacoes = self.transacoes.filter(**filtros)
+        if contas is not None:
+            lancamentos = lancamentos.filter(conta__in=contas)
+            resultado = dict((conta, Decimal('0')) for conta in contas)
 
-        for transacao in transacoes:
-            for lancamento in transacao.lancamentos.all():
-                if lancamento.conta == conta:
-                    resultado += lancamento.valor
+        for linha in lancamentos.values("conta").annotate(total=Sum("valor")):
+            resultado[linha["conta"]] = linha["total"]
 
         return resultado
 
 class Transacao(models.Model):
     registro = models.ForeignKey(Registro, related_name="transacoes")
-    data = models.DateField("Data")
+    data = models.DateField("Data", db_index=True)
     descricao = models.TextField(blank=True)
 
     class Meta:
@@ -92,7 +145,7 @@ class Transacao(models.Model):
 class Lancamento(models.Model):
     transacao = models.ForeignKey(Transacao, related_name="lancamentos")
     valor = models.DecimalField("Valor", max_digits=10, decimal_places=2)
-    conta = models.TextField()
+    conta = models.TextField(db_index=True)
 
     class Meta:
         verbose_name = "Lançamento"
@@ -108,6 +161,127 @@ class Lancamento(models.Model):
         super(Lancamento, self).save(*args, **kwargs)
 
 
+def fim_do_mes(data):
+    """Retorna o último dia do mês de `data`."""
+
+    prox_mes = datetime.date(data.year + data.month // 12, data.month % 12 + 1, 1)
+    return prox_mes - datetime.timedelta(1)
+
+
+class SaldoCheckpoint(models.Model):
+    """
+    Saldo de uma conta de um registro no fim de um mês fechado -- a
+    soma de todos os lançamentos da conta até o último dia do mês,
+    inclusive.
+
+    Os checkpoints são criados sob demanda pelo `Registro.balanco`, e
+    removidos quando uma transação ou lançamento do mês, ou de um mês
+    anterior, é salvo ou removido. Alterações feitas direto no banco de
+    dados (e.g. `QuerySet.update`) não removem os checkpoints.
+    """
+
+    registro = models.ForeignKey(Registro, related_name="checkpoints")
+    conta = models.TextField()
+    data = models.DateField("Data")
+    saldo = models.DecimalField("Saldo", max_digits=12, decimal_places=2)
+
+    class Meta:
+        unique_together = [("registro", "conta", "data")]
+        ordering = ["-data"]
+
+    def __unicode__(self):
+        return u"{conta} em {data}: {saldo}".format(**vars(self))
+
+    @classmethod
+    def obter(cls, registro, conta, ateh=None):
+        """
+        Retorna o checkpoint da conta no fim do último mês fechado até
+        a data `ateh` (ou até hoje, se não for dada), criando-o se
+        necessário a partir do checkpoint anterior mais próximo.
+
+        Retorna `None` se não houver nenhum mês fechado até `ateh`. Um
+        mês é fechado quando já acabou.
+
+        Duas requisições podem calcular o mesmo checkpoint ao mesmo
+        tempo; a segunda a gravá-lo usa o checkpoint gravado pela
+        primeira.
+        """
+
+        hoje = datetime.date.today()
+        if isinstance(ateh, datetime.datetime):
+            ateh = ateh.date()
+        if ateh is None or ateh >= hoje:
+            ateh = hoje
+
+        data = ateh if ateh == fim_do_mes(ateh) and ateh < hoje \
+                    else ateh.replace(day=1) - datetime.timedelta(1)
+
+        checkpoints = cls.objects.filter(registro=registro, conta=conta, data__lte=data)
+
+        try:
+            anterior = checkpoints[0]
+        except IndexError:
+            anterior = None
+            saldo = registro._somar(conta, ateh=data)
+        else:
+            if anterior.data == data:
+                return anterior
+
+            saldo = anterior.saldo + registro._somar(conta, anterior.data + datetime.timedelta(1), data)
+
+        # O get_or_create trata o IntegrityError do unique_together
+        # (dentro de um savepoint) e lê o checkpoint que ganhou a corrida.
+        checkpoint, criado = cls.objects.get_or_create(registro=registro, conta=conta, data=data,
+                                                       defaults={"saldo": saldo})
+        return checkpoint
+
+    @classmethod
+    def invalidar(cls, registro_id, data):
+        """
+        Remove os checkpoints do registro que incluem a data `data`.
+        """
+
+        cls.objects.filter(registro=registro_id, data__gte=data).delete()
+
+
+def _invalidar_checkpoints_da_transacao(transacao_id):
+    for registro_id, data in Transacao.objects.filter(pk=transacao_id).values_list("registro", "data"):
+        SaldoCheckpoint.invalidar(registro_id, data)
+
+@receiver(pre_save, sender=Transacao, dispatch_uid="invalidar_checkpoints_antes")
+@receiver(pre_save, sender=Lancamento, dispatch_uid="invalidar_checkpoints_antes")
+def invalidar_checkpoints_antes(sender, instance, **kwargs):
+    """
+    Invalida os checkpoints afetados pelos valores antigos de uma
+    transação ou lançamento alterado (e.g. quando a data muda).
+    """
+
+    if instance.pk is None:
+        return
+
+    if sender is Transacao:
+        _invalidar_checkpoints_da_transacao(instance.pk)
+    else:
+        transacoes = Lancamento.objects.filter(pk=instance.pk).values_list("transacao", flat=True)
+        for transacao_id in transacoes:
+            _invalidar_checkpoints_da_transacao(transacao_id)
+
+@receiver(post_save, sender=Transacao, dispatch_uid="invalidar_checkpoints")
+@receiver(pre_delete, sender=Transacao, dispatch_uid="invalidar_checkpoints")
+@receiver(post_save, sender=Lancamento, dispatch_uid="invalidar_checkpoints")
+@receiver(post_delete, sender=Lancamento, dispatch_uid="invalidar_checkpoints")
+def invalidar_checkpoints(sender, instance, **kwargs):
+    """
+    Invalida os checkpoints afetados por uma transação ou lançamento
+    salvo ou removido.
+    """
+
+    if sender is Transacao:
+        SaldoCheckpoint.invalidar(instance.registro_id, instance.data)
+    else:
+        _invalidar_checkpoints_da_transacao(instance.transacao_id)
+
+
 config_pages["vestat"].add(
     Link(
         "transacoes-de-contabilidade",
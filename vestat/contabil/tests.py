@@ -5,8 +5,10 @@ from decimal import Decimal
 from django.test import TestCase
 from django.core.exceptions import ValidationError
 
-from contabil import join, Contas
-from contabil.models import Registro, Transacao, Lancamento
+from vestat.versao import versao_dos_dados
+
+from contabil import join, Contas, NoDeConta
+from contabil.models import Registro, Transacao, Lancamento, SaldoCheckpoint
 
 class RegistroTestCase(TestCase):
     """
@@ -43,6 +45,140 @@ class RegistroTestCase(TestCase):
         self.assertEqual(self.registro.balanco(join("gastos", "funcionarios")), Decimal("100"))
         self.assertEqual(self.registro.balanco(join("bens", "caixa")), Decimal("-100"))
 
+    def criar_transacao(self, data, lancamentos):
+        transacao = Transacao(registro=self.registro, data=data, descricao="Transação de teste")
+        transacao.save()
+
+        for conta, valor in lancamentos:
+            transacao.lancamentos.create(conta=conta, valor=valor)
+
+        return transacao
+
+    def test_balanco_no_intervalo(self):
+        for dia in [1, 2, 3]:
+            self.criar_transacao(datetime.date(2013, 5, dia), [
+                (join("gastos", "funcionarios"), Decimal("10")),
+                (join("bens", "caixa"), Decimal("-10")),
+            ])
+
+        outro_registro = Registro(nome="Outro registro")
+        outro_registro.save()
+        Transacao(registro=outro_registro, data=datetime.date(2013, 5, 2)).save()
+        outro_registro.transacoes.all()[0].lancamentos.create(
+            conta=join("gastos", "funcionarios"), valor=Decimal("1000"))
+
+        conta = join("gastos", "funcionarios")
+
+        self.assertEqual(self.registro.balanco(conta), Decimal("30"))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.registro.balanco(conta, de=datetime.date(2013, 5, 2)), Decimal("20"))
+
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2013, 5, 2)), Decimal("20"))
+        self.assertEqual(self.registro.balanco(conta, datetime.date(2013, 5, 2), datetime.date(2013, 5, 2)), Decimal("10"))
+        # contas-mães não somam as subcontas
+        self.assertEqual(self.registro.balanco("gastos"), Decimal("0"))
+
+    def test_balancos(self):
+        self.criar_transacao(datetime.date(2013, 5, 1), [
+            (join("gastos", "funcionarios"), Decimal("10")),
+            (join("bens", "caixa"), Decimal("-10")),
+        ])
+        self.criar_transacao(datetime.date(2013, 5, 2), [
+            (join("gastos", "funcionarios"), Decimal("5")),
+            (join("bens", "banco"), Decimal("-5")),
+        ])
+
+        with self.assertNumQueries(1):
+            balancos = self.registro.balancos()
+
+        self.assertEqual(balancos, {
+            join("gastos", "funcionarios"): Decimal("15"),
+            join("bens", "caixa"): Decimal("-10"),
+            join("bens", "banco"): Decimal("-5"),
+        })
+
+        balancos = self.registro.balancos([join("bens", "caixa"), join("dividas", "10%")],
+                                          de=datetime.date(2013, 5, 2))
+        self.assertEqual(balancos, {
+            join("bens", "caixa"): Decimal("0"),
+            join("dividas", "10%"): Decimal("0"),
+        })
+
+    def test_balanco_usa_checkpoints(self):
+        conta = join("gastos", "funcionarios")
+        for data in [datetime.date(2012, 1, 10), datetime.date(2012, 2, 10), datetime.date(2012, 3, 10)]:
+            self.criar_transacao(data, [(conta, Decimal("10")), (join("bens", "caixa"), Decimal("-10"))])
+
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 2, 20)), Decimal("20"))
+        checkpoint = SaldoCheckpoint.objects.get(registro=self.registro, conta=conta)
+        self.assertEqual((checkpoint.data, checkpoint.saldo), (datetime.date(2012, 1, 31), Decimal("10")))
+
+        # com o checkpoint pronto: uma consulta pra ele, outra pro resto
+        with self.assertNumQueries(2):
+            self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 2, 20)), Decimal("20"))
+
+        # o checkpoint de março parte do de fevereiro
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 31)), Decimal("30"))
+        self.assertEqual(self.registro.balanco(conta), Decimal("30"))
+        self.assertEqual(SaldoCheckpoint.objects.get(data=datetime.date(2012, 3, 31)).saldo, Decimal("30"))
+
+    def test_checkpoint_nao_troca_a_versao_dos_dados(self):
+        conta = join("gastos", "funcionarios")
+        self.criar_transacao(datetime.date(2012, 1, 10), [(conta, Decimal("10"))])
+        versao = versao_dos_dados()
+
+        self.assertEqual(self.registro.balanco(conta), Decimal("10"))
+        self.assertTrue(SaldoCheckpoint.objects.exists())
+        self.assertEqual(versao_dos_dados(), versao)
+
+        # alterar os dados remove o checkpoint e troca a versão
+        self.criar_transacao(datetime.date(2012, 1, 11), [(conta, Decimal("5"))])
+        self.assertNotEqual(versao_dos_dados(), versao)
+
+    def test_checkpoint_criado_ao_mesmo_tempo(self):
+        conta = join("gastos", "funcionarios")
+        self.criar_transacao(datetime.date(2012, 1, 10), [(conta, Decimal("10"))])
+
+        # outra requisição grava o checkpoint enquanto este é calculado
+        somar = self.registro._somar
+        def somar_e_criar(*args, **kwargs):
+            SaldoCheckpoint.objects.create(registro=self.registro, conta=conta,
+                                           data=datetime.date(2012, 1, 31), saldo=Decimal("10"))
+            return somar(*args, **kwargs)
+        self.registro._somar = somar_e_criar
+
+        checkpoint = SaldoCheckpoint.obter(self.registro, conta, ateh=datetime.date(2012, 2, 20))
+        self.assertEqual((checkpoint.data, checkpoint.saldo), (datetime.date(2012, 1, 31), Decimal("10")))
+        self.assertEqual(SaldoCheckpoint.objects.count(), 1)
+
+    def test_checkpoints_sao_invalidados(self):
+        conta = join("gastos", "funcionarios")
+        transacao = self.criar_transacao(datetime.date(2012, 2, 10), [(conta, Decimal("10"))])
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 15)), Decimal("10"))
+
+        # lançamento novo num mês fechado
+        self.criar_transacao(datetime.date(2012, 1, 5), [(conta, Decimal("5"))])
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 15)), Decimal("15"))
+
+        # lançamento alterado
+        lancamento = transacao.lancamentos.get()
+        lancamento.valor = Decimal("20")
+        lancamento.save()
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 15)), Decimal("25"))
+
+        # transação movida pra depois do intervalo
+        transacao.data = datetime.date(2012, 4, 1)
+        transacao.save()
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 15)), Decimal("5"))
+
+        # transação removida
+        transacao.data = datetime.date(2012, 1, 1)
+        transacao.save()
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 15)), Decimal("25"))
+        transacao.delete()
+        self.assertEqual(self.registro.balanco(conta, ateh=datetime.date(2012, 3, 15)), Decimal("5"))
+
     def test_transacao_com_soma_zero_eh_consistente(self):
         transacao = Transacao(
                 registro=self.registro,
@@ -191,3 +327,35 @@ class ContasTestCase(TestCase):
 
         self.assertEqual(hierarquia_dos_lancamentos.contas, resultado_correto)
 
+    def teste_arvore_de_saldos(self):
+        for conta, valor in [(join("gastos", "funcionarios"), Decimal("10.00")),
+                             (join("gastos", "fornecedores", "vinho"), Decimal("15.00")),
+                             (join("gastos", "fornecedores", "mercado"), Decimal("5.00")),
+                             (join("gastos", "fornecedores"), Decimal("1.00")),
+                             (join("bens", "caixa"), Decimal("-31.00"))]:
+            self.transacao.lancamentos.create(valor=valor, conta=conta)
+
+        antiga = Transacao(registro=self.registro, data=datetime.date(2012, 1, 1))
+        antiga.save()
+        antiga.lancamentos.create(valor=Decimal("100"), conta=join("gastos", "funcionarios"))
+
+        contas = Contas()
+        with self.assertNumQueries(1):
+            contas.digerir_balancos(self.registro, de=datetime.date(2013, 1, 1))
+
+        arvore = contas.arvore
+        self.assertEqual(arvore.saldo_total, Decimal("0"))
+        self.assertEqual([filho.nome for filho in arvore.filhos], [u"bens", u"gastos"])
+
+        gastos = arvore.filhos[1]
+        self.assertEqual((gastos.saldo_proprio, gastos.saldo_total), (Decimal("0"), Decimal("31")))
+
+        fornecedores = gastos.filhos[0]
+        self.assertEqual(fornecedores, NoDeConta(u"fornecedores", Decimal("1"), Decimal("21"), [
+            NoDeConta(u"mercado", Decimal("5"), Decimal("5"), []),
+            NoDeConta(u"vinho", Decimal("15"), Decimal("15"), []),
+        ]))
+
+        todas = Contas()
+        todas.digerir_balancos(self.registro)
+        self.assertEqual(todas.arvore.filhos[1].saldo_total, Decimal("131"))
@@ -1,10 +1,79 @@
 # -*- encoding: utf-8 -*-
-from itertools import groupby
+import bisect
+import datetime
+
+from django.db.models.signals import post_save, post_delete
 
 from vestat.utils import daterange_inclusive
 
 from feriados.models import Feriado
 
+_indice = {}
+"""
+Cache dos feriados de cada ano: associa cada ano a um `dict` que
+associa cada data de feriado à lista de objetos `Feriado` que caem
+nela.
+"""
+
+_dias_uteis = {}
+"""
+Cache dos dias úteis de cada ano: associa cada ano a uma lista ordenada
+dos objetos `datetime.date` dos seus dias úteis.
+"""
+
+_feriados = None
+"""
+Cache da lista de objetos `Feriado` cadastrados, ou `None` se eles
+ainda não foram carregados.
+"""
+
+def limpar_indice(*args, **kwargs):
+    """
+    Descarta o índice de feriados; ele é remontado na próxima consulta.
+
+    É chamada sempre que um `Feriado` é salvo ou removido.
+    """
+
+    global _feriados
+
+    _indice.clear()
+    _dias_uteis.clear()
+    _feriados = None
+
+# Sem `dispatch_uid`: esse módulo pode ser importado com dois nomes
+# ("feriados.core" e "vestat.feriados.core"), cada um com o seu cache, e
+# os dois precisam ser limpos.
+post_save.connect(limpar_indice, sender=Feriado)
+post_delete.connect(limpar_indice, sender=Feriado)
+
+def indice_do_ano(ano):
+    """
+    Retorna um `dict` que associa cada data de feriado do ano fornecido
+    à lista de objetos `Feriado` que caem nela.
+
+    Os feriados são carregados do banco de dados uma vez só, e o índice
+    de cada ano é montado na primeira consulta a ele.
+
+    Argumentos:
+        - ano: um inteiro; o ano consultado.
+    """
+
+    global _feriados
+
+    if ano not in _indice:
+        if _feriados is None:
+            _feriados = list(Feriado.objects.all())
+
+        indice = {}
+        for feriado in _feriados:
+            data = feriado.data_em(ano)
+            if data is not None:
+                indice.setdefault(data, []).append(feriado)
+
+        _indice[ano] = indice
+
+    return _indice[ano]
+
 def eh_feriado(data):
     """
     Retorna `True` se houver um feriado cadastrado na data fornecida, e
@@ -14,10 +83,7 @@ def eh_feriado(data):
         - data: um objeto `datetime.date`.
     """
 
-    for feriado in Feriado.objects.all():
-        if feriado.acontece_em(data):
-            return True
-    return False
+    return data in indice_do_ano(data.year)
 
 def eh_dia_util(data):
     """
@@ -31,25 +97,74 @@ def eh_dia_util(data):
 
     return data.weekday() in range(0, 5) and not(eh_feriado(data))
 
+def dias_uteis_do_ano(ano):
+    """
+    Retorna uma lista ordenada dos objetos `datetime.date` dos dias
+    úteis do ano fornecido (ver `eh_dia_util`). A lista é montada uma
+    vez só por ano, junto com o índice de feriados.
+
+    Argumentos:
+        - ano: um inteiro; o ano consultado.
+    """
+
+    if ano not in _dias_uteis:
+        feriados = indice_do_ano(ano)
+        datas = daterange_inclusive(datetime.date(ano, 1, 1), datetime.date(ano, 12, 31))
+        _dias_uteis[ano] = [data for data in datas
+                            if data.weekday() < 5 and data not in feriados]
+
+    return _dias_uteis[ano]
+
+def somar_dias_uteis(data, dias):
+    """
+    Retorna a data que fica `dias` dias úteis depois da data fornecida
+    (que não conta, seja ou não um dia útil).
+
+    A busca é uma bissecção na lista de dias úteis do ano, então o
+    custo não depende do número de dias.
+
+    Argumentos:
+        - data: um objeto `datetime.date`.
+        - dias: um inteiro não-negativo; o número de dias úteis.
+    """
+
+    if not dias:
+        return data
+
+    ano = data.year
+    uteis = dias_uteis_do_ano(ano)
+    # índice do primeiro dia útil depois de `data`
+    i = bisect.bisect_right(uteis, data)
+
+    while i + dias > len(uteis):
+        dias -= len(uteis) - i
+        ano += 1
+        uteis = dias_uteis_do_ano(ano)
+        i = 0
+
+    return uteis[i + dias - 1]
+
 def feriados_entre(d1, d2):
     """
-    Retorna uma lista de tuplas com os feriados entre duas datas,
-    *inclusive*. As tuplas possuem o formato `(date, feriado)`, onde:
+    Retorna um iterator de tuplas com os feriados entre duas datas,
+    *inclusive*, em ordem de data. As tuplas possuem o formato
+    `(date, feriado)`, onde:
 
     - `date` é o objeto `datetime.date` do dia do feriado
     - `Feriado` é o objeto `Feriado` correspondente.
 
+    Usa o índice de feriados de cada ano (ver `indice_do_ano`); as
+    tuplas são geradas sob demanda, um ano de cada vez.
+
     Argumentos:
         - d1: objeto `datetime.date`, a data de início da busca.
         - d2: objeto `datetime.date`, a data de fim da busca.
     """
 
-    datas = daterange_inclusive(d1, d2)
-    datas_agrupadas_por_ano = groupby(datas, lambda d: d.year)
+    for ano in range(d1.year, d2.year + 1):
+        indice = indice_do_ano(ano)
 
-    for ano, datas in datas_agrupadas_por_ano:
-        datas_feriados = {(f.data_em(ano), f) for f in Feriado.objects.all()}
-        for data_teste in datas:
-            for data_feriado, feriado in datas_feriados:
-                if data_feriado == data_teste:
-                    yield (data_feriado, feriado)
+        for data in sorted(indice):
+            if d1 <= data <= d2:
+                for feriado in indice[data]:
+                    yield (data, feriado)
@@ -6,10 +6,12 @@ Funções se comportam de acordo com o esperado pela aplicação
 `calendario`.
 """
 
-from vestat.calendario import Event
+from vestat.calendario import Event, depends_on
 
 from core import feriados_entre
+from models import Feriado
 
+@depends_on(Feriado)
 def feriados_events(begin, end):
     """
     Eventos pros feriados.
@@ -13,6 +13,42 @@ from django.conf import settings
 from vestat.config import config_pages, Link
 from django.core.urlresolvers import reverse_lazy
 
+_pascoas = {}
+"""
+Cache das datas da Páscoa de cada ano.
+"""
+
+_expressoes = {}
+"""
+Cache das expressões de data anual móvel já compiladas, indexadas pelo
+texto da expressão.
+"""
+
+def pascoa(ano):
+    """
+    Retorna o objeto `datetime.date` da Páscoa do ano fornecido.
+
+    Argumentos:
+        - ano: um inteiro; o ano consultado.
+    """
+
+    if ano not in _pascoas:
+        _pascoas[ano] = easter.easter(ano)
+    return _pascoas[ano]
+
+def compilar_expressao(expressao):
+    """
+    Retorna o código compilado de uma expressão de data anual móvel.
+
+    Argumentos:
+        - expressao: a expressão, como no campo `Feriado.data_anual_movel`.
+    """
+
+    if expressao not in _expressoes:
+        _expressoes[expressao] = compile(expressao, "<data_anual_movel>", "eval")
+    return _expressoes[expressao]
+
+
 class Feriado(models.Model):
     """
     Um feriado de data única, anual fixa ou anual móvel.
@@ -64,8 +100,8 @@ class Feriado(models.Model):
         Argumentos:
             - ano: um inteiro; o ano consultado.
         """
-        return eval(self.data_anual_movel, {
-            "pascoa": easter.easter(ano),
+        return eval(compilar_expressao(self.data_anual_movel), {
+            "pascoa": pascoa(ano),
             "d": timedelta,
         })
 
@@ -1,17 +1,30 @@
 # -*- encoding: utf-8 -*-
-from datetime import date
+from datetime import date, timedelta
 from dateutil import easter
 
 from django.test import TestCase
 from django.core.exceptions import ValidationError
 
 from feriados.models import Feriado
-from core import eh_feriado, feriados_entre
+from core import eh_feriado, eh_dia_util, feriados_entre, limpar_indice, somar_dias_uteis
 
 def tenta_clean(instance):
     return lambda: instance.clean()
 
 
+class IndiceLimpoTestCase(TestCase):
+    """
+    Um TestCase que descarta o índice de feriados (ver
+    `core.indice_do_ano`) antes e depois de cada teste: o rollback do
+    banco de dados no fim de um teste não dispara os sinais que o
+    descartam, e os feriados de um teste ficariam no índice do próximo.
+    """
+
+    def setUp(self):
+        limpar_indice()
+        self.addCleanup(limpar_indice)
+
+
 class ArgumentosInsuficientesTestCase(TestCase):
     def teste_sem_nada(self):
         f = Feriado()
@@ -95,10 +108,12 @@ class DataAnualMovelEvalInconsistenteTestCase(TestCase):
         self.assertRaises(ValidationError, tenta_clean(feriado))
 
 
-class FeriadosBancarios2012TestCase(TestCase):
+class FeriadosBancarios2012TestCase(IndiceLimpoTestCase):
     fixtures = ["feriados_bancarios.json"]
 
     def setUp(self):
+        super(FeriadosBancarios2012TestCase, self).setUp()
+
         # Feriados de 2012
         # Fonte: http://calendario.retira.com.br/feriados/brasil/2012/
 
@@ -123,7 +138,54 @@ class FeriadosBancarios2012TestCase(TestCase):
                 self.fail("{0} deve ser feriado!".format(deve_ser_feriado))
 
 
-class FeriadosEntreTestCase(TestCase):
+class IndiceDeFeriadosTestCase(IndiceLimpoTestCase):
+    fixtures = ["feriados_bancarios.json"]
+
+    def teste_consulta_o_banco_uma_vez(self):
+        with self.assertNumQueries(1):
+            for dia in range(1, 32):
+                eh_feriado(date(2012, 12, dia))
+                eh_feriado(date(2013, 12, dia))
+
+        self.assertTrue(eh_feriado(date(2013, 3, 31))) # páscoa
+
+    def teste_feriado_novo_invalida_o_indice(self):
+        self.assertFalse(eh_feriado(date(2012, 8, 15)))
+
+        feriado = Feriado(nome=u"Assunção", data_anual_fixa="15/08")
+        feriado.save()
+        self.assertTrue(eh_feriado(date(2012, 8, 15)))
+
+        feriado.delete()
+        self.assertFalse(eh_feriado(date(2012, 8, 15)))
+
+
+class SomarDiasUteisTestCase(IndiceLimpoTestCase):
+    fixtures = ["feriados_bancarios.json"]
+
+    def somar_um_por_um(self, data, dias):
+        while dias:
+            data += timedelta(1)
+            if eh_dia_util(data):
+                dias -= 1
+        return data
+
+    def teste_carnaval(self):
+        # sexta antes do carnaval de 2012 + 1 dia útil = quarta de cinzas
+        self.assertEqual(somar_dias_uteis(date(2012, 2, 17), 1), date(2012, 2, 22))
+        self.assertEqual(somar_dias_uteis(date(2012, 2, 17), 0), date(2012, 2, 17))
+
+    def teste_virada_de_ano(self):
+        self.assertEqual(somar_dias_uteis(date(2012, 12, 31), 1), date(2013, 1, 2))
+        self.assertEqual(somar_dias_uteis(date(2012, 12, 31), 300), self.somar_um_por_um(date(2012, 12, 31), 300))
+
+    def teste_igual_a_contar_um_por_um(self):
+        for data in [date(2012, 1, 1), date(2012, 2, 18), date(2012, 4, 6), date(2012, 11, 14)]:
+            for dias in [1, 2, 5, 30]:
+                self.assertEqual(somar_dias_uteis(data, dias), self.somar_um_por_um(data, dias))
+
+
+class FeriadosEntreTestCase(IndiceLimpoTestCase):
     fixtures = ["feriados_bancarios.json"]
 
     def teste_exclusive(self):
@@ -139,3 +201,13 @@ class FeriadosEntreTestCase(TestCase):
 
         self.assertEqual(len(list(feriados_entre(d1, d2))), 3)
         # ano novo, carnaval, carnaval
+
+    def teste_varios_anos_em_ordem(self):
+        with self.assertNumQueries(1):
+            feriados = list(feriados_entre(date(2011, 12, 20), date(2013, 1, 5)))
+
+        datas = [data for data, feriado in feriados]
+        self.assertEqual(datas, sorted(datas))
+        self.assertEqual(datas[0], date(2011, 12, 25))
+        self.assertEqual(datas[-1], date(2013, 1, 1))
+        self.assertEqual(len(feriados), 1 + 12 + 1)
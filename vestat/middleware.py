@@ -12,6 +12,7 @@ from django.contrib.auth import authenticate, login
 
 from vestat.config.models import VestatConfiguration
 from vestat.django_utils import criar_superusuario
+from vestat.versao import adiar_nova_versao
 
 
 logger = logging.getLogger(settings.NOME_APLICACAO)
@@ -74,3 +75,33 @@ class AutologinMiddleware():
                 logger.warn("User {username} is not active".format(**kwargs))
         else:
             logger.warn("Cannot login {username} using password {password}".format(**kwargs))
+
+
+class AdiarVersaoDosDadosMiddleware:
+    """
+    Troca a versão dos dados (ver `vestat.versao`) uma vez só, no fim
+    da requisição, em vez de a cada objeto salvo ou removido.
+
+    Deve vir antes do `AdiarResumosMiddleware` em `MIDDLEWARE_CLASSES`,
+    pra que os resumos recalculados no fim da requisição entrem na
+    mesma troca.
+
+    """
+
+    def process_request(self, request):
+        request._adiar_versao = adiar_nova_versao()
+        request._adiar_versao.__enter__()
+
+    def process_exception(self, request, exception):
+        adiar = request.__dict__.pop("_adiar_versao", None)
+        if adiar is not None:
+            try:
+                adiar.__exit__(type(exception), exception, None)
+            except type(exception):
+                pass
+
+    def process_response(self, request, response):
+        adiar = request.__dict__.pop("_adiar_versao", None)
+        if adiar is not None:
+            adiar.__exit__(None, None, None)
+        return response
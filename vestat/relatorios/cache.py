@@ -0,0 +1,44 @@
+# -*- encoding: utf-8 -*-
+"""
+Cache dos resultados dos relatórios.
+
+Os relatórios já renderizados ficam no cache ``relatorios`` (ver
+`settings.CACHES`), que fica em disco e é compartilhado entre o
+servidor e o comando `precalcular_relatorios`. As chaves incluem a
+versão dos dados (ver `vestat.versao`), que muda sempre que os dados
+do caixa ou da contabilidade mudam; um resultado calculado antes da
+mudança nunca mais é encontrado, e acaba removido pelo próprio cache.
+"""
+
+from django.core.cache import get_cache
+
+from vestat.temp import fingerprint
+from vestat.versao import versao_dos_dados
+
+CACHE = "relatorios"
+"""
+Nome do cache (em `settings.CACHES`) usado pros relatórios.
+"""
+
+def chave(*partes):
+    """
+    Retorna a chave do cache pro resultado identificado por `partes`
+    (o nome do relatório e os seus filtros, por exemplo) na versão
+    atual dos dados.
+    """
+
+    return "relatorio-" + fingerprint((versao_dos_dados(),) + partes)
+
+def buscar(chave):
+    """
+    Retorna o resultado guardado na `chave`, ou `None` se não houver.
+    """
+
+    return get_cache(CACHE).get(chave)
+
+def guardar(chave, valor):
+    """
+    Guarda o resultado `valor` na `chave`.
+    """
+
+    get_cache(CACHE).set(chave, valor)
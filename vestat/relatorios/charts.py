@@ -0,0 +1,272 @@
+# -*- encoding: utf-8 -*-
+"""
+Gráficos dos relatórios.
+
+Este módulo não importa o matplotlib nem o numpy: eles só são
+carregados quando um gráfico é desenhado pela primeira vez (ver
+`reports2.elements.figure_png`), pra que as páginas sem gráficos -- a
+tela do caixa, por exemplo -- não paguem o tempo de carregá-los.
+"""
+from decimal import Decimal
+
+from django.db.models.query import QuerySet
+
+from vestat.caixa.models import Dia, DespesaDeCaixa, MovimentacaoBancaria, CategoriaDeMovimentacao
+from vestat.relatorios.reports2 import ReportElement
+from vestat.relatorios.reports2.elements import BarChartElement, figure_png, png_html
+
+
+class MonthlyRollup(object):
+    """
+    Totais de cada mês de um conjunto de dias, calculados uma vez só
+    (ver `Dia.resumos_por_mes`) e compartilhados pelos elementos do
+    relatório de meses.
+
+    Iterar sobre o objeto retorna tuplas ``(ano, mes, resumo)``, em ordem
+    crescente de mês, onde `resumo` é o `ResumoDoDia` com os totais do
+    mês.
+    """
+
+    def __init__(self, dias):
+        """
+        Argumentos:
+
+            - dias: um QuerySet ou uma lista de objetos `Dia`.
+        """
+
+        if not isinstance(dias, QuerySet):
+            dias = Dia.objects.filter(pk__in=[dia.pk for dia in dias])
+
+        self.meses = Dia.resumos_por_mes(dias)
+
+    def __iter__(self):
+        for (ano, mes), resumo in self.meses.items():
+            yield ano, mes, resumo
+
+    def __len__(self):
+        return len(self.meses)
+
+
+class MonthlyRollupMixin:
+    """
+    Mixin pra elementos de relatório que usam os totais por mês dos seus
+    dados.
+
+    O relatório pode entregar um `MonthlyRollup` já calculado no atributo
+    `rollup`; senão, ele é calculado a partir dos dados do elemento na
+    primeira chamada a `get_rollup`.
+    """
+
+    rollup = None
+
+    def get_rollup(self):
+        if self.rollup is None:
+            self.rollup = MonthlyRollup(self.data)
+        return self.rollup
+
+
+class DespesasPorMesChart(MonthlyRollupMixin, BarChartElement):
+    """
+    Gera gráfico de barras de despesas de cada mês, e uma linha de tendência.
+
+    Gráfico de barras:
+
+    - eixo X -> meses
+    - eixo Y -> total de despesas de cada mês
+
+    """
+
+    title = "Gráfico de despesas"
+    chart_title = u"Despesas totais por mês"
+    color = "r"
+
+    def get_bars(self):
+        return [("%02d/%04d" % (mes, ano), -resumo.despesas())
+                for ano, mes, resumo in self.get_rollup()]
+
+
+class FaturamentoPorMesChart(MonthlyRollupMixin, BarChartElement):
+    """
+    Gera gráfico de barras de faturamento de cada mês, e uma linha de tendência.
+
+    Gráfico de barras:
+
+    - eixo X -> meses
+    - eixo Y -> faturamento de cada mês
+
+    """
+
+    title = "Gráfico de faturamentos"
+    chart_title = u"Faturamento total por mês"
+    color = "g"
+
+    def get_bars(self):
+        return [("%02d/%04d" % (mes, ano), resumo.faturamento())
+                for ano, mes, resumo in self.get_rollup()]
+
+
+class ResultadoPorMesChart(MonthlyRollupMixin, BarChartElement):
+    """
+    Gera gráfico de barras de resultado de cada mês, e uma linha de tendência.
+
+    Gráfico de barras:
+
+    - eixo X -> meses
+    - eixo Y -> resultado (faturamento menos as despesas) de cada mês
+
+    """
+
+    title = "Gráfico de resultados"
+    chart_title = u"Resultado total por mês"
+    label_offsets = (200, 500)
+
+    def get_bars(self):
+        return [("%02d/%04d" % (mes, ano), resumo.resultado())
+                for ano, mes, resumo in self.get_rollup()]
+
+    def bar_color(self, value):
+        return "g" if value > 0 else "r"
+
+
+GRAFICOS_DE_MESES = {
+    "despesas": DespesasPorMesChart,
+    "faturamento": FaturamentoPorMesChart,
+    "resultado": ResultadoPorMesChart,
+}
+"""
+Gráficos do relatório de meses que podem ser pedidos a `grafico_de_meses`.
+"""
+
+
+class DespesasPorCategoriaCharts(ReportElement):
+    """
+    Gera gráficos de torta sobre o total de despesas, com a porcentagem
+    de cada categoria.
+
+    Gera um gráfico pra 'raiz' (categorias sem mãe), e um gráfico pra
+    cada categoria que tenha filhas, com as porcentagens das despesas
+    das filhas com relação à mãe.
+
+    """
+
+    title = "Gráficos de torta"
+
+    def render_html(self):
+        """
+        Renderiza o gráfico em HTML, usando o matplotlib.
+
+        """
+
+        def arvore_categorias(categorias):
+            """
+            Retorna uma lista representando a árvore de categorias.
+
+            A lista tem como elementos dicionários, cada um
+            representando uma categoria e contendo as seguintes chaves:
+
+                - nome: o nome da categoria
+                - porcentagem: a porcentagem que essa categoria
+                  contribui pro total de despesas de sua categoria-mãe
+                  (ou pro total de todas as despesas, caso a categoria
+                  não tenha mãe).
+                - filhos: uma lista de dicionários com essas mesmas
+                  chaves, representando as categorias-filhas dessa
+                  categoria.
+
+            """
+            despesas = list(DespesaDeCaixa.objects.filter(dia__in=self.data, categoria__in=categorias)) + \
+                    list(MovimentacaoBancaria.objects.filter(dia__in=self.data, valor__lt=0, categoria__in=categorias))
+            total_despesas_das_categorias = Decimal(sum(d.valor for d in despesas))
+
+            output_total = []
+
+            for categoria in categorias:
+                despesas_da_categoria = [d for d in despesas if d.categoria == categoria]
+                total_despesas_da_categoria = Decimal(sum(d.valor for d in despesas_da_categoria))
+
+                output_categoria = {
+                    "nome": categoria.nome,
+                    "porcentagem": total_despesas_da_categoria / total_despesas_das_categorias,
+                }
+
+                output_total.append(output_categoria)
+
+                if categoria.filhas.count():
+                    output_categoria["filhos"] = arvore_categorias(list(categoria.filhas.all()))
+
+            output_total.sort(key=lambda c: c["porcentagem"], reverse=True)
+
+            return output_total
+
+        categorias = CategoriaDeMovimentacao.objects.all()
+        categorias_raiz = [c for c in categorias if not c.mae]
+
+        arvore = arvore_categorias(categorias_raiz)
+
+
+        def montar_listas(nome, arvore, listas):
+            """
+            Transforma a árvore de categorias em uma lista de
+            dicionários não-recursiva.
+
+            Cada dicionário dessa lista representa categorias-irmã --
+            categorias que são filhas da mesma mãe, e no caso da raiz,
+            categorias que não têm mãe. Eles possuem as seguintes chaves:
+
+                - mae: o nome da categoria-mãe, ou "Raiz" caso não haja
+                  mãe.
+
+                - irmas: uma lista de dicionários, cada um com as
+                  seguintes chaves:
+
+                    - nome: o nome da categoria
+
+                    - porcentagem: a porcentagem que essa categoria
+                      contribui pro total de despesas de sua categoria-mãe
+                      (ou pro total de todas as despesas, caso a categoria
+                      não tenha mãe).
+
+            Categorias com porcentagem menor que a designada na variável
+            `LIMITE` são agrupadas sob o rótulo "Outros", pra evitar que
+            sejam exibidas diversas frações da torta muito pequenas e
+            seus rótulos se embaralhem.
+            """
+
+            LIMITE = Decimal("0.05")
+
+            lista = { "mae": nome, "irmas": [] }
+            listas.append(lista)
+
+            for categoria in arvore:
+                if categoria["porcentagem"] > LIMITE:
+                    lista["irmas"].append({ "nome": categoria["nome"], "porcentagem": categoria["porcentagem"] })
+                else:
+                    if lista["irmas"][-1]["nome"] == "Outros":
+                        outros = lista["irmas"][-1]
+                    else:
+                        outros = { "nome": "Outros", "porcentagem": Decimal("0") }
+                        lista["irmas"].append(outros)
+
+                    outros["porcentagem"] += categoria["porcentagem"]
+
+                if "filhos" in categoria:
+                    montar_listas(categoria["nome"], categoria["filhos"], listas)
+
+        listas = []
+        montar_listas("Raiz", arvore, listas)
+
+        output = u""
+
+        for lista in listas:
+            labels = [c["nome"] for c in lista["irmas"]]
+            fracs = [c["porcentagem"] for c in lista["irmas"]]
+
+            def draw(figure, labels=labels, fracs=fracs, title=lista["mae"]):
+                ax = figure.add_subplot(111)
+                ax.pie(fracs, labels=labels, autopct='%1.1f%%', startangle=90)
+                ax.set_title(title)
+
+            key = (self.__class__.__name__, lista["mae"], labels, [float(f) for f in fracs])
+            output += png_html(figure_png(key, (6, 6), 100, draw)) + u"\n"
+
+        return output
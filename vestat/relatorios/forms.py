@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 import calendar
-from datetime import date
+from datetime import date, timedelta
 
 from django import forms
 
 from relatorios.widgets import MonthYearWidget
 from caixa.models import Dia
+from caixa.previsao import previsao_de_caixa
 
 class RelatorioSimplesForm(forms.Form):
     de = forms.DateField(label="Início", required=False)
@@ -80,6 +81,17 @@ class DateFilterForm2(FilterForm):
 
         return filtered
 
+    @property
+    def filter_info(self):
+        if self.is_bound:
+            if self.is_valid():
+                datas = [self.cleaned_data.get("from_date"), self.cleaned_data.get("to_date")]
+                return " - ".join("{:%d/%m/%Y}".format(d) if d else "..." for d in datas)
+            else:
+                return "Período inválido"
+        else:
+            return ""
+
 
 class AnoFilterForm(FilterForm):
     ano = forms.IntegerField(label="Ano", required=True)
@@ -109,7 +121,7 @@ class IntervaloMesesFilterForm(FilterForm):
         ("csv", "CSV"),
     )
 
-    _anos_com_dias = [d.year for d in Dia.objects.dates("data", "year")]
+    _anos_com_dias = Dia.periodos("year")
 
     from_date = forms.DateField(label="Início", widget=MonthYearWidget(years=_anos_com_dias))
     to_date = forms.DateField(label="Fim", widget=MonthYearWidget(years=_anos_com_dias))
@@ -145,3 +157,58 @@ class IntervaloMesesFilterForm(FilterForm):
                 return "Intervalo inválido"
         else:
             return ""
+
+
+class PrevisaoDeCaixaFilterForm(FilterForm):
+    """
+    Formulário do relatório de previsão de caixa. Em vez de filtrar os
+    dados, calcula a previsão (ver `caixa.previsao.previsao_de_caixa`)
+    a partir da data fornecida pela view.
+    """
+
+    FORMAT_CHOICES = (
+        ("html", "HTML"),
+        ("csv", "CSV"),
+        ("json", "JSON"),
+    )
+
+    PERIODO_CHOICES = (
+        ("dia", "Dia"),
+        ("semana", "Semana"),
+    )
+
+    HORIZONTE_PADRAO = 90
+
+    inicio = forms.DateField(label="Início", required=False)
+    horizonte = forms.IntegerField(label="Dias", required=False, min_value=1, max_value=3660,
+                                   initial=HORIZONTE_PADRAO)
+    periodo = forms.ChoiceField(label="Agrupar por", required=False, choices=PERIODO_CHOICES, initial="dia")
+    saldo_inicial = forms.DecimalField(label="Saldo inicial", required=False, max_digits=12, decimal_places=2)
+    format = forms.ChoiceField(label="Formato", required=False, choices=FORMAT_CHOICES, initial="html")
+
+    def intervalo(self, hoje):
+        """
+        Retorna as datas de início e fim da previsão; sem `inicio`, a
+        previsão começa em `hoje`.
+        """
+
+        inicio = self.cleaned_data.get("inicio") or hoje
+        horizonte = self.cleaned_data.get("horizonte") or self.HORIZONTE_PADRAO
+        return inicio, inicio + timedelta(horizonte - 1)
+
+    def filter(self, data):
+        inicio, fim = self.intervalo(data)
+        return previsao_de_caixa(inicio, fim,
+                                 self.cleaned_data.get("periodo") or "dia",
+                                 self.cleaned_data.get("saldo_inicial") or 0)
+
+    @property
+    def filter_info(self):
+        if self.is_bound:
+            if self.is_valid():
+                inicio, fim = self.intervalo(date.today())
+                return "{:%d/%m/%Y} - {:%d/%m/%Y}".format(inicio, fim)
+            else:
+                return "Previsão inválida"
+        else:
+            return ""
@@ -0,0 +1,117 @@
+# -*- encoding: utf-8 -*-
+"""
+Comando 'precalcular_relatorios', calcula e guarda em cache (ver
+`relatorios.cache`) os relatórios mais pesados, pros intervalos mais
+usados, pra que eles abram na hora no dia seguinte.
+
+Feito pra rodar todo dia depois da meia-noite, por exemplo no cron:
+
+    30 3 * * * cd /caminho/do/vestat && python manage.py precalcular_relatorios
+
+Os relatórios já em cache e com os dados inalterados não são
+calculados de novo.
+"""
+import datetime
+import time
+from collections import OrderedDict
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from django.utils import translation
+
+from vestat.caixa.models import Dia
+from vestat.relatorios.views import MesesReportView, DespesasPorCategoriaReportView, \
+    TABELAS_DE_VENDAS, tabela_do_relatorio
+
+
+def intervalos_padrao(hoje):
+    """
+    Retorna um `OrderedDict` com os intervalos pré-calculados, cada um
+    uma tupla `(inicio, fim)` de datas terminando em `hoje`: o mês
+    atual, os últimos 12 meses e o ano até hoje.
+    """
+
+    ano, mes = divmod(hoje.year * 12 + hoje.month - 1 - 11, 12)
+
+    return OrderedDict([
+        (u"mês atual", (datetime.date(hoje.year, hoje.month, 1), hoje)),
+        (u"últimos 12 meses", (datetime.date(ano, mes + 1, 1), hoje)),
+        (u"ano até hoje", (datetime.date(hoje.year, 1, 1), hoje)),
+    ])
+
+def precalcular_report_view(View, query):
+    """
+    Calcula o relatório em HTML da class-based view `View` (uma
+    subclasse de `ReportView` com `cache_results`), com os filtros em
+    `query`, como se fosse pedido pelo navegador.
+    """
+
+    view = View()
+    filter_form, data, subtitle = view.filter(query)
+    if filter_form is not None and not filter_form.is_valid():
+        raise CommandError(u"Filtro inválido pra {0}: {1}".format(View.__name__, filter_form.errors))
+
+    view.render_report(filter_form, data, "html", query)
+
+def precalcular_vendas(inicio, fim):
+    """
+    Calcula as tabelas do relatório de vendas entre `inicio` e `fim`.
+    """
+
+    dias = Dia.dias_entre(inicio, fim)
+    for tablemaker in TABELAS_DE_VENDAS:
+        tabela_do_relatorio(tablemaker, dias, inicio, fim)
+
+def precalcular(inicio, fim):
+    """
+    Retorna um `OrderedDict` com o nome de cada relatório e uma função
+    que o calcula entre as datas `inicio` e `fim`. Os filtros são os
+    mesmos dos formulários da página de relatórios.
+    """
+
+    meses = QueryDict("", mutable=True)
+    meses.update({"from_date_month": inicio.month, "from_date_year": inicio.year,
+                  "to_date_month": fim.month, "to_date_year": fim.year,
+                  "format": "html"})
+
+    datas = QueryDict("", mutable=True)
+    datas.update({"from_date": inicio.strftime("%d/%m/%Y"), "to_date": fim.strftime("%d/%m/%Y"),
+                  "format": "html"})
+
+    return OrderedDict([
+        (u"Relatório de meses", lambda: precalcular_report_view(MesesReportView, meses)),
+        (u"Despesas por categoria", lambda: precalcular_report_view(DespesasPorCategoriaReportView, datas)),
+        (u"Vendas", lambda: precalcular_vendas(inicio, fim)),
+    ])
+
+
+class Command(BaseCommand):
+    help = u"Calcula e guarda em cache os relatórios mais pesados pros intervalos mais usados."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--hoje", dest="hoje",
+                    help=u"Data (DD/MM/AAAA) em que os intervalos terminam; o padrão é hoje."),
+    )
+
+    def handle(self, *args, **options):
+        # Os comandos rodam em inglês; os relatórios precisam ser
+        # renderizados (e os filtros lidos) como pelo servidor.
+        translation.activate(settings.LANGUAGE_CODE)
+
+        if options.get("hoje"):
+            try:
+                hoje = datetime.datetime.strptime(options["hoje"], "%d/%m/%Y").date()
+            except ValueError:
+                raise CommandError(u"Data inválida: {0}".format(options["hoje"]))
+        else:
+            hoje = datetime.date.today()
+
+        for intervalo, (inicio, fim) in intervalos_padrao(hoje).items():
+            for relatorio, calcular in precalcular(inicio, fim).items():
+                comeco = time.time()
+                calcular()
+
+                self.stdout.write(u"{0}, {1} ({2:%d/%m/%Y} - {3:%d/%m/%Y}): {4:.1f}s\n"
+                                  .format(relatorio, intervalo, inicio, fim, time.time() - comeco))
@@ -2,3 +2,7 @@
 
 # Esse módulo não possui modelos, mas esse arquivo existe pois o comando
 # `manage.py test relatorios` só funciona assim.
+
+# Conecta os sinais que trocam a versão dos dados dos relatórios em
+# cache assim que a aplicação é carregada.
+import vestat.versao
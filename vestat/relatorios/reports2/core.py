@@ -3,8 +3,24 @@
 Novo sistema de relatórios do Vestat.
 """
 
+import csv
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
 from django.template import Context, loader, TemplateDoesNotExist
 from django.template.defaultfilters import slugify
+from django.utils.encoding import force_unicode
+from django.utils.html import strip_tags
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+"""
+Número padrão de linhas por página das tabelas em HTML (ver
+`Report2.paginate`).
+"""
 
 class Report2():
     """
@@ -41,12 +57,82 @@ class Report2():
         """
         self.data = data
         self.elements = [Element(data) for Element in self.element_classes]
+        self.timings = []
+
+    def render_elements(self, format):
+        """
+        Renderiza os elementos no formato especificado e retorna uma
+        lista de tuplas ``(elemento, conteúdo)``, na ordem dos elementos.
+        O conteúdo de elementos que não suportam o formato é `None`.
+
+        Se `settings.RELATORIOS_THREADS` for maior que 1, o trabalho dos
+        elementos que o declaram (ver `ReportElement.background_job`;
+        e.g. desenhar os gráficos) é feito em até esse número de threads,
+        enquanto os outros elementos (e.g. as tabelas) são renderizados
+        nesta. O banco de dados só é acessado por esta thread. O tempo
+        gasto por cada elemento fica em `timings`, uma lista de tuplas
+        ``(elemento, segundos)``.
+
+        Argumentos:
+
+            - format: uma string contendo o formato desejado
+            (i.e.  "html", "csv").
+        """
+
+        jobs = {}
+        if getattr(settings, "RELATORIOS_THREADS", 1) > 1:
+            for index, element in enumerate(self.elements):
+                if hasattr(element, "render_" + format):
+                    start = time.time()
+                    job = element.background_job()
+                    if job is not None:
+                        jobs[index] = job, time.time() - start
+
+        pool = None
+        if jobs:
+            pool = ThreadPool(min(settings.RELATORIOS_THREADS, len(jobs)))
+            for index, (job, seconds) in jobs.items():
+                jobs[index] = pool.apply_async(job), seconds
+
+        try:
+            # Os elementos sem trabalho em outra thread primeiro,
+            # enquanto as threads trabalham nos outros.
+            order = [index for index in range(len(self.elements)) if index not in jobs] + sorted(jobs)
+            results = [None] * len(self.elements)
+
+            for index in order:
+                element = self.elements[index]
+                waited = 0
+
+                if index in jobs:
+                    job, waited = jobs[index]
+                    start = time.time()
+                    element.background_result(_job_result(element, job))
+                    waited += time.time() - start
+
+                content, seconds = _render_element(element, format)
+                results[index] = content, seconds + waited
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.timings = [(element, seconds) for element, (_, seconds) in zip(self.elements, results)]
+
+        for element, seconds in self.timings:
+            logger.debug("{0}: {1}.render_{2} em {3:.3f}s".format(self.title, element.__class__.__name__,
+                                                                  format, seconds))
+
+        return [(element, content) for element, (content, _) in zip(self.elements, results)]
 
     def render(self, format):
         """
         Retorna o conteúdo do relatório no formato especificado.
         Elementos que não suportam esse formato não serão exibidos.
 
+        Os elementos são renderizados por `render_elements` antes do
+        template do relatório.
+
         Argumentos:
 
             - format: uma string contendo o formato desejado
@@ -62,9 +148,110 @@ class Report2():
         else:
             context = Context({
                 "report": self,
+                "elements": self.render_elements(format),
             })
             return template.render(context)
 
+    def paginate(self, query):
+        """
+        Pagina os elementos que suportam paginação (ver
+        `Table2.paginate`), de acordo com os parâmetros ``page`` (a
+        página, começando em 1) e ``size`` (o número de linhas por
+        página, `PAGE_SIZE` por padrão) de `query`.
+
+        Argumentos:
+
+            - query: um `QueryDict`, e.g. o `request.GET`.
+        """
+
+        try:
+            page = max(int(query.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+
+        try:
+            page_size = max(int(query.get("size", PAGE_SIZE)), 1)
+        except ValueError:
+            page_size = PAGE_SIZE
+
+        for element in self.elements:
+            paginate = getattr(element, "paginate", None)
+            if paginate is not None:
+                paginate(page, page_size, query)
+
+    def iter_rows(self):
+        """
+        Gera as linhas de todos os elementos que sabem gerar linhas (ver
+        `Table2.iter_rows`), na ordem dos elementos, com uma linha vazia
+        antes de cada elemento. Usado pra exportar o relatório em CSV
+        sem montá-lo inteiro na memória (ver `iter_csv`).
+        """
+
+        for element in self.elements:
+            iter_rows = getattr(element, "iter_rows", None)
+            if iter_rows is None:
+                continue
+
+            yield []
+            for row in iter_rows():
+                yield row
+
+def _render_element(element, format):
+    """
+    Chama o método ``render_<format>`` do elemento, se houver, e retorna
+    uma tupla com o conteúdo (ou `None`) e o tempo gasto, em segundos.
+    """
+
+    start = time.time()
+
+    render = getattr(element, "render_" + format, None)
+    content = render() if render is not None else None
+
+    return content, time.time() - start
+
+def _job_result(element, job):
+    """
+    Espera e retorna o resultado do trabalho `job` (um `AsyncResult`)
+    do elemento, ou `None` se ele falhar -- o elemento então faz o
+    trabalho ele mesmo, ao ser renderizado.
+    """
+
+    try:
+        return job.get()
+    except Exception:
+        logger.exception("{0}: erro no trabalho em outra thread".format(element.__class__.__name__))
+        return None
+
+class _Echo():
+    """
+    Pseudo-arquivo que retorna o que é escrito nele, pra que o
+    `csv.writer` possa ser usado pra gerar uma linha de cada vez.
+    """
+
+    def write(self, value):
+        return value
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    return strip_tags(force_unicode(value)).encode("utf-8")
+
+def iter_csv(rows, delimiter=";"):
+    """
+    Gera, uma de cada vez, as linhas de `rows` no formato CSV,
+    codificadas em UTF-8. Tags HTML dos valores são removidas.
+
+    Argumentos:
+
+        - rows: um iterável de sequências de valores, e.g. o retornado
+          por `Report2.iter_rows`.
+        - delimiter: o separador de valores.
+    """
+
+    writer = csv.writer(_Echo(), delimiter=delimiter)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
 class ReportElement():
     """
     Classe abstrata para elementos de um relatório -- tabelas, gráficos etc.
@@ -75,6 +262,10 @@ class ReportElement():
     Esses métodos devem retornar o conteúdo no formato correto pra ser incluído
     no relatório de mesmo formato -- `render_html` deve retornar uma string
     em HTML, `render_csv` uma string no formato CSV etc.
+
+    Elementos com trabalho pesado de CPU (e.g. desenhar um gráfico) podem
+    implementar `background_job` e `background_result`, pra que esse
+    trabalho seja feito em outro processo (ver `Report2.render_elements`).
     """
 
     def __init__(self, data):
@@ -86,3 +277,21 @@ class ReportElement():
             - data: os dados sob os quais o elemento fala.
         """
         self.data = data
+
+    def background_job(self):
+        """
+        Retorna uma função, sem argumentos, com o trabalho a ser feito em
+        outra thread antes de renderizar o elemento, ou `None` se não
+        houver (ver `Report2.render_elements`). A função não deve
+        acessar o banco de dados: o que vier dele deve ser lido antes,
+        pelo próprio `background_job`.
+        """
+        return None
+
+    def background_result(self, result):
+        """
+        Recebe o valor retornado pela função de `background_job`, ou
+        `None` se o trabalho falhar -- nesse caso, o elemento deve fazer
+        o trabalho ele mesmo ao ser renderizado.
+        """
+        pass
@@ -3,11 +3,116 @@
 Alguns elementos pra serem usados em relatórios `Report2`.
 """
 
+import base64
+import threading
+from collections import OrderedDict
+from itertools import islice
+from StringIO import StringIO
+
+from django.http import QueryDict
 from django.template import Context, loader
 from django.template.defaultfilters import slugify
 
+from vestat.django_utils import format_currency
+from vestat.temp import fingerprint
 from core import ReportElement
 
+PNG_CACHE_SIZE = 32
+"""
+Número máximo de imagens de gráficos guardadas em memória (ver
+`figure_png`).
+"""
+
+_png_cache = OrderedDict()
+_png_cache_lock = threading.Lock()
+
+def draw_png(figsize, dpi, draw, args=()):
+    """
+    Desenha uma figura do matplotlib em memória e retorna a imagem em
+    PNG, como uma string. A figura é desenhada com a API orientada a
+    objetos do matplotlib (`Figure` e o canvas Agg), sem o estado global
+    do `pyplot`, então várias figuras podem ser desenhadas ao mesmo tempo.
+
+    Também é chamada nas threads de `Report2.render_elements` (ver
+    `BarChartElement.background_job`).
+
+    Argumentos:
+
+        - figsize: uma tupla ``(largura, altura)``, em inches.
+        - dpi: a resolução da imagem, em pontos por inch.
+        - draw: uma função que desenha o gráfico; recebe a `Figure` e os
+          argumentos em `args`.
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    draw(figure, *args)
+
+    output = StringIO()
+    canvas.print_png(output)
+    return output.getvalue()
+
+def cached_png(key):
+    """
+    Retorna a imagem guardada por `figure_png` com a chave `key`, ou
+    `None` se ela não estiver em memória.
+    """
+
+    key = fingerprint(key)
+
+    with _png_cache_lock:
+        if key not in _png_cache:
+            return None
+
+        png = _png_cache.pop(key)
+        _png_cache[key] = png
+        return png
+
+def cache_png(key, png):
+    """
+    Guarda a imagem `png` com a chave `key`, descartando as usadas há
+    mais tempo se passar de `PNG_CACHE_SIZE` imagens.
+    """
+
+    key = fingerprint(key)
+
+    with _png_cache_lock:
+        _png_cache[key] = png
+        while len(_png_cache) > PNG_CACHE_SIZE:
+            _png_cache.popitem(last=False)
+
+def figure_png(key, figsize, dpi, draw, args=()):
+    """
+    Retorna a imagem em PNG, como uma string, de uma figura desenhada
+    por `draw_png`. As últimas `PNG_CACHE_SIZE` imagens são guardadas:
+    uma figura com a mesma `key` não é desenhada de novo.
+
+    Argumentos:
+
+        - key: um valor com tudo que determina a imagem (e.g. o nome do
+          gráfico e os seus dados); deve ter uma representação (`repr`)
+          estável.
+        - figsize, dpi, draw, args: os argumentos de `draw_png`.
+    """
+
+    png = cached_png(key)
+
+    if png is None:
+        png = draw_png(figsize, dpi, draw, args)
+        cache_png(key, png)
+
+    return png
+
+def png_html(png):
+    """
+    Retorna uma imagem em HTML com o PNG `png` embutido numa data URI.
+    """
+
+    return u'<img src="data:image/png;base64,{0}" />'.format(base64.b64encode(png))
+
 class TableField2():
     """
     Um campo (uma coluna) de uma tabela.
@@ -34,7 +139,13 @@ class Table2(ReportElement):
     Classe abstrata pra uma tabela.
 
     Subclasses devem sobrescrever os atributos `title` e `fields`, e
-    implementar a property `body`.
+    implementar a property `body` ou o método `rows`. Tabelas grandes
+    devem implementar `rows` como um gerador: na exportação em CSV e nas
+    páginas em HTML (ver `paginate`), só as linhas usadas são geradas.
+
+    Os totais, se houver, ficam na property `footer`, que deve ser
+    calculada independentemente do corpo (que pode nem ser gerado
+    inteiro).
     """
 
     title = ""
@@ -47,6 +158,22 @@ class Table2(ReportElement):
     Objetos `TableField2` representando as colunas da tabela.
     """
 
+    page = 1
+    """
+    Página exibida ao renderizar a tabela em HTML, começando em 1.
+    """
+
+    page_size = None
+    """
+    Número de linhas por página em HTML; `None` exibe todas as linhas.
+    """
+
+    page_query = None
+    """
+    `QueryDict` com os parâmetros da página atual, usado pra montar os
+    links pras páginas anterior e seguinte.
+    """
+
     @property
     def body(self):
         """
@@ -55,6 +182,13 @@ class Table2(ReportElement):
         """
         pass
 
+    def rows(self):
+        """
+        Retorna um iterador sobre as linhas do corpo da tabela. A
+        implementação padrão itera sobre `body`.
+        """
+        return iter(self.body or ())
+
     @property
     def footer(self):
         """
@@ -63,26 +197,81 @@ class Table2(ReportElement):
         """
         return tuple()
 
+    def paginate(self, page, page_size, query=None):
+        """
+        Faz a tabela em HTML exibir só as linhas da página `page`, com
+        `page_size` linhas por página.
+
+        Argumentos:
+
+            - page: o número da página, começando em 1
+            - page_size: o número de linhas por página
+            - query: um `QueryDict` com os parâmetros da requisição,
+              usado nos links pras outras páginas
+        """
+
+        self.page = page
+        self.page_size = page_size
+        self.page_query = query
+
+    def _page_link(self, page):
+        query = self.page_query.copy() if self.page_query is not None else QueryDict("", mutable=True)
+        query["page"] = page
+        return "?" + query.urlencode()
+
+    def iter_rows(self):
+        """
+        Gera as linhas da tabela, uma de cada vez: o título (se houver),
+        os cabeçalhos das colunas, o corpo e o rodapé. Usado pra exportar
+        a tabela em CSV (ver `core.iter_csv`).
+        """
+
+        if self.title:
+            yield [self.title.upper()]
+
+        yield [field.header for field in self.fields]
+
+        for row in self.rows():
+            yield row
+
+        for row in self.footer:
+            yield row
+
     def render(self, format):
         """
         Encapsula a renderização de diversos formatos na mesma função.
 
-        Usa um template com extensão igual ao formato desejado.
+        Usa um template com extensão igual ao formato desejado. Em HTML,
+        se a tabela estiver paginada (ver `paginate`), só as linhas da
+        página atual são geradas.
 
         Argumentos:
 
             - format: o formato de renderização
         """
 
-        template_name = "elements/table.{0}".format(format)
-        template = loader.get_template(template_name)
-        context = Context({
+        context = {
             "title": self.title,
             "fields": self.fields,
-            "body": self.body,
+            "body": self.rows(),
             "footer": self.footer,
-        })
-        return template.render(context)
+        }
+
+        if format == "html" and self.page_size:
+            start = (self.page - 1) * self.page_size
+            # uma linha a mais, pra saber se há uma próxima página
+            body = list(islice(context["body"], start, start + self.page_size + 1))
+
+            context["body"] = body[:self.page_size]
+            context["page"] = self.page
+            if self.page > 1:
+                context["previous_page"] = self._page_link(self.page - 1)
+            if len(body) > self.page_size:
+                context["next_page"] = self._page_link(self.page + 1)
+
+        template_name = "elements/table.{0}".format(format)
+        template = loader.get_template(template_name)
+        return template.render(Context(context))
 
     def render_html(self):
         """
@@ -95,3 +284,193 @@ class Table2(ReportElement):
         Renderiza o template em CSV.
         """
         return self.render("csv")
+
+
+class BarChartElement(ReportElement):
+    """
+    Classe abstrata pra um gráfico de barras, com uma linha de tendência
+    e o valor de cada barra escrito em cima dela.
+
+    Subclasses devem sobrescrever os atributos `title` e `chart_title`,
+    e implementar o método `get_bars`.
+
+    O gráfico é desenhado em memória por `figure_png`: um gráfico com as
+    mesmas barras não é desenhado de novo. Num relatório, o desenho pode
+    ser feito em outra thread (ver `background_job`), enquanto as outras
+    tabelas são renderizadas.
+    """
+
+    title = ""
+    """
+    Título do elemento no relatório
+    """
+
+    chart_title = u""
+    """
+    Título desenhado na imagem do gráfico
+    """
+
+    ylabel = u"Reais"
+    """
+    Rótulo do eixo Y
+    """
+
+    color = "b"
+    """
+    Cor das barras (ver `bar_color`)
+    """
+
+    label_offsets = (400, 900)
+    """
+    Distância, nas unidades do eixo Y, entre o valor de uma barra e o
+    seu rótulo: acima das barras positivas e abaixo das negativas.
+    """
+
+    # largura de cada barra (inches)
+    bar_width = 0.5
+    # largura mínima do gráfico (inches)
+    min_width = 4
+    # espaçamento entre uma barra e outra (inches)
+    padding = 0.3
+    # altura do gráfico (inches)
+    height = 6
+    # resolução da imagem (pontos por inch)
+    dpi = 100
+
+    # ajustes de espaçamento ao redor do gráfico (porcentagem de
+    # width/height)
+    adjustments = {
+        "bottom": 0.1,
+        "left": 0.17,
+    }
+
+    def get_bars(self):
+        """
+        Retorna uma lista de tuplas ``(rótulo, valor)``, uma pra cada
+        barra do gráfico, na ordem do eixo X.
+        """
+        return []
+
+    def bar_color(self, value):
+        """
+        Retorna a cor da barra com o valor `value`.
+        """
+        return self.color
+
+    def draw(self, figure, labels, values):
+        """
+        Desenha o gráfico na `matplotlib.figure.Figure` fornecida.
+        """
+
+        import numpy
+
+        x_locations = numpy.arange(len(values))
+
+        figure.subplots_adjust(**self.adjustments)
+        ax = figure.add_subplot(111)
+
+        # Gráfico de barras
+        rects = ax.bar(x_locations, values, self.bar_width,
+                       color=[self.bar_color(value) for value in values])
+
+        # Linha de tendência (só faz sentido com mais de uma barra)
+        if len(values) > 1:
+            slope, intercept = numpy.polyfit(x_locations, values, 1)
+            trendline_y = intercept + (slope * x_locations)
+            ax.plot(x_locations, trendline_y, color="blue")
+
+        ax.set_ylabel(self.ylabel)
+        ax.set_title(self.chart_title)
+
+        # espaçamento à direita de todas as barras
+        ax.set_xticks(x_locations + self.padding)
+        ax.set_xticklabels(labels)
+        # espaçamento à esquerda da primeira barra
+        ax.set_xlim([0 - self.padding, len(values)])
+
+        # deixa o eixo Y um pouco maior, pra dar espaço pro rótulo
+        # em cima de cada barra
+        y1, y2 = ax.get_ylim()
+        ax.set_ylim(y1, y2 * 1.1)
+
+        # configura rotação e tamanho do rótulo de cada barra no eixo X
+        for label in ax.get_xticklabels():
+            label.set_rotation(45)
+            label.set_rotation_mode("anchor")
+            label.set_verticalalignment("top")
+            label.set_horizontalalignment("right")
+            label.set_size("8")
+
+        # rotula cada uma das barras com seu valor correspondente
+        above, below = self.label_offsets
+        for rect, value in zip(rects, values):
+            text_x = rect.get_x() + rect.get_width() / 2.0
+            text_y = value + above if value >= 0 else value - below
+
+            ax.text(text_x, text_y, format_currency(value),
+                    ha='center', va='bottom', size='8')
+
+    def png_arguments(self):
+        """
+        Retorna uma tupla com os argumentos de `figure_png` pra desenhar
+        o gráfico, ou `None` se não houver nenhuma barra. As barras são
+        lidas (ver `get_bars`) uma vez só.
+        """
+
+        if not hasattr(self, "_png_arguments"):
+            bars = self.get_bars()
+
+            if not bars:
+                self._png_arguments = None
+            else:
+                labels = [label for label, _ in bars]
+                values = [float(value) for _, value in bars]
+                width = max(self.bar_width * len(values), self.min_width) + sum(self.adjustments.values())
+
+                self._png_arguments = ((self.__class__.__name__, labels, values), (width, self.height),
+                                       self.dpi, self.draw, (labels, values))
+
+        return self._png_arguments
+
+    def render_png(self):
+        """
+        Retorna a imagem do gráfico em PNG, como uma string, ou `None`
+        se não houver nenhuma barra.
+        """
+
+        if getattr(self, "_png", None) is not None:
+            return self._png
+
+        arguments = self.png_arguments()
+        if arguments is None:
+            return None
+
+        return figure_png(*arguments)
+
+    def background_job(self):
+        """
+        Desenha o gráfico em outra thread, se ele ainda não estiver em
+        memória (ver `ReportElement.background_job`). As barras são lidas
+        do banco de dados antes, nesta thread.
+        """
+
+        arguments = self.png_arguments()
+        if arguments is None or cached_png(arguments[0]) is not None:
+            return None
+
+        return lambda: figure_png(*arguments)
+
+    def background_result(self, png):
+        self._png = png
+
+    def render_html(self):
+        """
+        Renderiza o gráfico como uma imagem em HTML, com o PNG embutido
+        numa data URI.
+        """
+
+        png = self.render_png()
+        if png is None:
+            return u''
+
+        return png_html(png)
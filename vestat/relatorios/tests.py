@@ -4,12 +4,38 @@
 Testes da app `relatorios`
 """
 
+import base64
+import csv
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, time as time_
+from decimal import Decimal, ROUND_HALF_UP
+from StringIO import StringIO
+
 from django.test import TestCase
-from django.test.client import Client
+from django.test.utils import override_settings
+from django.test.client import Client, RequestFactory
 from django.core.urlresolvers import reverse
+from django.core.cache import get_cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.http import QueryDict, HttpResponse
 
-from vestat.caixa.models import Dia
-from views import MesesReportTable
+from vestat.caixa.models import Dia, ResumoDiario, PagamentoComCartao, Venda, CategoriaDeMovimentacao
+from reports2 import Report2, ReportElement, iter_csv, elements
+from vestat.django_utils import format_currency
+from views import MesesReport, MesesReportTable, DespesasReportTable, \
+    DespesasPorCategoriaReportTable
+from charts import FaturamentoPorMesChart
+from views import MesesReportView, tabela_do_relatorio, vendas_por_mesa
+from management.commands.precalcular_relatorios import intervalos_padrao
+from vestat.relatorios import cache
+from vestat import versao
+from vestat.middleware import AdiarVersaoDosDadosMiddleware
 
 class MesesReportTestCase(TestCase):
     """
@@ -41,3 +67,572 @@ class MesesReportTableTestCase(TestCase):
         table = MesesReportTable(data)
 
         self.assertTrue(len(table.body))
+
+    def teste_totais_do_mes(self):
+        data = Dia.objects.filter(data__year=2012)
+        table = MesesReportTable(data)
+
+        linha = table.body[0]
+        dias = Dia._dias(2012, int(linha[0][5:]), data)
+
+        self.assertEqual(linha[0], "2012-01")
+        self.assertEqual(linha[1], Dia.num_pessoas_total(dias))
+        self.assertEqual(linha[2], Dia.vendas_total(dias))
+
+
+class MesesReportRollupTestCase(TestCase):
+    """
+    Testes do `MonthlyRollup` compartilhado pelos elementos do relatório
+    de meses.
+    """
+
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def setUp(self):
+        ResumoDiario.recalcular(Dia.objects.all())
+
+    def teste_elementos_compartilham_os_totais(self):
+        data = Dia.objects.filter(data__year=2012)
+
+        with self.assertNumQueries(3):
+            report = MesesReport(data)
+            for element in report.elements:
+                self.assertTrue(element.get_rollup() is report.rollup)
+            table_body = report.elements[-1].body
+
+        meses = Dia._meses(2012, data)
+        self.assertEqual([linha[0] for linha in table_body],
+                         ["2012-%02d" % mes for mes in meses])
+
+    def teste_dados_vazios(self):
+        report = MesesReport([])
+        self.assertEqual(len(report.rollup), 0)
+        self.assertEqual(report.elements[-1].body, [])
+
+
+class PrevisaoDeCaixaReportTestCase(TestCase):
+    """
+    Testes do relatório de previsão de caixa.
+    """
+
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse("relatorio_previsao_de_caixa")
+
+    def teste_formatos(self):
+        for format in ["html", "csv"]:
+            response = self.client.get(self.url, {"inicio": "01/06/2012", "format": format})
+            self.assertEqual(response.status_code, 200)
+
+    def teste_json(self):
+        response = self.client.get(self.url, {"inicio": "01/06/2012", "horizonte": 30, "format": "json"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+        pontos = json.loads(response.content)["pontos"]
+        self.assertEqual(len(pontos), 30)
+        self.assertEqual(pontos[0]["inicio"], "2012-06-01")
+
+        pagamentos = PagamentoComCartao.objects.filter(data_do_deposito__range=(date(2012, 6, 1), date(2012, 6, 30)))
+        # cada depósito é arredondado pro centavo
+        esperado = sum((p.valor - p.taxa).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) for p in pagamentos)
+        self.assertEqual(sum(Decimal(p["depositos"]) for p in pontos), esperado)
+
+    def teste_json_invalido(self):
+        response = self.client.get(self.url, {"horizonte": 0, "format": "json"})
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue("horizonte" in json.loads(response.content)["erros"])
+
+
+class CSVTestCase(TestCase):
+    """
+    Testes da exportação dos relatórios em CSV.
+    """
+
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def setUp(self):
+        self.client = Client()
+
+    def linhas(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        conteudo = "".join(response.streaming_content)
+        return list(csv.reader(StringIO(conteudo), delimiter=";"))
+
+    def teste_iter_csv(self):
+        linhas = list(iter_csv([[u"Mês", u'<span class="neg">-1,00</span>', None, 3], ["a;b"]]))
+        self.assertEqual(linhas, [u"Mês;-1,00;;3\r\n".encode("utf-8"), '"a;b"\r\n'])
+
+    def teste_relatorio_de_meses(self):
+        response = self.client.get(reverse("relatorio_meses"),
+            {"from_date_year": 2012, "from_date_month": 1, "to_date_year": 2012, "to_date_month": 12,
+             "format": "csv"})
+        linhas = self.linhas(response)
+
+        self.assertEqual(linhas[0], ["Relatório de meses", "01/2012 - 12/2012"])
+        self.assertEqual(linhas[2], ["TABELA"])
+        self.assertEqual(linhas[4][0], "2012-01")
+
+    def teste_relatorio_de_vendas(self):
+        response = self.client.get("/relatorios/vendas_por_categoria/", {"csv": "1"})
+        linhas = self.linhas(response)
+
+        self.assertEqual(linhas[0], ["Vendas"])
+        self.assertEqual(linhas[2], ["Vendas por categoria"])
+
+    def teste_relatorio_de_despesas(self):
+        dia = Dia.objects.filter(data__year=2012, data__month=1)[0]
+        dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        dia.movimentacaobancaria_set.create(valor=Decimal("-5"))
+
+        response = self.client.get(reverse("relatorio_despesas"),
+                                   {"from_date": "01/01/2012", "to_date": "31/01/2012", "format": "csv"})
+        linhas = self.linhas(response)
+
+        self.assertEqual(linhas[0], ["Despesas", "01/01/2012 - 31/01/2012"])
+        self.assertEqual(linhas[2], ["Dia", "Valor", "Categoria", "C/B?"])
+        self.assertEqual([linha[3] for linha in linhas[3:5]], ["Caixa", "Banco"])
+        self.assertEqual(linhas[3][0], dia.data.strftime("%d/%m/%Y"))
+        self.assertEqual(linhas[5][:2], ["TOTAL", "R$ " + format_currency(Decimal("-15"))])
+
+
+class PaginacaoTestCase(TestCase):
+    """
+    Testes da paginação das tabelas `Table2` em HTML.
+    """
+
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def setUp(self):
+        self.client = Client()
+
+        dias = Dia.objects.filter(data__year=2012, data__month=3).order_by("data")
+        for dia in dias:
+            dia.despesadecaixa_set.create(valor=Decimal("-1"))
+
+        self.num_dias = dias.count()
+        self.parametros = {"from_date": "01/03/2012", "to_date": "31/03/2012", "format": "html"}
+
+    def teste_paginas(self):
+        table = DespesasReportTable(Dia.objects.filter(data__year=2012, data__month=3))
+
+        table.paginate(1, 10)
+        primeira = table.render_html()
+        self.assertEqual(primeira.count("<tr>"), 1 + 10 + 1)
+        self.assertTrue("page=2" in primeira)
+        self.assertFalse("page=0" in primeira)
+
+        tamanho = (self.num_dias + 1) // 2
+        table.paginate(2, tamanho)
+        ultima = table.render_html()
+        self.assertEqual(ultima.count("<tr>"), 1 + self.num_dias - tamanho + 1)
+        self.assertTrue("page=1" in ultima)
+        self.assertFalse("page=3" in ultima)
+
+    def teste_pagina_le_so_os_dias_exibidos(self):
+        table = DespesasReportTable(Dia.objects.filter(data__year=2012, data__month=3))
+        table.paginate(1, 2)
+
+        # 1 consulta pros dias, 2 (despesas de caixa e movimentações)
+        # pra cada um dos 2 dias exibidos, 1 pra saber se há uma próxima
+        # página e 2 pro total
+        with self.assertNumQueries(1 + 2 * 2 + 1 + 2):
+            table.render_html()
+
+    def teste_view(self):
+        parametros = dict(self.parametros, size=5, page=2)
+        response = self.client.get(reverse("relatorio_despesas"), parametros)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.count(format_currency(Decimal("-1")).encode("utf-8")), 5)
+
+        parametros["page"] = "x"
+        response = self.client.get(reverse("relatorio_despesas"), parametros)
+        self.assertEqual(response.status_code, 200)
+
+    def teste_csv_nao_eh_paginado(self):
+        parametros = dict(self.parametros, size=5, format="csv")
+        response = self.client.get(reverse("relatorio_despesas"), parametros)
+        conteudo = "".join(response.streaming_content)
+        self.assertEqual(conteudo.count("Caixa"), self.num_dias)
+
+
+class DespesasPorCategoriaReportTableTestCase(TestCase):
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def teste_rodape_nao_depende_do_corpo(self):
+        dia = Dia.objects.filter(data__year=2012)[0]
+        dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        dia.movimentacaobancaria_set.create(valor=Decimal("-5"))
+        dia.movimentacaobancaria_set.create(valor=Decimal("7"))
+
+        table = DespesasPorCategoriaReportTable(Dia.objects.filter(data__year=2012))
+        self.assertEqual(table.footer[0][1], format_currency(Decimal("-15")))
+
+    def teste_linhas_geradas_sob_demanda(self):
+        fornecedor = CategoriaDeMovimentacao.objects.create(nome="Fornecedor de teste")
+        bebidas = CategoriaDeMovimentacao.objects.create(nome="Bebidas de teste", mae=fornecedor)
+
+        dia = Dia.objects.filter(data__year=2012)[0]
+        dia.despesadecaixa_set.create(valor=Decimal("-10"), categoria=bebidas)
+        dia.despesadecaixa_set.create(valor=Decimal("-4"), categoria=fornecedor)
+        dia.movimentacaobancaria_set.create(valor=Decimal("-6"), categoria=bebidas)
+        dia.despesadecaixa_set.create(valor=Decimal("-5"))
+        Venda(dia=dia, mesa="1", hora_entrada=time_(20, 0), hora_saida=time_(21, 0), num_pessoas=2,
+              categoria="L", conta=Decimal("100"), pgto_dinheiro=Decimal("100")).fechar()
+
+        table = DespesasPorCategoriaReportTable(Dia.objects.filter(data=dia.data))
+        rows = table.rows()
+        self.assertFalse(isinstance(rows, (list, tuple)))
+        self.assertEqual(list(rows), [
+            (u"Fornecedor de teste - Total", format_currency(Decimal("-20")), "80.00%", "20.00%"),
+            (u"Fornecedor de teste > Bebidas de teste", format_currency(Decimal("-16")), "64.00%", "16.00%"),
+            (u"Fornecedor de teste > Outros", format_currency(Decimal("-4")), "16.00%", "4.00%"),
+            (u"Outros", format_currency(Decimal("-5")), "20.00%", "5.00%"),
+        ])
+
+
+class FigurePngTestCase(TestCase):
+    """
+    Testes do `elements.figure_png`, usado por todos os gráficos.
+    """
+
+    def setUp(self):
+        elements._png_cache.clear()
+
+    def teste_nao_desenha_de_novo(self):
+        desenhos = []
+
+        def draw(figure):
+            desenhos.append(figure)
+            figure.add_subplot(111).pie([1, 2], labels=[u"a", u"b"])
+
+        png = elements.figure_png(("torta", [1, 2]), (2, 2), 50, draw)
+        self.assertTrue(png.startswith("\x89PNG"))
+        self.assertEqual(elements.figure_png(("torta", [1, 2]), (2, 2), 50, draw), png)
+        self.assertEqual(len(desenhos), 1)
+
+        elements.figure_png(("torta", [2, 1]), (2, 2), 50, draw)
+        self.assertEqual(len(desenhos), 2)
+
+        self.assertEqual(elements.png_html(png), u'<img src="data:image/png;base64,{0}" />'.format(base64.b64encode(png)))
+
+
+class BarChartElementTestCase(TestCase):
+    """
+    Testes dos gráficos de barras do relatório de meses.
+    """
+
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def setUp(self):
+        elements._png_cache.clear()
+        self.desenhos = []
+        self.threads = []
+
+        test_case = self
+
+        class Chart(FaturamentoPorMesChart):
+            def draw(self, figure, labels, values):
+                test_case.desenhos.append(labels)
+                test_case.threads.append(threading.current_thread())
+                FaturamentoPorMesChart.draw(self, figure, labels, values)
+
+        self.Chart = Chart
+
+    def teste_imagem_em_memoria(self):
+        html = self.Chart(Dia.objects.filter(data__year=2012)).render_html()
+
+        self.assertTrue(html.startswith(u'<img src="data:image/png;base64,'))
+        png = base64.b64decode(html.split(",", 1)[1].split('"')[0])
+        self.assertTrue(png.startswith("\x89PNG"))
+        self.assertEqual(self.desenhos, [["%02d/2012" % mes for mes in Dia._meses(2012)]])
+
+    @override_settings(RELATORIOS_THREADS=2)
+    def teste_grafico_desenhado_em_outra_thread(self):
+        class Relatorio(Report2):
+            element_classes = [self.Chart]
+
+        report = Relatorio(Dia.objects.filter(data__year=2012))
+        html = report.render_elements("html")[0][1]
+
+        self.assertTrue(html.startswith(u'<img src="data:image/png;base64,'))
+        self.assertEqual(len(self.desenhos), 1)
+        self.assertNotEqual(self.threads, [threading.current_thread()])
+
+    def teste_grafico_repetido_nao_eh_desenhado_de_novo(self):
+        data = Dia.objects.filter(data__year=2012)
+
+        primeira = self.Chart(data).render_png()
+        self.assertEqual(self.Chart(data).render_png(), primeira)
+        self.assertEqual(len(self.desenhos), 1)
+
+        self.Chart(data.filter(data__lte=date(2012, 6, 30))).render_png()
+        self.assertEqual(len(self.desenhos), 2)
+
+    def teste_sem_dados(self):
+        self.assertEqual(self.Chart([]).render_html(), u"")
+
+    def teste_endpoint(self):
+        parametros = {"from_date_year": 2012, "from_date_month": 1, "to_date_year": 2012, "to_date_month": 12}
+
+        response = self.client.get(reverse("grafico_de_meses", args=["resultado"]), parametros)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/png")
+
+        response = self.client.get(reverse("grafico_de_meses", args=["inexistente"]), parametros)
+        self.assertEqual(response.status_code, 404)
+
+
+class RenderElementsTestCase(TestCase):
+    """
+    Testes do `Report2.render_elements`.
+    """
+
+    def setUp(self):
+        self.renderizados = []
+        test_case = self
+
+        class Lento(ReportElement):
+            title = "Lento"
+            def render_html(self):
+                test_case.renderizados.append(self)
+                time.sleep(0.2)
+                return u"lento"
+
+        class Rapido(ReportElement):
+            title = "Rápido"
+            def render_html(self):
+                test_case.renderizados.append(self)
+                return u"rápido"
+
+        class ComTrabalho(ReportElement):
+            title = "Com trabalho"
+            thread = None
+            def background_job(self):
+                return threading.current_thread
+            def background_result(self, thread):
+                self.thread = thread
+            def render_html(self):
+                test_case.renderizados.append(self)
+                if self.thread in (None, threading.current_thread()):
+                    return u"esta thread"
+                return u"outra thread"
+
+        class SoCSV(ReportElement):
+            def render_csv(self):
+                return u"csv"
+
+        class Relatorio(Report2):
+            title = "Relatório"
+            element_classes = [Lento, ComTrabalho, Rapido, SoCSV]
+
+        self.ComTrabalho = ComTrabalho
+        self.Relatorio = Relatorio
+
+    @override_settings(RELATORIOS_THREADS=1)
+    def teste_em_serie(self):
+        report = self.Relatorio([])
+        elementos = report.render_elements("html")
+
+        self.assertEqual([conteudo for _, conteudo in elementos], [u"lento", u"esta thread", u"rápido", None])
+        self.assertEqual([e for e, _ in elementos], report.elements)
+        self.assertEqual([e for e, _ in report.timings], report.elements)
+        self.assertEqual(self.renderizados, report.elements[:3])
+        self.assertTrue(report.timings[0][1] >= 0.2)
+
+    @override_settings(RELATORIOS_THREADS=2)
+    def teste_com_threads(self):
+        report = self.Relatorio([])
+        elementos = report.render_elements("html")
+
+        self.assertEqual([conteudo for _, conteudo in elementos], [u"lento", u"outra thread", u"rápido", None])
+        # o elemento com trabalho em outra thread é renderizado por último
+        self.assertEqual(self.renderizados, [report.elements[0], report.elements[2], report.elements[1]])
+
+    @override_settings(RELATORIOS_THREADS=2)
+    def teste_trabalho_com_erro(self):
+        def job():
+            raise ValueError
+        self.ComTrabalho.background_job = lambda self: job
+
+        elementos = self.Relatorio([]).render_elements("html")
+        self.assertEqual(elementos[1][1], u"esta thread")
+
+    def teste_template(self):
+        html = self.Relatorio([]).render("html")
+        self.assertEqual(html.count("<h2>"), 3)
+        self.assertTrue(html.index(u"lento") < html.index(u"rápido"))
+
+
+class ImportacaoDosGraficosTestCase(TestCase):
+    """
+    Testes da importação tardia do matplotlib e do numpy.
+    """
+
+    def teste_urls_nao_carregam_graficos(self):
+        import vestat
+        from django.conf import settings
+
+        script = ("import sys\n"
+                  "from django.core.urlresolvers import resolve\n"
+                  "resolve('/caixa/')\n"
+                  "import vestat.relatorios.views, vestat.caixa.events\n"
+                  "print([m for m in ('matplotlib', 'numpy') if m in sys.modules])\n")
+
+        env = dict(os.environ)
+        env["DJANGO_SETTINGS_MODULE"] = settings.SETTINGS_MODULE
+        caminhos = [os.path.dirname(os.path.dirname(os.path.abspath(vestat.__file__)))] + sys.path
+        env["PYTHONPATH"] = os.pathsep.join(p for p in caminhos if p)
+
+        processo = subprocess.Popen([sys.executable, "-c", script], env=env,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        saida, erros = processo.communicate()
+
+        self.assertEqual(processo.returncode, 0, erros)
+        self.assertEqual(saida.strip().splitlines()[-1], "[]")
+
+
+class CacheDeRelatoriosTestCase(TestCase):
+    """
+    Testes dos relatórios em cache e do comando `precalcular_relatorios`.
+    """
+
+    fixtures = ["testes_2012-contabil", "testes_2012-caixa"]
+
+    def setUp(self):
+        get_cache(cache.CACHE).clear()
+        self.query = QueryDict("from_date_month=1&from_date_year=2012&to_date_month=12&to_date_year=2012&format=html")
+
+    def render(self, query):
+        view = MesesReportView()
+        filter_form, data, subtitle = view.filter(query)
+        return view.render_report(filter_form, data, "html", query)
+
+    def teste_relatorio_em_cache(self):
+        html = self.render(self.query)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(self.query), html)
+
+        # mesmo filtro, escrito de outra forma
+        with self.assertNumQueries(0):
+            self.render(QueryDict("to_date_year=2012&to_date_month=12&from_date_year=2012&from_date_month=01&format=html"))
+
+    def teste_dados_alterados_invalidam_o_cache(self):
+        anterior = versao.versao_dos_dados()
+        self.render(self.query)
+
+        dia = Dia.objects.filter(data__year=2012)[0]
+        dia.despesadecaixa_set.create(valor=Decimal("-10"))
+
+        self.assertNotEqual(versao.versao_dos_dados(), anterior)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.buscar(cache.chave("nada")), None)
+        self.assertNotEqual(self.render(self.query), None)
+
+    def contar_versoes(self):
+        """
+        Troca o `versao.nova_versao_dos_dados` por uma versão que conta
+        as trocas em `self.versoes` (desfeito no fim do teste).
+        """
+
+        self.versoes = []
+        nova_versao_dos_dados = versao.nova_versao_dos_dados
+
+        def contar():
+            self.versoes.append(nova_versao_dos_dados())
+            return self.versoes[-1]
+
+        versao.nova_versao_dos_dados = contar
+        self.addCleanup(setattr, versao, "nova_versao_dos_dados", nova_versao_dos_dados)
+
+    def teste_cache_em_memoria_nos_testes(self):
+        self.assertTrue(isinstance(get_cache(cache.CACHE), LocMemCache))
+
+    def teste_uma_versao_nova_por_bloco(self):
+        anterior = versao.versao_dos_dados()
+        dia = Dia.objects.filter(data__year=2012)[0]
+        self.contar_versoes()
+
+        with versao.adiar_nova_versao():
+            dia.despesadecaixa_set.create(valor=Decimal("-10"))
+            with versao.adiar_nova_versao():
+                dia.movimentacaobancaria_set.create(valor=Decimal("7"))
+            self.assertEqual(self.versoes, [])
+            self.assertEqual(versao.versao_dos_dados(), anterior)
+
+        self.assertEqual(len(self.versoes), 1)
+        self.assertEqual(versao.versao_dos_dados(), self.versoes[0])
+
+        # sem alterações, a versão continua a mesma
+        with versao.adiar_nova_versao():
+            Dia.objects.get(pk=dia.pk)
+        self.assertEqual(len(self.versoes), 1)
+
+        # um bloco que termina com uma exceção também troca a versão
+        with self.assertRaises(ValueError):
+            with versao.adiar_nova_versao():
+                dia.despesadecaixa_set.create(valor=Decimal("-10"))
+                raise ValueError
+        self.assertEqual(len(self.versoes), 2)
+
+    def teste_resumos_recalculados_nao_trocam_a_versao(self):
+        dias = list(Dia.objects.filter(data__year=2012).values_list("pk", flat=True))
+        self.contar_versoes()
+
+        ResumoDiario.recalcular(dias)
+        ResumoDiario.invalidar(dias)
+        self.assertEqual(self.versoes, [])
+
+    def teste_middleware_troca_a_versao_no_fim_da_requisicao(self):
+        middleware = AdiarVersaoDosDadosMiddleware()
+        request = RequestFactory().get("/")
+        dia = Dia.objects.filter(data__year=2012)[0]
+        self.contar_versoes()
+
+        middleware.process_request(request)
+        dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        dia.movimentacaobancaria_set.create(valor=Decimal("7"))
+        self.assertEqual(self.versoes, [])
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(len(self.versoes), 1)
+
+        # outra requisição, que termina com uma exceção
+        middleware.process_request(request)
+        dia.despesadecaixa_set.create(valor=Decimal("-10"))
+        middleware.process_exception(request, ValueError())
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(len(self.versoes), 2)
+
+        # e uma que só lê os dados
+        self.client.get(reverse("relatorio_meses"), self.query)
+        self.assertEqual(len(self.versoes), 2)
+
+    def teste_tabela_de_vendas_em_cache(self):
+        dias = Dia.dias_entre(date(2012, 1, 1), date(2012, 12, 31))
+        tabela = tabela_do_relatorio(vendas_por_mesa, dias, date(2012, 1, 1), date(2012, 12, 31))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(tabela_do_relatorio(vendas_por_mesa, dias, date(2012, 1, 1), date(2012, 12, 31)),
+                             tabela)
+
+    def teste_comando(self):
+        hoje = date(2012, 12, 31)
+        intervalos = intervalos_padrao(hoje)
+        self.assertEqual(intervalos.values(), [(date(2012, 12, 1), hoje),
+                                               (date(2012, 1, 1), hoje),
+                                               (date(2012, 1, 1), hoje)])
+
+        call_command("precalcular_relatorios", hoje="31/12/2012", stdout=StringIO())
+
+        with self.assertNumQueries(0):
+            self.render(self.query)
+
+        # a mesma requisição feita pelo navegador usa o relatório já calculado
+        response = self.client.get(reverse("relatorio_meses"), self.query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.render(self.query) in response.content.decode("utf-8"))
@@ -7,18 +7,18 @@ urlpatterns = patterns('',
 
      (r'^simples/$', views.simples),
      (r'^ajustes/$', views.ajustes),
-     (r'^despesas/$', views.lista_despesas),
+     url(r'^despesas/$', views.DespesasReportView.as_view(), name="relatorio_despesas"),
      url(r'^vendas_por_mesa/$', views.view_relatorio, kwargs={ "titulo": "Vendas", "tablemakers": [views.vendas_por_mesa] }),
      url(r'^vendas_por_categoria/$', views.view_relatorio, kwargs={ "titulo": "Vendas", "tablemakers": [views.vendas_por_categoria] }),
      url(r'^vendas_por_cidade/$', views.view_relatorio, kwargs={ "titulo": "Vendas", "tablemakers": [views.vendas_por_cidade] }),
      url(r'^vendas_por_dia_da_semana/$', views.view_relatorio, kwargs={ "titulo": "Vendas", "tablemakers": [views.vendas_por_dia_da_semana] }),
-     url(r'^vendas/$', views.view_relatorio, kwargs={ "titulo": "Vendas",
-                                                      "tablemakers": [views.vendas_por_mesa, views.vendas_por_categoria,
-                                                                      views.vendas_por_dia_da_semana, views.vendas_por_cidade]
-                                                     }),
+     url(r'^vendas/$', views.view_relatorio, kwargs={ "titulo": "Vendas", "tablemakers": views.TABELAS_DE_VENDAS }),
      url(r'^pgtos_por_bandeira/$', views.view_relatorio, kwargs={ "titulo": "Pagamentos com cartão", "tablemakers": [views.pgtos_por_bandeira] }),
 
      url(r'^despesas_por_categoria/$', views.DespesasPorCategoriaReportView.as_view()),
 
      url(r'^meses/$', views.MesesReportView.as_view(), name="relatorio_meses"),
+     url(r'^meses/graficos/(?P<grafico>\w+)\.png$', views.grafico_de_meses, name="grafico_de_meses"),
+
+     url(r'^previsao_de_caixa/$', views.PrevisaoDeCaixaReportView.as_view(), name="relatorio_previsao_de_caixa"),
 )
@@ -1,29 +1,33 @@
 # -*- encoding: utf-8 -*-
 import datetime
+import itertools
+import json
 from decimal import Decimal
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import logging
 
-import numpy
-from matplotlib import pyplot
-
 from vestat.caixa.models import Dia, Venda, DespesaDeCaixa, \
     PagamentoComCartao, AjusteDeCaixa, MovimentacaoBancaria, \
     secs_to_time, CategoriaDeMovimentacao
 
 from vestat.caixa.templatetags.vestat_extras import colorir_num
-from vestat.relatorios.forms import RelatorioSimplesForm, AnoFilterForm, DateFilterForm, DateFilterForm2, IntervaloMesesFilterForm
-from vestat.relatorios.reports import Table, Report, TableField
+from vestat.relatorios.forms import RelatorioSimplesForm, AnoFilterForm, DateFilterForm2, IntervaloMesesFilterForm, \
+    PrevisaoDeCaixaFilterForm
 from vestat.django_utils import format_currency, format_date
-from vestat.temp import mkstemp, path2url
 
-from vestat.relatorios.reports2 import Report2, ReportElement
+from vestat.relatorios.reports2 import Report2, ReportElement, iter_csv
 from vestat.relatorios.reports2.elements import Table2, TableField2
+from vestat.relatorios import cache
+from vestat.relatorios.charts import MonthlyRollup, MonthlyRollupMixin, DespesasPorMesChart, \
+    FaturamentoPorMesChart, ResultadoPorMesChart, GRAFICOS_DE_MESES
 
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse, Http404
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.db.models.aggregates import Sum, Avg, Count
+from django.db.models.query import QuerySet
 from django.forms.forms import pretty_name
 from django.views.generic import View
 
@@ -36,6 +40,22 @@ def somar_dict(accum, key, d):
     else:
         accum[key] = d
 
+def csv_response(rows, filename):
+    """
+    Retorna uma resposta que envia as linhas `rows` em CSV à medida que
+    elas são geradas (ver `reports2.iter_csv`), sem montar o arquivo
+    inteiro na memória.
+
+    Argumentos:
+
+        - rows: um iterável de sequências de valores.
+        - filename: o nome do arquivo sugerido pro navegador.
+    """
+
+    response = StreamingHttpResponse(iter_csv(rows), content_type="text/csv; charset=utf-8")
+    response['Content-Disposition'] = 'attachment; filename={0}'.format(filename)
+    return response
+
 class ReportView(View):
     """
     Uma classe abstrata pra uma view de relatório.
@@ -55,6 +75,12 @@ class ReportView(View):
     Classe do formulário de filtragem usado. Deve ser subclasse de `reports.FilterForm`.
     """
 
+    cache_results = False
+    """
+    Se o relatório em HTML deve ser guardado em cache (ver
+    `relatorios.cache`) e reaproveitado enquanto os dados não mudarem.
+    """
+
     def get_raw_data(self):
         """
         Extrai os dados crus a serem filtrados pelo
@@ -62,413 +88,92 @@ class ReportView(View):
         """
         pass
 
-    def get(self, request, *args, **kwargs):
+    def filter(self, query):
         """
-        Extrai os dados crus, filtra se houver um `FilterForm`, cria o
-        objeto `Report` e o renderiza.
+        Retorna uma tupla `(filter_form, data, subtitle)` com o
+        formulário de filtragem preenchido com `query` (ou `None`, se a
+        view não tiver um `FilterForm`), os dados filtrados e o
+        subtítulo do relatório.
         """
         if self.FilterForm:
-            filter_form = self.FilterForm(data=request.GET)
+            filter_form = self.FilterForm(data=query)
 
             if filter_form.is_valid():
                 data = filter_form.filter(self.get_raw_data())
             else:
                 data = []
 
-            subtitle = filter_form.filter_info
+            return filter_form, data, filter_form.filter_info
         else:
-            filter_form = None
-            data = self.get_raw_data()
-            subtitle = ""
-
-        report = self.Report(data)
-        format = request.GET.get("format", "html")
-        report_contents = report.render(format)
-
-        template_name = "report2_view.{0}".format(format)
-
-        response = render_to_response(template_name, {
-              'title': report.title,
-              'subtitle': subtitle,
-              'report_contents': report_contents,
-              'filter_form': filter_form, },
-             context_instance=RequestContext(request))
-
-        if format == "csv":
-            response.mimetype = "text/csv"
-            response['Content-Disposition'] = 'attachment; filename=report.csv'
-
-        return response
-
-
-class DespesasPorMesChart(ReportElement):
-    """
-    Gera gráfico de barras de despesas de cada mês, e uma linha de tendência.
-
-    Gráfico de barras:
-
-    - eixo X -> meses
-    - eixo Y -> total de despesas de cada mês
-
-    """
+            return None, self.get_raw_data(), ""
 
-    title = "Gráfico de despesas"
-
-    def render_html(self):
+    def cache_key(self, filter_form, format, query):
         """
-        Renderiza o gráfico em HTML, usando o matplotlib.
+        Retorna a chave do relatório filtrado por `filter_form` no cache,
+        ou `None` se ele não deve ser guardado: só os relatórios em HTML
+        das views com `cache_results`, e com um filtro válido, são
+        guardados.
 
+        A chave depende dos dados já validados pelo formulário, e não
+        da forma como eles foram escritos em `query`, e da página pedida.
         """
+        if not self.cache_results or format != "html":
+            return None
+        if filter_form is not None and not filter_form.is_valid():
+            return None
 
-        despesas = []
-        xlabels = []
-
-        # monta a lista de despesas totais por mês, iterando pelos anos
-        # e meses dos dias fornecidos como dados crus.
-        for ano in Dia._anos(self.data):
-            for mes in Dia._meses(ano, self.data):
-                dias = Dia._dias(ano, mes, self.data)
-                despesas_total = Dia.despesas_de_caixa_total(dias) + Dia.debitos_bancarios_total(dias)
-                despesas.append(-despesas_total)
-                xlabels.append("{:%m/%Y}".format(datetime.date(ano, mes, 1)))
-
-        # nenhuma despesa => nenhuma imagem
-        if not despesas:
-            return u''
-
-        x_locations = numpy.arange(len(despesas))
-
-        # largura de cada barra (inches)
-        bar_width = 0.5
-        # largura mínima do gráfico (inches)
-        min_width = 4
-        # espaçamento entre uma barra e outra (inches)
-        padding = 0.3
-
-        # ajustes de espaçamento ao redor do gráfico (porcentagem de
-        # width/height)
-        adjustments = {
-            "bottom": 0.1,
-            "left": 0.17,
-        }
-
-        plot_width = max(bar_width * len(despesas), min_width) + sum(adjustments.values())
-
-        figsize = (plot_width, 6)
-
-        try:
-            figure = pyplot.figure(figsize=figsize)
-            ax = figure.add_subplot(111)
-
-            pyplot.subplots_adjust(**adjustments)
-
-            # Gráfico de barras
-            rects = ax.bar(x_locations, despesas, bar_width, color='r')
-
-            # Linha de tendência
-            slope, intercept = numpy.polyfit(x_locations, map(float, despesas), 1)
-            trendline_y = intercept + (slope * x_locations)
-            line = ax.plot(x_locations, trendline_y, color="blue")
-
-            ax.set_ylabel(u"Reais")
-            ax.set_title(u"Despesas totais por mês")
-            ax.set_xticklabels(xlabels)
-
-            # espaçamento à direita de todas as barras
-            ax.set_xticks(x_locations + padding)
-            # espaçamento à esquerda da primeira barra
-            ax.set_xlim([0 - padding, len(despesas)])
-
-            # deixa o eixo Y um pouco maior, pra dar espaço pro rótulo
-            # em cima de cada barra
-            x1, x2, y1, y2 = pyplot.axis()
-            ax.set_ylim(y1, y2 * 1.1)
-
-            # configura rotação e tamanho do rótulo de cada mês no eixo X
-            for label in ax.get_xticklabels():
-                label.set_rotation(45)
-                label.set_rotation_mode("anchor")
-                label.set_verticalalignment("top")
-                label.set_horizontalalignment("right")
-                label.set_size("8")
-
-            def autolabel(ax, rects):
-                """
-                Rotula cada uma das barras com seu valor correspondente
-                (ie total de despesas do mês)
-                """
+        filters = sorted(filter_form.cleaned_data.items()) if filter_form is not None else []
+        return cache.chave(self.Report.__name__, filters, query.get("page"), query.get("size"))
 
-                for rect in rects:
-                    height = rect.get_height()
-
-                    text_x = rect.get_x() + rect.get_width() / 2.0
-
-                    if rect.get_y() < 0:
-                        text_y = -1 * (height + 900)
-                    else:
-                        text_y = height + 400
-
-                    ax.text(text_x, text_y, "{0}".format(format_currency(height)),
-                            ha='center', va='bottom', size='8')
-            autolabel(ax, rects)
-
-            img_file, img_path = mkstemp(suffix=".png")
-            img_url = path2url(img_path)
-            figure.savefig(img_path, format="png")
-
-            return u'<img src="{img_url}" />'.format(img_url=img_url)
-
-        finally:
-            pyplot.close(figure)
-
-
-class FaturamentoPorMesChart(ReportElement):
-    """
-    Gera gráfico de barras de faturamento de cada mês, e uma linha de tendência.
-
-    Gráfico de barras:
-
-    - eixo X -> meses
-    - eixo Y -> faturamento de cada mês
-
-    """
-
-    title = "Gráfico de faturamentos"
-
-    def render_html(self):
+    def render_report(self, filter_form, data, format, query):
         """
-        Renderiza o gráfico em HTML, usando o matplotlib.
-
+        Renderiza o relatório com os dados `data` no formato `format`,
+        paginado de acordo com `query`. Usa o resultado em cache, se
+        houver (ver `cache_key`).
         """
-        faturamentos = []
-        xlabels = []
-
-        # monta a lista de faturamento total por mês, iterando pelos anos
-        # e meses dos dias fornecidos como dados crus.
-        for ano in Dia._anos(self.data):
-            for mes in Dia._meses(ano, self.data):
-                dias = Dia._dias(ano, mes, self.data)
-                faturamento_total = Dia.faturamento_total(dias)
-                faturamentos.append(faturamento_total)
-                xlabels.append("{:%m/%Y}".format(datetime.date(ano, mes, 1)))
-
-        # nenhum faturamento => nenhuma imagem
-        if not faturamentos:
-            return u''
-
-        x_locations = numpy.arange(len(faturamentos))
-
-        # largura de cada barra (inches)
-        bar_width = 0.5
-        # largura mínima do gráfico (inches)
-        min_width = 4
-        # espaçamento entre uma barra e outra (inches)
-        padding = 0.3
-
-        # ajustes de espaçamento ao redor do gráfico (porcentagem de
-        # width/height)
-        adjustments = {
-            "bottom": 0.1,
-            "left": 0.17,
-        }
-
-        plot_width = max(bar_width * len(faturamentos), min_width) + sum(adjustments.values())
-
-        figsize = (plot_width, 6)
+        key = self.cache_key(filter_form, format, query)
+        if key is not None:
+            report_contents = cache.buscar(key)
+            if report_contents is not None:
+                return report_contents
 
-        try:
-            figure = pyplot.figure(figsize=figsize)
-            ax = figure.add_subplot(111)
-
-            pyplot.subplots_adjust(**adjustments)
-
-            # Gráfico de barras
-            rects = ax.bar(x_locations, faturamentos, bar_width, color='g')
-
-            # Linha de tendência
-            slope, intercept = numpy.polyfit(x_locations, map(float, faturamentos), 1)
-            trendline_y = intercept + (slope * x_locations)
-            line = ax.plot(x_locations, trendline_y, color="blue")
-
-            ax.set_ylabel(u"Reais")
-            ax.set_title(u"Faturamento total por mês")
-            ax.set_xticklabels(xlabels)
-
-            # espaçamento à direita de todas as barras
-            ax.set_xticks(x_locations + padding)
-            # espaçamento à esquerda da primeira barra
-            ax.set_xlim([0 - padding, len(faturamentos)])
-
-            # deixa o eixo Y um pouco maior, pra dar espaço pro rótulo
-            # em cima de cada barra
-            x1, x2, y1, y2 = pyplot.axis()
-            ax.set_ylim(y1, y2 * 1.1)
-
-            # configura rotação e tamanho do rótulo de cada mês no eixo X
-            for label in ax.get_xticklabels():
-                label.set_rotation(45)
-                label.set_rotation_mode("anchor")
-                label.set_verticalalignment("top")
-                label.set_horizontalalignment("right")
-                label.set_size("8")
-
-            def autolabel(ax, rects):
-                """
-                Rotula cada uma das barras com seu valor correspondente
-                (ie faturamento do mês)
-                """
-
-                # attach some text labels
-                for rect in rects:
-                    height = rect.get_height()
-
-                    text_x = rect.get_x() + rect.get_width() / 2.0
-
-                    if rect.get_y() < 0:
-                        text_y = -1 * (height + 900)
-                    else:
-                        text_y = height + 400
-
-                    ax.text(text_x, text_y, "{0}".format(format_currency(height)),
-                            ha='center', va='bottom', size='8')
-
-
-            autolabel(ax, rects)
-
-            img_file, img_path = mkstemp(suffix=".png")
-            img_url = path2url(img_path)
-            figure.savefig(img_path, format="png")
-            return u'<img src="{img_url}" />'.format(img_url=img_url)
-
-        finally:
-            pyplot.close(figure)
-
-
-class ResultadoPorMesChart(ReportElement):
-    """
-    Gera gráfico de barras de resultado de cada mês, e uma linha de tendência.
-
-    Gráfico de barras:
+        report = self.Report(data)
+        report.paginate(query)
+        report_contents = report.render(format)
 
-    - eixo X -> meses
-    - eixo Y -> resultado (faturamento menos as despesas) de cada mês
+        if key is not None:
+            cache.guardar(key, report_contents)
 
-    """
+        return report_contents
 
-    title = "Gráfico de resultados"
-
-    def render_html(self):
+    def get(self, request, *args, **kwargs):
         """
-        Renderiza o gráfico em HTML, usando o matplotlib.
-
+        Extrai os dados crus, filtra se houver um `FilterForm`, cria o
+        objeto `Report` e o renderiza.
         """
-        resultados = []
-        xlabels = []
-        colors = []
-
-        # monta a lista de despesas totais por mês, iterando pelos anos
-        # e meses dos dias fornecidos como dados crus.
-        for ano in Dia._anos(self.data):
-            for mes in Dia._meses(ano, self.data):
-                dias = Dia._dias(ano, mes, self.data)
-                resultado_total = Dia.resultado_total(dias)
-                resultados.append(resultado_total)
-                xlabels.append("{:%m/%Y}".format(datetime.date(ano, mes, 1)))
-                colors.append("g" if resultado_total > 0 else "r")
-
-        # nenhum resultado, nenhuma imagem
-        if not resultados:
-            return u''
-
-        x_locations = numpy.arange(len(resultados))
-
-        # largura de cada barra (inches)
-        bar_width = 0.5
-        # largura mínima do gráfico (inches)
-        min_width = 4
-        # espaçamento entre uma barra e outra (inches)
-        padding = 0.3
-
-        # ajustes de espaçamento ao redor do gráfico (porcentagem de
-        # width/height)
-        adjustments = {
-            "bottom": 0.1,
-            "left": 0.17,
-        }
-
-        plot_width = max(bar_width * len(resultados), min_width) + sum(adjustments.values())
-
-        figsize = (plot_width, 6)
-
-        try:
-            figure = pyplot.figure(figsize=figsize)
-            ax = figure.add_subplot(111)
-
-            pyplot.subplots_adjust(**adjustments)
-
-            # Gráfico de barras
-            rects = ax.bar(x_locations, resultados, bar_width, color=colors)
-
-            # Linha de tendência
-            slope, intercept = numpy.polyfit(x_locations, map(float, resultados), 1)
-            trendline_y = intercept + (slope * x_locations)
-            line = ax.plot(x_locations, trendline_y, color="blue")
-
-            ax.set_ylabel(u"Reais")
-            ax.set_title(u"Resultado total por mês")
-            ax.set_xticklabels(xlabels)
-
-            # espaçamento à direita de todas as barras
-            ax.set_xticks(x_locations + padding)
-            # espaçamento à esquerda da primeira barra
-            ax.set_xlim([0 - padding, len(resultados)])
-
-            # deixa o eixo Y um pouco maior, pra dar espaço pro rótulo
-            # em cima de cada barra
-            x1, x2, y1, y2 = pyplot.axis()
-            ax.set_ylim(y1, y2 * 1.1)
-
-            # configura rotação e tamanho do rótulo de cada mês no eixo X
-            for label in ax.get_xticklabels():
-                label.set_rotation(45)
-                label.set_rotation_mode("anchor")
-                label.set_verticalalignment("top")
-                label.set_horizontalalignment("right")
-                label.set_size("8")
-
-            def autolabel(ax, rects):
-                """
-                Rotula cada uma das barras com seu valor correspondente
-                (ie resultado do mês)
-                """
-
-                for rect in rects:
-                    height = rect.get_height()
-
-                    text_x = rect.get_x() + rect.get_width() / 2.0
-
-                    if rect.get_y() < 0:
-                        height *= -1
-                        text_y = height - 500
-                    else:
-                        text_y = height + 200
+        filter_form, data, subtitle = self.filter(request.GET)
+        format = request.GET.get("format", "html")
 
-                    ax.text(text_x, text_y, "{0}".format(format_currency(height)),
-                            ha='center', va='bottom', size='8')
+        if format == "csv":
+            report = self.Report(data)
+            rows = itertools.chain([[report.title, subtitle]], report.iter_rows())
+            return csv_response(rows, "report.csv")
 
+        report_contents = self.render_report(filter_form, data, format, request.GET)
 
-            autolabel(ax, rects)
+        template_name = "report2_view.{0}".format(format)
 
-            img_file, img_path = mkstemp(suffix=".png")
-            img_url = path2url(img_path)
-            figure.savefig(img_path, format="png")
-            return u'<img src="{img_url}" />'.format(img_url=img_url)
+        response = render_to_response(template_name, {
+              'title': self.Report.title,
+              'subtitle': subtitle,
+              'report_contents': report_contents,
+              'filter_form': filter_form, },
+             context_instance=RequestContext(request))
 
-        finally:
-            pyplot.close(figure)
+        return response
 
 
-class MesesReportTable(Table2):
+class MesesReportTable(MonthlyRollupMixin, Table2):
     """
     Tabela pro relatório de meses. Cada linha da tabela exibe a
     consolidação dos dados de cada mês
@@ -492,22 +197,20 @@ class MesesReportTable(Table2):
     @property
     def body(self):
         result = []
-        for ano in Dia._anos(self.data):
-            for mes in Dia._meses(ano, self.data):
-                dias = Dia._dias(ano, mes, self.data)
-                result.append(["%04d-%02d" % (ano, mes),              # mes
-                             Dia.num_pessoas_total(dias),           # num pessoas
-                             Dia.vendas_total(dias),                # vendas
-                             Dia.permanencia_media_total(dias),     # permanencia medi
-                             colorir_num(Dia.faturamento_total(dias)),           # faturamento
-                             colorir_num(Dia.despesas_de_caixa_total(dias)),     # desp cx
-                             colorir_num(Dia.debitos_bancarios_total(dias)),     # banco
-                             colorir_num(Dia.resultado_total(dias)),             # resultado
-                             colorir_num(Dia.captacao_por_pessoa_total(dias)),   # per capita
-                             colorir_num(Dia.gorjeta_total(dias)),               # 10%
-                             ])
+        for ano, mes, resumo in self.get_rollup():
+            result.append(["%04d-%02d" % (ano, mes),                   # mes
+                           resumo.num_pessoas,                          # num pessoas
+                           resumo.vendas,                               # vendas
+                           resumo.permanencia_media(),                  # permanencia medi
+                           colorir_num(resumo.faturamento()),           # faturamento
+                           colorir_num(resumo.despesas_de_caixa),       # desp cx
+                           colorir_num(resumo.debitos_bancarios),       # banco
+                           colorir_num(resumo.resultado()),             # resultado
+                           colorir_num(resumo.captacao_por_pessoa()),   # per capita
+                           colorir_num(resumo.gorjeta()),               # 10%
+                           ])
 
-        return sorted(result, key=lambda r: r[0])
+        return result
 
 
 
@@ -522,11 +225,20 @@ class MesesReport(Report2):
         - Gráfico de barras de resultado por mês
         - Tabela com vários dados por mês.
 
+    Os totais de cada mês são calculados uma vez só, num `MonthlyRollup`
+    compartilhado por todos os elementos.
     """
 
     title="Relatório de meses"
     element_classes = [DespesasPorMesChart, FaturamentoPorMesChart, ResultadoPorMesChart, MesesReportTable]
 
+    def __init__(self, data):
+        Report2.__init__(self, data)
+
+        self.rollup = MonthlyRollup(data)
+        for element in self.elements:
+            element.rollup = self.rollup
+
 
 class MesesReportView(ReportView):
     """
@@ -537,66 +249,119 @@ class MesesReportView(ReportView):
 
     Report = MesesReport
     FilterForm = IntervaloMesesFilterForm
+    cache_results = True
 
     def get_raw_data(self):
         return Dia.objects.all()
 
 
-def lista_despesas(request):
-    def process_data(self, data):
-        def make_row(dia, despesa, tipo):
-            return ["<a href=\"%s\">%02d/%02d/%04d</a>" % (dia.get_absolute_url(),
-                                                           dia.data.day, dia.data.month,
-                                                           dia.data.year),
-                    colorir_num(despesa.valor),
-                    unicode(despesa.categoria),
-                    tipo]
-
-        for dia in data.order_by("data"):
-            for despesa_cx in dia.despesadecaixa_set.all():
-                self.append(make_row(dia, despesa_cx, "Caixa"))
-            for despesa_bc in dia.movimentacaobancaria_set.filter(valor__lt=0):
-                self.append(make_row(dia, despesa_bc, "Banco"))
-
-    table = Table(fields=[
-                TableField("Dia"),
-                TableField("Valor", classes=["currency"]),
-                TableField("Categoria"),
-                TableField("C/B?"),            ],
-            process_data=process_data,
+def grafico_de_meses(request, grafico):
+    """
+    Retorna a imagem PNG de um dos gráficos do relatório de meses (ver
+    `GRAFICOS_DE_MESES`), com os dias filtrados pelos mesmos parâmetros
+    do relatório.
+    """
+
+    if grafico not in GRAFICOS_DE_MESES:
+        raise Http404
+
+    data = request.GET.copy()
+    data.setdefault("format", "html")
+
+    filter_form = IntervaloMesesFilterForm(data=data)
+    if not filter_form.is_valid():
+        raise Http404
+
+    png = GRAFICOS_DE_MESES[grafico](filter_form.filter(Dia.objects.all())).render_png()
+    if png is None:
+        raise Http404
+
+    return HttpResponse(png, content_type="image/png")
+
+
+def total_de_despesas(dias):
+    """
+    Retorna o total das despesas de caixa e das movimentações bancárias
+    negativas dos dias `dias`, somado pelo banco de dados.
+    """
+
+    caixa = DespesaDeCaixa.objects.filter(dia__in=dias).aggregate(Sum("valor"))
+    banco = MovimentacaoBancaria.objects.filter(dia__in=dias, valor__lt=0).aggregate(Sum("valor"))
+    return (caixa["valor__sum"] or 0) + (banco["valor__sum"] or 0)
+
+def linhas_de_despesas(dias):
+    """
+    Gera as linhas do relatório de despesas dos dias `dias`, um dia de
+    cada vez: as despesas de caixa e as movimentações bancárias
+    negativas de cada dia, em ordem de data.
+    """
+
+    def make_row(dia, despesa, tipo):
+        return ["<a href=\"%s\">%02d/%02d/%04d</a>" % (dia.get_absolute_url(),
+                                                       dia.data.day, dia.data.month,
+                                                       dia.data.year),
+                colorir_num(despesa.valor),
+                unicode(despesa.categoria),
+                tipo]
+
+    for dia in dias.order_by("data").iterator():
+        for despesa_cx in dia.despesadecaixa_set.all():
+            yield make_row(dia, despesa_cx, "Caixa")
+        for despesa_bc in dia.movimentacaobancaria_set.filter(valor__lt=0):
+            yield make_row(dia, despesa_bc, "Banco")
+
+class DespesasReportTable(Table2):
+    """
+    Tabela pro relatório de despesas. As linhas são geradas dia a dia
+    (ver `linhas_de_despesas`), então só as linhas da página exibida
+    são lidas do banco de dados.
+    """
+
+    fields = (
+        TableField2("Dia"),
+        TableField2("Valor", classes=["currency"]),
+        TableField2("Categoria"),
+        TableField2("C/B?"),
     )
 
-    filter_form = DateFilterForm(data=request.GET, datefield_name="data")
+    def rows(self):
+        if not isinstance(self.data, QuerySet):
+            return iter(())
+        return linhas_de_despesas(self.data)
 
-    if filter_form.is_valid():
-        report = Report(data=Dia.objects.all(), filters=[filter_form], tables=[table])
-        from_date = filter_form.cleaned_data.get("from_date").strftime(settings.SHORT_DATE_FORMAT_PYTHON)
-        to_date = filter_form.cleaned_data.get("to_date").strftime(settings.SHORT_DATE_FORMAT_PYTHON)
-        title = "Despesas: {from_date} - {to_date}".format(**vars())
-    else:
-        report = None
-        title = "Período inválido"
+    @property
+    def footer(self):
+        if not isinstance(self.data, QuerySet):
+            return tuple()
 
-    if "csv" in request.GET:
-        response = render_to_response('relatorios/report_csv.html', {
-                              'report': report,
-                              'title': title,
-                             },
-                             context_instance=RequestContext(request),
-                             mimetype="text/csv")
+        return [("TOTAL", colorir_num(total_de_despesas(self.data)), "", "")]
 
-        response['Content-Disposition'] = 'attachment; filename=despesas.csv'
-        return response
 
+class DespesasReport(Report2):
+    """
+    Relatório de despesas.
 
-    return render_to_response('relatorios/report.html', {
-                              'report': report,
-                              'title': title,
-                              'filter_form': filter_form,
-                              'voltar_link': '/relatorios/',
-                              'voltar_label': 'Relatórios',
-                             },
-                             context_instance=RequestContext(request))
+    Elementos:
+
+        - Tabela com as despesas de caixa e bancárias de cada dia.
+
+    """
+    title = "Despesas"
+    element_classes = [DespesasReportTable]
+
+
+class DespesasReportView(ReportView):
+    """
+    Class-based view do relatório de despesas. Filtra os dias por data
+    de início e data de fim.
+
+    """
+
+    Report = DespesasReport
+    FilterForm = DateFilterForm2
+
+    def get_raw_data(self):
+        return Dia.objects.all()
 
 def simples(request):
     filtro_form = RelatorioSimplesForm(request.GET)
@@ -759,302 +524,246 @@ def pgtos_por_bandeira(dias):
              "body": body
            }
 
+TABELAS_DE_VENDAS = [vendas_por_mesa, vendas_por_categoria, vendas_por_dia_da_semana, vendas_por_cidade]
+"""
+Tabelas do relatório de vendas.
+"""
 
-class DespesasPorCategoriaCharts(ReportElement):
-    """
-    Gera gráficos de torta sobre o total de despesas, com a porcentagem
-    de cada categoria.
-
-    Gera um gráfico pra 'raiz' (categorias sem mãe), e um gráfico pra
-    cada categoria que tenha filhas, com as porcentagens das despesas
-    das filhas com relação à mãe.
 
+class DespesasPorCategoriaReportTable(Table2):
     """
+    Tabela pro relatório de despesas agrupadas por categoria.
 
-    title = "Gráficos de torta"
-
-    def render_html(self):
-        """
-        Renderiza o gráfico em HTML, usando o matplotlib.
-
-        """
+    """
 
-        def arvore_categorias(categorias):
-            """
-            Retorna uma lista representando a árvore de categorias.
+    title = "Tabela"
 
-            A lista tem como elementos dicionários, cada um
-            representando uma categoria e contendo as seguintes chaves:
+    fields = (
+        TableField2("Categoria"),
+        TableField2("Total", classes=["currency"]),
+        TableField2("Porcentagem das despesas", classes=["percentage"]),
+        TableField2("Porcentagem das vendas", classes=["percentage"]),
+    )
 
-                - nome: o nome da categoria
-                - porcentagem: a porcentagem que essa categoria
-                  contribui pro total de despesas de sua categoria-mãe
-                  (ou pro total de todas as despesas, caso a categoria
-                  não tenha mãe).
-                - filhos: uma lista de dicionários com essas mesmas
-                  chaves, representando as categorias-filhas dessa
-                  categoria.
+    _total_despesas = None
 
-            """
-            despesas = list(DespesaDeCaixa.objects.filter(dia__in=self.data, categoria__in=categorias)) + \
-                    list(MovimentacaoBancaria.objects.filter(dia__in=self.data, valor__lt=0, categoria__in=categorias))
-            total_despesas_das_categorias = Decimal(sum(d.valor for d in despesas))
+    def total_despesas(self):
+        """
+        Retorna o total das despesas de caixa e das movimentações
+        bancárias negativas dos dias da tabela, somado pelo banco de
+        dados.
+        """
 
-            output_total = []
+        if self._total_despesas is None:
+            self._total_despesas = Decimal(total_de_despesas(self.data))
 
-            for categoria in categorias:
-                despesas_da_categoria = [d for d in despesas if d.categoria == categoria]
-                total_despesas_da_categoria = Decimal(sum(d.valor for d in despesas_da_categoria))
+        return self._total_despesas
 
-                output_categoria = {
-                    "nome": categoria.nome,
-                    "porcentagem": total_despesas_da_categoria / total_despesas_das_categorias,
-                }
+    def rows(self):
+        """
+        Gera as linhas da tabela, ordenadas pelo nome completo da
+        categoria. Os totais são somados pelo banco de dados, agrupados
+        por categoria, então o custo não cresce com o número de
+        despesas.
+        """
 
-                output_total.append(output_categoria)
+        total_despesas = self.total_despesas()
 
-                if categoria.filhas.count():
-                    output_categoria["filhos"] = arvore_categorias(list(categoria.filhas.all()))
+        if not total_despesas:
+            return
 
-            output_total.sort(key=lambda c: c["porcentagem"], reverse=True)
+        totais_por_categoria = defaultdict(Decimal)
+        for despesas in [DespesaDeCaixa.objects.filter(dia__in=self.data),
+                         MovimentacaoBancaria.objects.filter(dia__in=self.data, valor__lt=0)]:
+            for categoria_id, total in despesas.order_by().values_list("categoria").annotate(Sum("valor")):
+                totais_por_categoria[categoria_id] += total
 
-            return output_total
+        total_vendas = Decimal(Venda.objects.filter(dia__in=self.data).aggregate(Sum("conta"))["conta__sum"] or 0)
 
-        categorias = CategoriaDeMovimentacao.objects.all()
-        categorias_raiz = [c for c in categorias if not c.mae]
+        def porcentagens(total):
+            return ("{:.2%}".format(abs(total / total_despesas)),
+                    "{:.2%}".format(abs(total / total_vendas)))
 
-        arvore = arvore_categorias(categorias_raiz)
+        # Despesas com `categoria == None`
+        outros = totais_por_categoria.pop(None, Decimal("0"))
+        if outros:
+            logger.debug(u"Total de despesas sem categoria: {0}".format(outros))
 
+        categorias = CategoriaDeMovimentacao.objects.in_bulk(totais_por_categoria.keys())
+        totais = defaultdict(Decimal)
+        totais_outros = defaultdict(Decimal)
 
-        def montar_listas(nome, arvore, listas):
-            """
-            Transforma a árvore de categorias em uma lista de
-            dicionários não-recursiva.
+        for categoria_id, total in totais_por_categoria.items():
+            categoria = categorias[categoria_id]
+            caminho_categorias = [categoria] + categoria.ascendentes
 
-            Cada dicionário dessa lista representa categorias-irmã --
-            categorias que são filhas da mesma mãe, e no caso da raiz,
-            categorias que não têm mãe. Eles possuem as seguintes chaves:
+            for ascendente in caminho_categorias:
+                totais[ascendente] += total
 
-                - mae: o nome da categoria-mãe, ou "Raiz" caso não haja
-                  mãe.
+            # Se a categoria tem filhos, a despesa deve ser categorizada como
+            # "Outros".
+            #
+            # Ex: se há "Fornecedor > Vinhos" e a despesa está como
+            # "Fornecedor", deve ser listada como "Fornecedor > Outros"
 
-                - irmas: uma lista de dicionários, cada um com as
-                  seguintes chaves:
+            if categoria.filhas.count():
+                totais_outros[caminho_categorias[-1]] += total
 
-                    - nome: o nome da categoria
+        linhas = []
+        for categoria, total in totais.items():
+            if categoria.filhas.count():
+                nome = u"{0} - Total".format(categoria.nome_completo)
+            else:
+                nome = categoria.nome_completo
 
-                    - porcentagem: a porcentagem que essa categoria
-                      contribui pro total de despesas de sua categoria-mãe
-                      (ou pro total de todas as despesas, caso a categoria
-                      não tenha mãe).
+            linhas.append((nome, format_currency(total)) + porcentagens(total))
 
-            Categorias com porcentagem menor que a designada na variável
-            `LIMITE` são agrupadas sob o rótulo "Outros", pra evitar que
-            sejam exibidas diversas frações da torta muito pequenas e
-            seus rótulos se embaralhem.
-            """
+            if totais_outros[categoria]:
+                linhas.append((categoria.SEPARADOR.join([categoria.nome_completo, "Outros"]),
+                               format_currency(totais_outros[categoria])) + porcentagens(totais_outros[categoria]))
 
-            LIMITE = Decimal("0.05")
+        if outros:
+            linhas.append((u"Outros", format_currency(outros)) + porcentagens(outros))
 
-            lista = { "mae": nome, "irmas": [] }
-            listas.append(lista)
+        # Ordena por nome completo da categoria
+        for linha in sorted(linhas, key=lambda r: r[0]):
+            yield linha
 
-            for categoria in arvore:
-                if categoria["porcentagem"] > LIMITE:
-                    lista["irmas"].append({ "nome": categoria["nome"], "porcentagem": categoria["porcentagem"] })
-                else:
-                    if lista["irmas"][-1]["nome"] == "Outros":
-                        outros = lista["irmas"][-1]
-                    else:
-                        outros = { "nome": "Outros", "porcentagem": Decimal("0") }
-                        lista["irmas"].append(outros)
+    @property
+    def footer(self):
+        return [("TOTAL", format_currency(self.total_despesas()), "100%", "-")]
 
-                    outros["porcentagem"] += categoria["porcentagem"]
 
-                if "filhos" in categoria:
-                    montar_listas(categoria["nome"], categoria["filhos"], listas)
+class DespesasPorCategoriaReport(Report2):
+    """
+    Relatório de meses.
 
-        listas = []
-        montar_listas("Raiz", arvore, listas)
+    Elementos:
 
-        output = u""
+        - Graficos de torta de totais de despesas por categorias
+        - Tabela de despesas por categoria
 
-        for lista in listas:
-            try:
-                figure = pyplot.figure(figsize=(6, 6))
-                ax = figure.add_subplot(111)
-                labels = [c["nome"] for c in lista["irmas"]]
-                fracs = [c["porcentagem"] for c in lista["irmas"]]
-                ax.pie(fracs, labels=labels, autopct='%1.1f%%', startangle=90)
-                ax.set_title(lista["mae"])
+    """
+    title="Relatório de despesas por categoria"
+    # FIXME: gráficos de torta estão saindo errados
+    #element_classes = [DespesasPorCategoriaCharts, DespesasPorCategoriaReportTable]
+    element_classes = [DespesasPorCategoriaReportTable]
 
-                img_file, img_path = mkstemp(suffix=".png")
-                img_url = path2url(img_path)
-                figure.savefig(img_path, format="png")
-                output += u"<img src=\"{img_url}\" />\n".format(img_url=img_url)
-            finally:
-                pyplot.close(figure)
+class DespesasPorCategoriaReportView(ReportView):
+    """
+    Class-based view do relatório de despesas por categoria. Filtra os
+    dias por data de início e data de fim.
 
-        return output
+    """
 
+    Report = DespesasPorCategoriaReport
+    FilterForm = DateFilterForm2
+    cache_results = True
 
+    def get_raw_data(self):
+        return Dia.objects.all()
 
-class DespesasPorCategoriaReportTable(Table2):
+class PrevisaoDeCaixaTable(Table2):
     """
-    Tabela pro relatório de despesas agrupadas por categoria.
-
+    Tabela do relatório de previsão de caixa. Cada linha exibe um
+    período (dia ou semana) da previsão.
     """
 
-    title = "Tabela"
+    title = "Previsão"
 
     fields = (
-        TableField2("Categoria"),
-        TableField2("Total", classes=["currency"]),
-        TableField2("Porcentagem das despesas", classes=["percentage"]),
-        TableField2("Porcentagem das vendas", classes=["percentage"]),
+        TableField2("Período"),
+        TableField2("Depósitos", classes=["currency"]),
+        TableField2("Débitos lançados", classes=["currency"]),
+        TableField2("Saldo", classes=["currency"]),
     )
 
     @property
     def body(self):
-        despesas = list(DespesaDeCaixa.objects.filter(dia__in=self.data)) + \
-                list(MovimentacaoBancaria.objects.filter(dia__in=self.data, valor__lt=0))
-
-        self._total_despesas = Decimal(sum(d.valor for d in despesas))
-
-        if not self._total_despesas:
-            return []
-
-        vendas = Venda.objects.filter(dia__in=self.data)
-        total_vendas = Decimal(sum(v.conta for v in vendas))
-
-        categoria_dict_dict = {}
-
-        # Acumula despesas com `categoria == None`
-        outros = {
-            "total": Decimal("0"),
-        }
-
-        for despesa in despesas:
-            if despesa.categoria:
-                caminho_categorias = [despesa.categoria] + despesa.categoria.ascendentes
-
-                for categoria in caminho_categorias:
-                    categoria_dict = categoria_dict_dict.setdefault(categoria.slug, {
-                            "total": Decimal("0"),
-                            "outros": {
-                                "total": Decimal("0"),
-                            },
-                    })
-
-                    categoria_dict["total"] += despesa.valor
-
-                categoria_dict = categoria_dict_dict[categoria.slug]
-
-                # Se a categoria tem filhos, a despesa deve ser categorizada como
-                # "Outros".
-                #
-                # Ex: se há "Fornecedor > Vinhos" e a despesa está como
-                # "Fornecedor", deve ser listada como "Fornecedor > Outros"
-
-                if despesa.categoria.filhas.count():
-                    categoria_dict["outros"]["total"] += despesa.valor
+        result = []
+        for ponto in self.data:
+            if ponto.inicio == ponto.fim:
+                periodo = format_date(ponto.inicio)
             else:
-                logger.debug(u"Despesa sem categoria: {0}".format(despesa))
-                outros["total"] += despesa.valor
-
+                periodo = u"{0} - {1}".format(format_date(ponto.inicio), format_date(ponto.fim))
 
-        logger.debug(u"Total de despesas sem categoria: {0}".format(len([d for d in despesas if not d.categoria])))
+            result.append([periodo,
+                           colorir_num(ponto.depositos),
+                           colorir_num(ponto.debitos),
+                           colorir_num(ponto.saldo),
+                           ])
 
+        return result
 
-        # Calcula porcentagem em relação à despesa total
-        for categoria_dict in categoria_dict_dict.values():
-            razao_das_despesas = abs(categoria_dict["total"] / self._total_despesas)
-            razao_das_vendas = abs(categoria_dict["total"] / total_vendas)
 
-            categoria_dict["porcentagem_das_despesas"] = "{:.2%}".format(razao_das_despesas)
-            categoria_dict["porcentagem_das_vendas"] = "{:.2%}".format(razao_das_vendas)
-
-            if categoria_dict["outros"]["total"]:
-                razao_das_despesas = abs(categoria_dict["outros"]["total"] / self._total_despesas)
-                razao_das_vendas = abs(categoria_dict["outros"]["total"] / total_vendas)
+class PrevisaoDeCaixaReport(Report2):
+    """
+    Relatório de previsão de caixa.
 
-                categoria_dict["outros"]["porcentagem_das_despesas"] = "{:.2%}".format(razao_das_despesas)
-                categoria_dict["outros"]["porcentagem_das_vendas"] = "{:.2%}".format(razao_das_vendas)
+    Elementos:
 
+        - Tabela com os depósitos dos cartões, os débitos bancários e o
+          saldo projetado de cada período. Só entram os débitos já
+          lançados nos dias de trabalho.
 
-        razao_das_despesas_outros = abs(outros["total"] / self._total_despesas)
-        razao_das_vendas_outros = abs(outros["total"] / total_vendas)
+    Recebe como dados a lista de `PontoDaPrevisao` calculada por
+    `caixa.previsao.previsao_de_caixa`.
+    """
 
-        outros["porcentagem_das_despesas"] = "{:.2%}".format(razao_das_despesas_outros)
-        outros["porcentagem_das_vendas"] = "{:.2%}".format(razao_das_vendas_outros)
+    title = "Previsão de caixa"
+    element_classes = [PrevisaoDeCaixaTable]
 
 
-        categoria_tuple_list = []
-        for slug, categoria_dict in categoria_dict_dict.items():
-            categoria = CategoriaDeMovimentacao.objects.get(slug=slug)
+class PrevisaoDeCaixaReportView(ReportView):
+    """
+    Class-based view do relatório de previsão de caixa. A previsão
+    começa hoje, a não ser que outra data de início seja fornecida.
 
-            if categoria.filhas.count():
-                nome = u"{0} - Total".format(categoria.nome_completo)
-            else:
-                nome = categoria.nome_completo
+    Além dos formatos dos outros relatórios, aceita ``format=json``,
+    que retorna os pontos da previsão num objeto JSON.
+    """
 
-            categoria_tuple_list.append((
-                nome,
-                format_currency(categoria_dict["total"]),
-                categoria_dict["porcentagem_das_despesas"],
-                categoria_dict["porcentagem_das_vendas"],
-            ))
-
-            if categoria_dict["outros"]["total"]:
-                categoria_tuple_list.append((
-                    categoria.SEPARADOR.join([categoria.nome_completo, "Outros"]),
-                    format_currency(categoria_dict["outros"]["total"]),
-                    categoria_dict["outros"]["porcentagem_das_despesas"],
-                    categoria_dict["outros"]["porcentagem_das_vendas"],
-                ))
-
-        if outros["total"]:
-            categoria_tuple_list.append((
-                u"Outros",
-                format_currency(outros["total"]),
-                outros["porcentagem_das_despesas"],
-                outros["porcentagem_das_vendas"],
-            ))
-
-        return sorted(categoria_tuple_list, key=lambda r: r[0]) # Ordena por nome completo da categoria
+    Report = PrevisaoDeCaixaReport
+    FilterForm = PrevisaoDeCaixaFilterForm
 
-    @property
-    def footer(self):
-        return [("TOTAL", self._total_despesas, "100%", "-")]
+    def get_raw_data(self):
+        return datetime.date.today()
 
+    def get(self, request, *args, **kwargs):
+        if request.GET.get("format") != "json":
+            return super(PrevisaoDeCaixaReportView, self).get(request, *args, **kwargs)
 
-class DespesasPorCategoriaReport(Report2):
-    """
-    Relatório de meses.
+        filter_form = self.FilterForm(data=request.GET)
 
-    Elementos:
+        if not filter_form.is_valid():
+            erros = dict((campo, [unicode(erro) for erro in lista])
+                         for campo, lista in filter_form.errors.items())
+            return HttpResponseBadRequest(json.dumps({"erros": erros}),
+                                          content_type="application/json")
 
-        - Graficos de torta de totais de despesas por categorias
-        - Tabela de despesas por categoria
+        pontos = [ponto._asdict() for ponto in filter_form.filter(self.get_raw_data())]
+        return HttpResponse(json.dumps({"pontos": pontos}, cls=DjangoJSONEncoder),
+                            content_type="application/json")
 
+def tabela_do_relatorio(tablemaker, dias, de=None, ateh=None):
     """
-    title="Relatório de despesas por categoria"
-    # FIXME: gráficos de torta estão saindo errados
-    #element_classes = [DespesasPorCategoriaCharts, DespesasPorCategoriaReportTable]
-    element_classes = [DespesasPorCategoriaReportTable]
+    Retorna a tabela gerada pela função `tablemaker` (e.g.
+    `vendas_por_mesa`) com os dias `dias`, filtrados pelas datas `de` e
+    `ateh`, com os cabeçalhos já formatados.
 
-class DespesasPorCategoriaReportView(ReportView):
+    A tabela fica em cache (ver `relatorios.cache`) enquanto os dados
+    não mudarem, identificada pela função e pelas datas.
     """
-    Class-based view do relatório de despesas por categoria. Filtra os
-    dias por data de início e data de fim.
 
-    """
+    key = cache.chave(tablemaker.__name__, de, ateh)
+    table = cache.buscar(key)
 
-    Report = DespesasPorCategoriaReport
-    FilterForm = DateFilterForm2
+    if table is None:
+        table = tablemaker(dias)
+        table["headers"] = map(pretty_name, table["headers"])
+        cache.guardar(key, table)
 
-    def get_raw_data(self):
-        return Dia.objects.all()
+    return table
 
 def view_relatorio(request, titulo, tablemakers):
     filtro_form = RelatorioSimplesForm(request.GET)
@@ -1074,24 +783,24 @@ def view_relatorio(request, titulo, tablemakers):
     if ateh:
         titulo += ", ateh: " + format_date(ateh)
 
-    tables = []
-    for tablemaker in tablemakers:
-        table = tablemaker(dias)
+    def make_table(tablemaker):
+        return tabela_do_relatorio(tablemaker, dias, de, ateh)
 
-        table["headers"] = map(pretty_name, table["headers"])
+    if "csv" in request.GET:
+        def rows():
+            yield [titulo]
+            for tablemaker in tablemakers:
+                table = make_table(tablemaker)
 
-        tables.append(table)
+                yield []
+                yield [table["title"]]
+                yield table["headers"]
+                for row in itertools.chain(table["body"], table.get("footer") or []):
+                    yield row
 
-    if "csv" in request.GET:
-        response = render_to_response('relatorios/csv.html', {
-                              'title': titulo,
-                              'tables': tables,
-                             },
-                             context_instance=RequestContext(request),
-                             mimetype="text/csv")
+        return csv_response(rows(), "dados_por_mesa.csv")
 
-        response['Content-Disposition'] = 'attachment; filename=dados_por_mesa.csv'
-        return response
+    tables = map(make_table, tablemakers)
 
 
     return render_to_response('relatorios/table.html', {
@@ -1145,14 +854,11 @@ def index(request):
     relatorio_simples_form = RelatorioSimplesForm({'de': inicio_do_mes.strftime("%d/%m/%Y"),
                                                    'ateh': hoje.strftime("%d/%m/%Y"), })
     ano_filter_form = AnoFilterForm(initial={"ano": hoje.strftime("%Y")}, datefield_name="data")
-    date_filter_form = DateFilterForm(initial={
-                                        "from_date": inicio_do_mes.strftime("%d/%m/%Y"),
-                                        "to_date": hoje.strftime("%d/%m/%Y"),
-                                      }, datefield_name="data")
     date_filter_form2 = DateFilterForm2(initial={
                                         "from_date": inicio_do_mes.strftime("%d/%m/%Y"),
                                         "to_date": hoje.strftime("%d/%m/%Y"),
                                       }, datefield_name="data")
+    previsao_de_caixa_form = PrevisaoDeCaixaFilterForm()
 
 
     return render_to_response('relatorios/index.html', {
@@ -1160,8 +866,8 @@ def index(request):
                                 'relatorio_simples_form': relatorio_simples_form,
                                 'relatorio_meses_form': relatorio_meses_form,
                                 'ano_filter_form': ano_filter_form,
-                                'date_filter_form': date_filter_form,
                                 'date_filter_form2': date_filter_form2,
+                                'previsao_de_caixa_form': previsao_de_caixa_form,
                                   'voltar_link': '/',
                                   'voltar_label': 'Módulos',
                              },
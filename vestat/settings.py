@@ -162,6 +162,8 @@ MIDDLEWARE_CLASSES = (
     'vestat.middleware.ExceptionLoggerMiddleware',
     'vestat.middleware.AutologinMiddleware',
     'vestat.caixa.middleware.AutocreateRegistroMiddleware',
+    'vestat.middleware.AdiarVersaoDosDadosMiddleware',
+    'vestat.caixa.middleware.AdiarResumosMiddleware',
 )
 
 TEMPLATE_CONTEXT_PROCESSORS = (
@@ -194,3 +196,32 @@ INSTALLED_APPS = (
     'django.contrib.auth',
     'django.contrib.staticfiles',
 )
+
+# Quantas threads usar pra rodar os geradores de eventos do calendário
+# (calendario.core.get_events). Com 1, os geradores rodam em série.
+CALENDARIO_THREADS = 1
+
+# Quantas threads usar pra desenhar os gráficos de um relatório enquanto
+# as tabelas são renderizadas
+# (relatorios.reports2.Report2.render_elements). Com 1, os elementos são
+# renderizados em série.
+RELATORIOS_THREADS = 2
+
+# Cache dos relatórios pré-calculados (relatorios.cache) e da versão dos
+# dados (vestat.versao), compartilhado entre o servidor e os comandos. O "default"
+# continua sendo o cache em memória padrão do Django.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'relatorios': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(DATA_DIR, 'cache_relatorios'),
+        'TIMEOUT': 7 * 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# Os testes usam caches em memória no lugar dos de cima
+# (vestat.test_runner), pra não ler nem gravar o cache de verdade.
+TEST_RUNNER = 'vestat.test_runner.VestatTestRunner'
@@ -6,6 +6,7 @@ visíveis via HTTP -- imagens, por exemplo.
 """
 
 import os
+import hashlib
 import logging
 import tempfile
 from datetime import datetime, timedelta
@@ -47,6 +48,14 @@ def path2url(path):
     )
 
 
+def fingerprint(key):
+    """
+    Retorna um hash (hexadecimal) que identifica o valor `key`, a partir
+    da sua representação (`repr`).
+    """
+
+    return hashlib.sha1(repr(key)).hexdigest()
+
 def clear(older_than=86400):
     """
     Limpa os arquivos temporários antigos.
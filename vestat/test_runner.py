@@ -0,0 +1,34 @@
+# -*- encoding: utf-8 -*-
+"""
+Executor dos testes do Vestat (ver `settings.TEST_RUNNER`).
+"""
+
+from django.conf import settings
+from django.test.simple import DjangoTestSuiteRunner
+
+CACHES_DE_TESTE = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "relatorios": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                   "LOCATION": "relatorios-testes"},
+}
+"""
+Caches usados durante os testes: todos em memória, pra que os testes
+não leiam nem gravem os caches em disco do `DATA_DIR` (o cache dos
+relatórios, por exemplo), que são os do programa de verdade.
+"""
+
+
+class VestatTestRunner(DjangoTestSuiteRunner):
+    """
+    O executor padrão do Django, trocando os caches das configurações
+    pelos `CACHES_DE_TESTE` enquanto os testes rodam.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(VestatTestRunner, self).setup_test_environment(**kwargs)
+        self._caches = settings.CACHES
+        settings.CACHES = CACHES_DE_TESTE
+
+    def teardown_test_environment(self, **kwargs):
+        settings.CACHES = self._caches
+        super(VestatTestRunner, self).teardown_test_environment(**kwargs)
@@ -0,0 +1,126 @@
+# -*- encoding: utf-8 -*-
+"""
+Versão dos dados do caixa e da contabilidade.
+
+A versão é um identificador que muda sempre que um objeto das
+aplicações em `APPS_DOS_DADOS` é salvo ou removido. Quem guarda
+resultados calculados a partir desses dados (os relatórios em cache,
+ver `relatorios.cache`, e os eventos do calendário, ver
+`calendario.core`) guarda também a versão, e descarta o resultado
+quando ela muda.
+
+A versão fica no cache ``relatorios`` (ver `settings.CACHES`), em disco,
+pra que seja a mesma no servidor e nos comandos. Dentro de uma
+requisição (ver `middleware.AdiarVersaoDosDadosMiddleware`) ou de um
+bloco `adiar_nova_versao`, ela muda uma vez só, no fim.
+"""
+
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import get_cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+CACHE = "relatorios"
+"""
+Nome do cache (em `settings.CACHES`) em que a versão fica guardada.
+"""
+
+CHAVE_DA_VERSAO = "versao_dos_dados"
+"""
+Chave em que a versão dos dados fica guardada no cache.
+"""
+
+APPS_DOS_DADOS = ("caixa", "contabil")
+"""
+Aplicações cujos modelos entram nos relatórios.
+"""
+
+MODELOS_DERIVADOS = ("caixa.ResumoDiario", "contabil.SaldoCheckpoint")
+"""
+Modelos das `APPS_DOS_DADOS` que só guardam valores calculados a partir
+dos outros modelos, criados até quando os dados são só lidos (e.g. os
+checkpoints criados pelo `Registro.balanco`). Salvá-los não troca a
+versão dos dados.
+"""
+
+def nova_versao_dos_dados():
+    """
+    Troca a versão dos dados por uma nova, invalidando todos os
+    resultados guardados com a versão antiga. Deve ser chamada depois
+    de alterar os dados sem disparar os sinais do Django -- com
+    `QuerySet.update`, por exemplo.
+    """
+
+    versao = uuid.uuid4().hex
+    get_cache(CACHE).set(CHAVE_DA_VERSAO, versao)
+    return versao
+
+def versao_dos_dados():
+    """
+    Retorna a versão atual dos dados, criando uma nova se não houver
+    nenhuma no cache.
+    """
+
+    versao = get_cache(CACHE).get(CHAVE_DA_VERSAO)
+    if versao is None:
+        versao = nova_versao_dos_dados()
+    return versao
+
+_adiada = threading.local()
+"""
+Se a versão dos dados deve mudar no fim do bloco `adiar_nova_versao`
+aberto em cada thread (`None` fora de um bloco).
+"""
+
+@contextmanager
+def adiar_nova_versao():
+    """
+    Gerenciador de contexto que junta as trocas de versão dos dados
+    feitas por `dados_alterados` dentro do bloco `with` numa só, no fim
+    do bloco -- um dia recalculado, por exemplo, remove e insere vários
+    objetos, e cada troca é uma escrita no cache em disco.
+
+    Blocos aninhados fazem parte do bloco de fora. A versão muda mesmo
+    se o bloco terminar com uma exceção, já que parte dos dados pode
+    ter sido gravada.
+    """
+
+    if getattr(_adiada, "pendente", None) is not None:
+        yield
+        return
+
+    _adiada.pendente = False
+    try:
+        yield
+    finally:
+        pendente, _adiada.pendente = _adiada.pendente, None
+        if pendente:
+            nova_versao_dos_dados()
+
+@receiver(post_save, dispatch_uid="nova_versao_dos_dados")
+@receiver(post_delete, dispatch_uid="nova_versao_dos_dados")
+def dados_alterados(sender, raw=False, **kwargs):
+    """
+    Troca a versão dos dados quando um objeto das aplicações em
+    `APPS_DOS_DADOS` é salvo ou removido, ou marca a troca pro fim do
+    bloco `adiar_nova_versao` em andamento.
+
+    Objetos carregados de fixtures/dumps (``raw``) são ignorados, pra não
+    gravar uma versão nova pra cada objeto; quem carrega os dados deve
+    chamar `nova_versao_dos_dados` no fim. Objetos dos
+    `MODELOS_DERIVADOS` também são ignorados.
+    """
+
+    if raw or sender._meta.app_label not in APPS_DOS_DADOS:
+        return
+
+    if "{0}.{1}".format(sender._meta.app_label, sender._meta.object_name) in MODELOS_DERIVADOS:
+        return
+
+    if getattr(_adiada, "pendente", None) is not None:
+        _adiada.pendente = True
+    else:
+        nova_versao_dos_dados()